@@ -0,0 +1,689 @@
+import argparse
+import asyncio
+import csv
+import gc
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from array import array
+from collections import Counter
+from contextlib import redirect_stdout
+from datetime import date, timedelta
+
+from library_server import MAX_GROUP_COMMIT, LibraryServer
+from library_storage import BOOKS_FILE, ISSUED_BOOKS_FILE, MEMBERS_FILE, _write_json_records_atomic
+from library_system import (Book, BookSearchIndex, CatalogStorage, ColumnarCatalog, JsonStorage, LibraryError,
+                            LibrarySystem)
+
+AUTHOR_COUNT = 5000
+TITLE_WORDS = ["Clean", "Code", "Atomic", "Habits", "History", "Of", "The", "Silent", "Patient",
+               "Data", "Systems", "Design", "Never", "Lie", "Sapiens", "Brief", "Time", "Art",
+               "War", "Peace", "Night", "River", "Garden", "Secret", "Modern", "Python"]
+NAME_SYLLABLES = ["ha", "ra", "ri", "mc", "fad", "den", "son", "ber", "gen", "lo", "vic", "mar", "tin", "el",
+                  "ka", "no", "wa", "ski", "dell", "ov", "an", "to", "li", "ne", "stro", "quist"]
+LOAN_EPOCH = date(2026, 1, 1)  # synthetic due dates fall in the 60 days after this
+
+
+class _UnslottedBook:
+    # The Book layout before __slots__: a per-instance __dict__ for every record.
+    def __init__(self, title, author, isbn, quantity):
+        self._title = title
+        self._author = author
+        self._isbn = isbn
+        self._total_quantity = quantity
+        self._available_quantity = quantity
+
+
+def _isbn(i):
+    return f"978-{i:010d}"
+
+
+def synthetic_books(count, seed=42):
+    # Deterministic catalog records in the books.json format.
+    rng = random.Random(seed)
+    authors = [f"Author {i:05d}" for i in range(AUTHOR_COUNT)]
+    for i in range(count):
+        quantity = rng.randint(1, 20)
+        yield {
+            "title": " ".join(rng.choice(TITLE_WORDS) for _ in range(rng.randint(1, 4))) + f" {i}",
+            "author": rng.choice(authors),
+            "isbn": _isbn(i),
+            "total_quantity": quantity,
+            "available_quantity": quantity
+        }
+
+
+def synthetic_members(count, faculty_share=0.2, first_id=1001, seed=42):
+    # Deterministic Student/Faculty records in the members.json format.
+    rng = random.Random(seed)
+    departments = ["CSE", "EEE", "ME", "CE", "Physics", "Maths", "History", "Biology"]
+    for i in range(count):
+        if rng.random() < faculty_share:
+            yield {"member_id": first_id + i, "name": f"Faculty {i}", "type": "Faculty",
+                   "department": rng.choice(departments)}
+        else:
+            yield {"member_id": first_id + i, "name": f"Student {i}", "type": "Student",
+                   "student_id": f"S{i:08d}"}
+
+
+def write_dataset(data_dir, books, members, loans, faculty_share=0.2, seed=42):
+    # Writes books.json, members.json and issued_books.json the way JsonStorage saves them,
+    # with up to `loans` outstanding loans that respect stock and borrowing limits. Records are
+    # regenerated and streamed to disk rather than held in memory, so 10M-record catalogs fit.
+    rng = random.Random(seed)
+    available = array('i', (book["available_quantity"] for book in synthetic_books(books, seed)))
+    limits = array('b', (10 if member["type"] == "Faculty" else 3
+                         for member in synthetic_members(members, faculty_share, seed=seed)))
+    held = array('b', bytes(members))
+    issued = {}
+    for _ in range(loans if books and members else 0):
+        member = rng.randrange(members)
+        book = rng.randrange(books)
+        if held[member] < limits[member] and available[book] > 0:
+            available[book] -= 1
+            held[member] += 1
+            due_date = LOAN_EPOCH + timedelta(days=rng.randrange(60))
+            issued.setdefault(str(1001 + member), []).append({"isbn": _isbn(book), "due_date": due_date.isoformat()})
+
+    _write_json_records_atomic(os.path.join(data_dir, BOOKS_FILE),
+                               (dict(book, available_quantity=available[i]) for i, book in enumerate(synthetic_books(books, seed))))
+    _write_json_records_atomic(os.path.join(data_dir, MEMBERS_FILE), {
+        "students": (m for m in synthetic_members(members, faculty_share, seed=seed) if m["type"] == "Student"),
+        "faculty": (m for m in synthetic_members(members, faculty_share, seed=seed) if m["type"] == "Faculty")})
+    with open(os.path.join(data_dir, ISSUED_BOOKS_FILE), 'w') as f:
+        json.dump(issued, f, indent=4)
+    return {"books": books, "members": members, "loans": sum(held)}
+
+
+def _measure(build, text):
+    # Bytes still allocated after parsing the JSON text and building the store from it,
+    # i.e. what a catalog loaded from books.json keeps resident.
+    gc.collect()
+    tracemalloc.start()
+    store = build(json.loads(text))
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del store
+    gc.collect()
+    return current
+
+
+def memory_benchmark(count):
+    # Resident catalog size for each storage layout, measured with tracemalloc.
+    text = json.dumps(list(synthetic_books(count)))
+
+    def build_unslotted(records):
+        return {d["isbn"]: _UnslottedBook(d["title"], d["author"], d["isbn"], d["total_quantity"]) for d in records}
+
+    def build_slotted(records):
+        return {d["isbn"]: Book.from_dict(d) for d in records}
+
+    def build_columnar(records):
+        catalog = ColumnarCatalog()
+        for d in records:
+            catalog[d["isbn"]] = Book.from_dict(d)
+        return catalog
+
+    results = {"books": count}
+    for name, build in (("dict_objects", build_unslotted), ("slotted_objects", build_slotted), ("columnar", build_columnar)):
+        results[name] = {"bytes": _measure(build, text)}
+    baseline = results["dict_objects"]["bytes"]
+    for name in ("dict_objects", "slotted_objects", "columnar"):
+        results[name]["bytes_per_book"] = round(results[name]["bytes"] / count, 1)
+        results[name]["vs_dict_objects"] = round(results[name]["bytes"] / baseline, 3)
+    return results
+
+
+def _peak_rss_kb():
+    # VmHWM belongs to this process image alone; ru_maxrss also remembers the parent's peak
+    # from before the spawn's exec, which hides footprints smaller than the parent's.
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _startup_run(data_dir, streaming, trusted, lazy, catalog, queue):
+    # Runs in a fresh process so the peak RSS reflects this load alone.
+    start = time.perf_counter()
+    if catalog:
+        library = LibrarySystem(storage=CatalogStorage(data_dir))
+    else:
+        library = LibrarySystem(storage=JsonStorage(data_dir, streaming=streaming, trusted=trusted, lazy=lazy))
+    elapsed = time.perf_counter() - start
+    queue.put({"seconds": round(elapsed, 3), "peak_rss_kb": _peak_rss_kb(),
+               "books": len(library._books)})
+
+
+def startup_benchmark(books, members, loans):
+    # Startup time and peak RSS of LibrarySystem for each JSON loading mode.
+    # The first lazy open builds the offset indexes, and the first read-only open builds books.cat;
+    # the second of each shows the steady-state startup.
+    variants = {"json_load_validated": (False, False, False, False), "streaming_validated": (True, False, False, False),
+                "streaming_trusted": (True, True, False, False), "lazy_index_build": (True, False, True, False),
+                "lazy": (True, False, True, False), "mapped_catalog_build": (True, False, False, True),
+                "mapped_catalog": (True, False, False, True)}
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as data_dir:
+        results = {"dataset": write_dataset(data_dir, books, members, loans)}
+        results["books_json_bytes"] = os.path.getsize(os.path.join(data_dir, BOOKS_FILE))
+        for name, (streaming, trusted, lazy, catalog) in variants.items():
+            queue = context.Queue()
+            process = context.Process(target=_startup_run, args=(data_dir, streaming, trusted, lazy, catalog, queue))
+            process.start()
+            results[name] = queue.get()
+            process.join()
+    return results
+
+
+def _snapshot_run(data_dir, snapshot_format, compress, queue):
+    # Converts the JSON dataset to the format under test, then times a fresh load and a full save.
+    storage = JsonStorage(data_dir, snapshot_format=snapshot_format, compress=compress)
+    LibrarySystem(storage=storage)._save_data(force=True)
+    del storage
+    gc.collect()
+    start = time.perf_counter()
+    library = LibrarySystem(storage=JsonStorage(data_dir, snapshot_format=snapshot_format, compress=compress))
+    load_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    library._save_data(force=True)
+    save_seconds = time.perf_counter() - start
+    files = [name for name in os.listdir(data_dir) if name.endswith((".json", ".snap")) and name != "library_meta.json"]
+    queue.put({"load_seconds": round(load_seconds, 3), "save_seconds": round(save_seconds, 3),
+               "bytes": sum(os.path.getsize(os.path.join(data_dir, name)) for name in files),
+               "peak_rss_kb": _peak_rss_kb()})
+
+
+def snapshot_benchmark(books, members, loans):
+    # Load and save time and on-disk size of the three stores as JSON and as binary snapshots.
+    variants = {"json": ("json", False), "binary": ("binary", False), "binary_zlib": ("binary", True)}
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as data_dir:
+        results = {"dataset": write_dataset(data_dir, books, members, loans)}
+        for name, (snapshot_format, compress) in variants.items():
+            queue = context.Queue()
+            process = context.Process(target=_snapshot_run, args=(data_dir, snapshot_format, compress, queue))
+            process.start()
+            results[name] = queue.get()
+            process.join()
+    for name in ("binary", "binary_zlib"):
+        results[name]["load_speedup"] = round(results["json"]["load_seconds"] / results[name]["load_seconds"], 2)
+        results[name]["save_speedup"] = round(results["json"]["save_seconds"] / results[name]["save_seconds"], 2)
+    return results
+
+
+def write_import_csv(path, count, duplicate_share=0.05, invalid_share=0.01, seed=42):
+    # A CSV catalog dump: synthetic books, some repeating an earlier ISBN and some invalid rows.
+    rng = random.Random(seed)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["title", "author", "isbn", "quantity"])
+        for i, book in enumerate(synthetic_books(count, seed)):
+            roll = rng.random()
+            if roll < invalid_share:
+                writer.writerow([book["title"], "", book["isbn"], "-1"])
+            else:
+                isbn = _isbn(rng.randrange(i)) if i and roll < invalid_share + duplicate_share else book["isbn"]
+                writer.writerow([book["title"], book["author"], isbn, book["total_quantity"]])
+
+
+def _import_run(csv_path, workers, queue):
+    with tempfile.TemporaryDirectory() as data_dir:
+        library = LibrarySystem(data_dir=data_dir)
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            result = library.import_catalog(csv_path, workers)
+    queue.put({"seconds": round(result["seconds"], 3), "rows_per_sec": round(result["rows"] / result["seconds"]),
+               "added": result["added"], "merged": result["merged"], "rejected": len(result["rejected"])})
+
+
+def import_benchmark(rows, worker_counts):
+    # Bulk-import throughput of one CSV dump for each validation pool size, including the final save.
+    context = multiprocessing.get_context("spawn")
+    results = {"rows": rows, "cpus": os.cpu_count()}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_path = os.path.join(tmp_dir, "catalog.csv")
+        write_import_csv(csv_path, rows)
+        for workers in worker_counts:
+            queue = context.Queue()
+            process = context.Process(target=_import_run, args=(csv_path, workers, queue))
+            process.start()
+            results[f"workers_{workers}"] = queue.get()
+            process.join()
+    base = results[f"workers_{worker_counts[0]}"]["seconds"]
+    for workers in worker_counts:
+        results[f"workers_{workers}"]["speedup"] = round(base / results[f"workers_{workers}"]["seconds"], 2)
+    return results
+
+
+def _fsck_run(data_dir, workers, queue):
+    start = time.perf_counter()
+    library = LibrarySystem(storage=JsonStorage(data_dir, trusted=True))
+    load_seconds = time.perf_counter() - start
+    report = library.check_integrity(workers=workers)
+    queue.put({"load_seconds": round(load_seconds, 3), "check_seconds": round(report["seconds"], 3),
+               "loans_per_sec": round(report["checked"]["loans"] / report["seconds"]),
+               "problems": len(report["problems"]), "peak_rss_kb": _peak_rss_kb()})
+
+
+def fsck_benchmark(books, members, loans, worker_counts):
+    # check_integrity time for each pool size, over a dataset saved as binary snapshots so that
+    # loading it stays a small part of each run.
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as data_dir:
+        results = {"dataset": write_dataset(data_dir, books, members, loans), "cpus": os.cpu_count()}
+        LibrarySystem(storage=JsonStorage(data_dir, trusted=True, snapshot_format="binary"))._save_data(force=True)
+        for workers in worker_counts:
+            queue = context.Queue()
+            process = context.Process(target=_fsck_run, args=(data_dir, workers, queue))
+            process.start()
+            results[f"workers_{workers}"] = queue.get()
+            process.join()
+    return results
+
+
+def _shard_run(data_dir, shards, ops, seed, queue):
+    # Issue and return latency (one journal append each, to at most two shards), the compaction
+    # that follows them, and search latency, for one shard count (0: the unsharded JsonStorage).
+    rng = random.Random(seed)
+    results = {}
+    for step in ("first_load_seconds", "load_seconds"):
+        # The first sharded start also splits the dataset.
+        start = time.perf_counter()
+        with redirect_stdout(open(os.devnull, 'w')):
+            library = LibrarySystem(data_dir=data_dir, shards=shards or None, trusted_load=True)
+        results[step] = round(time.perf_counter() - start, 3)
+    books, members = len(library._books), len(library._members)
+    loans = []
+    while len(loans) < ops:
+        member_id, isbn = 1001 + rng.randrange(members), _isbn(rng.randrange(books))
+        if (library._books[isbn].get_available_quantity() > len(library._books[isbn].get_holds())
+                and len(library._issued_books.get(member_id, [])) < library._members[member_id].get_max_books_allowed()
+                and (member_id, isbn) not in loans):
+            loans.append((member_id, isbn))
+    issued = []
+
+    def issue(i):
+        try:
+            library.process_issue(*loans[i])
+            issued.append(loans[i])
+        except LibraryError:
+            pass
+
+    # With no spare copies or borrowing room there is nothing to issue, and so nothing to time.
+    if loans:
+        results["issue_book"] = _timed(issue, len(loans))
+    if issued:
+        results["return_book"] = _timed(lambda i: library.process_return(*issued[i]), len(issued))
+    start = time.perf_counter()
+    library.compact()
+    results["compact_seconds"] = round(time.perf_counter() - start, 3)
+    terms = [rng.choice(TITLE_WORDS) + " " + rng.choice(TITLE_WORDS) for _ in range(ops)]
+    library.find_books("warm up")
+    results["search_top20"] = _timed(lambda i: library.find_books(terms[i], 20), ops)
+    queue.put(results)
+
+
+def shard_benchmark(books, members, loans, shard_counts, ops=500):
+    # Every shard count starts from a fresh copy of the same dataset, which the first
+    # ShardedStorage start splits into shard directories.
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as source:
+        results = {"dataset": write_dataset(source, books, members, loans), "cpus": os.cpu_count()}
+        for shards in shard_counts:
+            with tempfile.TemporaryDirectory() as data_dir:
+                for name in (BOOKS_FILE, MEMBERS_FILE, ISSUED_BOOKS_FILE):
+                    shutil.copy(os.path.join(source, name), data_dir)
+                queue = context.Queue()
+                process = context.Process(target=_shard_run, args=(data_dir, shards, ops, 42, queue))
+                process.start()
+                results[f"shards_{shards}" if shards else "unsharded"] = queue.get()
+                process.join()
+    return results
+
+
+def _misspell(word, rng):
+    # Drops, doubles or swaps one letter, the way patrons mistype names.
+    i = rng.randrange(1, len(word) - 1)
+    edit = rng.randrange(3)
+    if edit == 0:
+        return word[:i] + word[i + 1:]
+    if edit == 1:
+        return word[:i] + word[i] + word[i:]
+    return word[:i - 1] + word[i] + word[i - 1] + word[i + 1:]
+
+
+def fuzzy_benchmark(count, queries=1000, seed=42):
+    # Typo-tolerant search latency on a catalog whose authors have made-up surnames, so the
+    # vocabulary is as varied as a real one. Each query is a misspelt surname from the catalog.
+    rng = random.Random(seed)
+    surnames = sorted({"".join(rng.choice(NAME_SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+                       for _ in range(AUTHOR_COUNT * 10)})
+    index = BookSearchIndex()
+    authors = []
+    for book in synthetic_books(count, seed):
+        author = f"{rng.choice(surnames)[:1]}. {rng.choice(surnames)}"
+        authors.append(author)
+        index.add(Book(book["title"], author, book["isbn"], book["total_quantity"]))
+    start = time.perf_counter()
+    index.search("warm up")
+    build_seconds = time.perf_counter() - start
+    terms = [_misspell(rng.choice(authors).split()[-1], rng) for _ in range(queries)]
+    results = {"books": count, "vocabulary": len(index._exact), "index_seconds": round(build_seconds, 3),
+               "fuzzy_top20": _timed(lambda i: index.fuzzy_search(terms[i], 20), queries),
+               "fuzzy_page3": _timed(lambda i: index.fuzzy_search(terms[i], 20, 40), queries),
+               "exact_top20": _timed(lambda i: index.search(terms[i], 20), queries)}
+    results["fuzzy_hit_rate"] = round(sum(bool(index.fuzzy_search(term, 1)) for term in terms) / queries, 3)
+    return results
+
+
+def _latency_stats(samples):
+    # Latency percentiles in milliseconds and throughput for one operation's timed runs.
+    ordered = sorted(samples)
+    total = sum(ordered)
+
+    def percentile(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 3)
+
+    return {"runs": len(ordered), "p50_ms": percentile(0.50), "p90_ms": percentile(0.90),
+            "p99_ms": percentile(0.99), "max_ms": round(ordered[-1] * 1000, 3),
+            "mean_ms": round(total / len(ordered) * 1000, 3),
+            "ops_per_sec": round(len(ordered) / total, 1) if total else None}
+
+
+def _timed(fn, runs):
+    samples = []
+    for i in range(runs):
+        start = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - start)
+    return _latency_stats(samples)
+
+
+def _suite_run(data_dir, ops, repeat, lazy, columnar, seed, queue):
+    # The non-interactive driver: the process_* API the menus are built on, the menu
+    # listing with its output discarded, and the storage load/save entry points.
+    # Runs in a fresh process so the peak RSS reflects the suite alone.
+    rng = random.Random(seed)
+    library = LibrarySystem(data_dir=data_dir, lazy=lazy, columnar=columnar)
+    books, members = len(library._books), len(library._members)
+    results = {}
+    results["load_data"] = _timed(lambda i: library._load_data(), repeat)
+    results["save_data"] = _timed(lambda i: library._save_data(force=True), repeat)
+
+    terms = [rng.choice(TITLE_WORDS) + (" " + rng.choice(TITLE_WORDS) if rng.random() < 0.5 else "")
+             for _ in range(ops // 2)]
+    terms += [f"Author {rng.randrange(AUTHOR_COUNT):05d}" for _ in range(ops - len(terms))]
+    rng.shuffle(terms)
+    results["search_book"] = _timed(lambda i: library.find_books(terms[i], 20), ops)
+
+    # Issue to members with room left, books with copies left; the picks happen outside the timing.
+    # A small catalog or a busy one may have fewer such pairs than ops, so the picking is capped
+    # by the spare copies and the spare borrowing room, and gives up after a bounded number of tries.
+    spare_copies = sum(max(book.get_available_quantity() - len(book.get_holds()), 0) for book in library._books.values())
+    spare_room = sum(max(member.get_max_books_allowed() - len(library._issued_books.get(member_id, [])), 0)
+                     for member_id, member in library._members.items())
+    target = min(ops, members, spare_copies, spare_room)
+    loans, planned_loans, planned_copies = [], Counter(), Counter()
+    for _ in range(100 * target):
+        if len(loans) >= target:
+            break
+        member_id = 1001 + rng.randrange(members)
+        isbn = _isbn(rng.randrange(books))
+        member, book = library._members.get(member_id), library._books.get(isbn)
+        if member is None or book is None:
+            continue
+        if (book.get_available_quantity() - planned_copies[isbn] > len(book.get_holds())
+                and len(library._issued_books.get(member_id, [])) + planned_loans[member_id] < member.get_max_books_allowed()):
+            loans.append((member_id, isbn))
+            planned_loans[member_id] += 1
+            planned_copies[isbn] += 1
+    issued, failures = [], []
+
+    def issue(i):
+        try:
+            library.process_issue(*loans[i])
+            issued.append(loans[i])
+        except LibraryError as e:
+            failures.append(str(e))
+
+    # With no spare copies or borrowing room there is nothing to issue, and so nothing to time.
+    if loans:
+        results["issue_book"] = _timed(issue, len(loans))
+    if issued:
+        results["return_book"] = _timed(lambda i: library.process_return(*issued[i]), len(issued))
+    results["add_member"] = _timed(lambda i: library.process_add_member(
+        "Student", f"Bench Student {i}", student_id=f"BENCH-{i:08d}") if i % 5 else library.process_add_member(
+        "Faculty", f"Bench Faculty {i}", department="Benchmarks"), ops)
+    with open(os.devnull, 'w') as devnull:
+        # The full member listing, which the menu now pages through; export() streams all of it.
+        results["view_all_members"] = _timed(lambda i: library.export("members", devnull), repeat)
+    queue.put({"results": results, "peak_rss_kb": _peak_rss_kb(), "issue_failures": len(failures)})
+
+
+def benchmark_suite(books, members, loans, faculty_share=0.2, seed=42, ops=1000, repeat=3, lazy=False, columnar=False):
+    # Generates a synthetic dataset and times the hot paths against it; deterministic for a given seed.
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as data_dir:
+        start = time.perf_counter()
+        dataset = write_dataset(data_dir, books, members, loans, faculty_share, seed)
+        generate_seconds = time.perf_counter() - start
+        queue = context.Queue()
+        process = context.Process(target=_suite_run, args=(data_dir, ops, repeat, lazy, columnar, seed, queue))
+        process.start()
+        run = queue.get()
+        process.join()
+    return {"config": {"books": books, "members": members, "loans": loans, "faculty_share": faculty_share,
+                       "seed": seed, "ops": ops, "repeat": repeat, "lazy": lazy, "columnar": columnar,
+                       "python": sys.version.split()[0]},
+            "dataset": dataset, "generate_seconds": round(generate_seconds, 3), **run}
+
+
+def compare_to_baseline(report, baseline, tolerance):
+    # Flags every operation whose p50 or p99 latency grew by more than `tolerance` (0.2 = 20%).
+    comparison = {}
+    for name, stats in report["results"].items():
+        before = baseline.get("results", {}).get(name)
+        if not before:
+            continue
+        entry = {}
+        for metric in ("p50_ms", "p99_ms"):
+            if before[metric]:
+                entry[f"{metric[:3]}_ratio"] = round(stats[metric] / before[metric], 3)
+        entry["regressed"] = any(ratio > 1 + tolerance for ratio in entry.values())
+        comparison[name] = entry
+    if baseline.get("config") != report["config"]:
+        print("Warning: the baseline was recorded with a different configuration.", file=sys.stderr)
+    return comparison
+
+
+def _server_run(data_dir, max_group, queue):
+    # Serves the dataset on a free port until the parent terminates the process.
+    server = LibraryServer(LibrarySystem(data_dir=data_dir), port=0, max_group=max_group)
+
+    async def serve():
+        await server.start()
+        queue.put(server.get_port())
+        await server.serve_forever()
+
+    asyncio.run(serve())
+
+
+async def _http_request(reader, writer, method, path, body=None):
+    # One request on a keep-alive connection; returns (status, decoded JSON body).
+    data = b"" if body is None else json.dumps(body).encode()
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(data)}\r\n\r\n".encode() + data)
+    head = await reader.readuntil(b"\r\n\r\n")
+    length = next(int(line.split(b":", 1)[1]) for line in head.split(b"\r\n") if line.lower().startswith(b"content-length:"))
+    return int(head.split(b" ", 2)[1]), json.loads(await reader.readexactly(length))
+
+
+async def _load_client(port, requests, write_share, books, members, seed, samples, statuses):
+    # Searches and ISBN lookups, plus issues that the next write of this client returns again.
+    rng = random.Random(seed)
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    borrowed = []
+    try:
+        for _ in range(requests):
+            if rng.random() < write_share:
+                kind, method = "write", "POST"
+                if borrowed:
+                    path, body = "/return", borrowed.pop()
+                else:
+                    path, body = "/issue", {"member_id": 1001 + rng.randrange(members), "isbn": _isbn(rng.randrange(books))}
+            else:
+                kind, method, body = "read", "GET", None
+                path = f"/books?q={rng.choice(TITLE_WORDS)}" if rng.random() < 0.5 else f"/books/{_isbn(rng.randrange(books))}"
+            start = time.perf_counter()
+            status, _ = await _http_request(reader, writer, method, path, body)
+            samples[kind].append(time.perf_counter() - start)
+            statuses[status] += 1
+            if path == "/issue" and status == 200:
+                borrowed.append(body)
+    finally:
+        writer.close()
+
+
+def server_load_test(books, members, loans, concurrency=64, requests=20000, write_share=0.2,
+                     max_group=MAX_GROUP_COMMIT, seed=42):
+    # Requests/sec of library_server.py under `concurrency` keep-alive clients, with the
+    # server in its own process and the group-commit sizes it reached.
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as data_dir:
+        dataset = write_dataset(data_dir, books, members, loans, seed=seed)
+        queue = context.Queue()
+        process = context.Process(target=_server_run, args=(data_dir, max_group, queue))
+        process.start()
+        try:
+            port = queue.get(timeout=600)
+            samples, statuses = {"read": [], "write": []}, Counter()
+
+            async def run_clients():
+                start = time.perf_counter()
+                await asyncio.gather(*(_load_client(port, requests // concurrency + (i < requests % concurrency),
+                                                    write_share, books, members, seed + i, samples, statuses)
+                                       for i in range(concurrency)))
+                elapsed = time.perf_counter() - start
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                _, server_stats = await _http_request(reader, writer, "GET", "/stats")
+                writer.close()
+                return elapsed, server_stats
+
+            elapsed, server_stats = asyncio.run(run_clients())
+        finally:
+            process.terminate()
+            process.join()
+    completed = len(samples["read"]) + len(samples["write"])
+    return {"config": {"books": books, "members": members, "loans": loans, "concurrency": concurrency,
+                       "requests": requests, "write_share": write_share, "max_group": max_group, "seed": seed},
+            "dataset": dataset, "seconds": round(elapsed, 3), "requests_per_sec": round(completed / elapsed, 1),
+            "statuses": {str(status): count for status, count in sorted(statuses.items())},
+            "reads": _latency_stats(samples["read"]) if samples["read"] else None,
+            "writes": _latency_stats(samples["write"]) if samples["write"] else None,
+            "write_groups": server_stats["groups"],
+            "mean_group_size": round(server_stats["writes"] / server_stats["groups"], 2) if server_stats["groups"] else None,
+            "largest_group": server_stats["largest_group"]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Library Management System benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    memory_parser = subparsers.add_parser("memory", help="catalog memory footprint per storage layout")
+    memory_parser.add_argument("--books", type=int, default=1_000_000)
+    startup_parser = subparsers.add_parser("startup", help="LibrarySystem startup time per JSON loading mode")
+    startup_parser.add_argument("--books", type=int, default=1_000_000)
+    startup_parser.add_argument("--members", type=int, default=100_000)
+    startup_parser.add_argument("--loans", type=int, default=100_000)
+    snapshot_parser = subparsers.add_parser("snapshot", help="load/save time and size of JSON vs binary snapshots")
+    snapshot_parser.add_argument("--books", type=int, default=1_000_000)
+    snapshot_parser.add_argument("--members", type=int, default=100_000)
+    snapshot_parser.add_argument("--loans", type=int, default=100_000)
+    import_parser = subparsers.add_parser("import", help="bulk CSV import throughput per number of worker processes")
+    import_parser.add_argument("--rows", type=int, default=500_000)
+    import_parser.add_argument("--workers", default="1,2,4", help="comma-separated pool sizes to compare")
+    fsck_parser = subparsers.add_parser("fsck", help="integrity check time per number of worker processes")
+    fsck_parser.add_argument("--books", type=int, default=1_000_000)
+    fsck_parser.add_argument("--members", type=int, default=3_000_000)
+    fsck_parser.add_argument("--loans", type=int, default=10_000_000)
+    fsck_parser.add_argument("--workers", default="1,2,4", help="comma-separated pool sizes to compare")
+    fuzzy_parser = subparsers.add_parser("fuzzy", help="typo-tolerant search latency on a large catalog")
+    fuzzy_parser.add_argument("--books", type=int, default=1_000_000)
+    fuzzy_parser.add_argument("--queries", type=int, default=1000)
+    shard_parser = subparsers.add_parser("shards", help="write, compaction and search latency per number of shards")
+    shard_parser.add_argument("--books", type=int, default=1_000_000)
+    shard_parser.add_argument("--members", type=int, default=100_000)
+    shard_parser.add_argument("--loans", type=int, default=100_000)
+    shard_parser.add_argument("--shards", default="0,4,16", help="comma-separated shard counts to compare (0: unsharded)")
+    shard_parser.add_argument("--ops", type=int, default=500, help="timed runs per issue/return/search")
+    suite_parser = subparsers.add_parser("suite", help="latency, throughput and peak RSS of the hot paths")
+    suite_parser.add_argument("--books", type=int, default=100_000)
+    suite_parser.add_argument("--members", type=int, default=10_000)
+    suite_parser.add_argument("--loans", type=int, default=10_000)
+    suite_parser.add_argument("--faculty-share", type=float, default=0.2, help="fraction of members who are faculty")
+    suite_parser.add_argument("--seed", type=int, default=42)
+    suite_parser.add_argument("--ops", type=int, default=1000, help="timed runs per search/issue/return/add_member")
+    suite_parser.add_argument("--repeat", type=int, default=3, help="timed runs per load/save/view_all_members")
+    suite_parser.add_argument("--lazy", action="store_true")
+    suite_parser.add_argument("--columnar", action="store_true")
+    suite_parser.add_argument("--output", help="also write the report to this file")
+    suite_parser.add_argument("--baseline", help="report to compare against; exits 1 on a regression")
+    suite_parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown before flagging (default 0.2)")
+    server_parser = subparsers.add_parser("server", help="requests/sec of library_server.py under concurrent clients")
+    server_parser.add_argument("--books", type=int, default=100_000)
+    server_parser.add_argument("--members", type=int, default=10_000)
+    server_parser.add_argument("--loans", type=int, default=10_000)
+    server_parser.add_argument("--concurrency", type=int, default=64, help="keep-alive client connections")
+    server_parser.add_argument("--requests", type=int, default=20_000)
+    server_parser.add_argument("--write-share", type=float, default=0.2, help="fraction of requests that issue or return")
+    server_parser.add_argument("--max-group", type=int, default=MAX_GROUP_COMMIT, help="most writes persisted together")
+    server_parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    if args.command == "suite":
+        report = benchmark_suite(args.books, args.members, args.loans, args.faculty_share, args.seed,
+                                 args.ops, args.repeat, args.lazy, args.columnar)
+        if args.baseline:
+            with open(args.baseline) as f:
+                report["comparison"] = compare_to_baseline(report, json.load(f), args.tolerance)
+        text = json.dumps(report, indent=4)
+        print(text)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(text + "\n")
+        if any(entry["regressed"] for entry in report.get("comparison", {}).values()):
+            sys.exit(1)
+    elif args.command == "memory":
+        print(json.dumps(memory_benchmark(args.books), indent=4))
+    elif args.command == "startup":
+        print(json.dumps(startup_benchmark(args.books, args.members, args.loans), indent=4))
+    elif args.command == "snapshot":
+        print(json.dumps(snapshot_benchmark(args.books, args.members, args.loans), indent=4))
+    elif args.command == "import":
+        worker_counts = [int(workers) for workers in args.workers.split(",")]
+        print(json.dumps(import_benchmark(args.rows, worker_counts), indent=4))
+    elif args.command == "fsck":
+        worker_counts = [int(workers) for workers in args.workers.split(",")]
+        print(json.dumps(fsck_benchmark(args.books, args.members, args.loans, worker_counts), indent=4))
+    elif args.command == "shards":
+        shard_counts = [int(shards) for shards in args.shards.split(",")]
+        print(json.dumps(shard_benchmark(args.books, args.members, args.loans, shard_counts, args.ops), indent=4))
+    elif args.command == "fuzzy":
+        print(json.dumps(fuzzy_benchmark(args.books, args.queries), indent=4))
+    elif args.command == "server":
+        print(json.dumps(server_load_test(args.books, args.members, args.loans, args.concurrency, args.requests,
+                                          args.write_share, args.max_group, args.seed), indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+import bisect
+from datetime import date, timedelta
+
+from library_models import Faculty
+
+class TopCounter:
+    # Counts that only ever go up by one, kept in buckets by count with the distinct counts in
+    # ascending order, so an increment is O(1) (plus a bisect over the few distinct counts) and
+    # the k highest are read straight off the top buckets in O(k).
+    def __init__(self):
+        self._counts = {}   # key -> count
+        self._buckets = {}  # count -> {key: None}, in the order the keys reached that count
+        self._order = []    # the distinct counts, ascending
+
+    def increment(self, key):
+        count = self._counts.get(key, 0)
+        if count:
+            self._discard(key, count)
+        self._add(key, count + 1)
+
+    def _add(self, key, count):
+        self._counts[key] = count
+        bucket = self._buckets.get(count)
+        if bucket is None:
+            bucket = self._buckets[count] = {}
+            bisect.insort(self._order, count)
+        bucket[key] = None
+
+    def _discard(self, key, count):
+        bucket = self._buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[count]
+            del self._order[bisect.bisect_left(self._order, count)]
+
+    def get(self, key):
+        return self._counts.get(key, 0)
+
+    def top(self, k):
+        # (key, count) pairs, highest count first; ties in the order they reached the count.
+        top = []
+        for count in reversed(self._order):
+            for key in self._buckets[count]:
+                if len(top) == k:
+                    return top
+                top.append((key, count))
+        return top
+
+    def items(self):
+        return self._counts.items()
+
+    def load(self, counts):
+        self.clear()
+        for key, count in sorted(counts, key=lambda item: item[1]):
+            self._add(key, count)
+
+    def clear(self):
+        self._counts.clear()
+        self._buckets.clear()
+        self._order.clear()
+
+class SortedRanking:
+    # Entries kept sorted in blocks of up to 2 * BLOCK, so adding or removing one moves at most a
+    # block's worth of references instead of the whole list, and the k largest are read straight
+    # off the last blocks in O(k).
+    BLOCK = 512
+
+    def __init__(self, entries=()):
+        entries = sorted(entries)
+        self._blocks = [entries[i:i + self.BLOCK] for i in range(0, len(entries), self.BLOCK)]
+        self._maxes = [block[-1] for block in self._blocks]  # each block's last entry, for bisecting
+
+    def add(self, entry):
+        if not self._blocks:
+            self._blocks.append([entry])
+            self._maxes.append(entry)
+            return
+        i = min(bisect.bisect_left(self._maxes, entry), len(self._blocks) - 1)
+        block = self._blocks[i]
+        bisect.insort(block, entry)
+        self._maxes[i] = block[-1]
+        if len(block) > 2 * self.BLOCK:
+            self._blocks[i:i + 1] = [block[:self.BLOCK], block[self.BLOCK:]]
+            self._maxes[i:i + 1] = [block[self.BLOCK - 1], block[-1]]
+
+    def remove(self, entry):
+        i = bisect.bisect_left(self._maxes, entry)
+        block = self._blocks[i]
+        del block[bisect.bisect_left(block, entry)]
+        if block:
+            self._maxes[i] = block[-1]
+        else:
+            del self._blocks[i]
+            del self._maxes[i]
+
+    def largest(self, k):
+        # The k largest entries, largest first.
+        top = []
+        for block in reversed(self._blocks):
+            for entry in reversed(block):
+                if len(top) == k:
+                    return top
+                top.append(entry)
+        return top
+
+class CirculationStats:
+    # Circulation analytics, kept current by LibrarySystem._apply_change as books are issued,
+    # returned and stocked, so reports never rescan the books, members or loans: how often each
+    # title and member has borrowed, issues and returns per faculty department and per day and
+    # ISO week, and per-author utilization (copies out over copies owned).
+    def __init__(self):
+        self._titles = TopCounter()   # isbn -> times issued
+        self._members = TopCounter()  # member_id -> books borrowed
+        self._departments = {}        # faculty department -> [issues, returns]
+        self._daily = {}              # ISO date -> [issues, returns]
+        self._weekly = {}             # ISO week, e.g. "2026-W42" -> [issues, returns]
+        # author -> [copies owned, copies out]. The counts follow the catalog rather than the
+        # event history, so they are built from the books on first use instead of being saved,
+        # and again whenever the catalog has been reloaded since. _ranking holds (utilization,
+        # author) for the authors owning copies, so a report reads the top k off its end.
+        self._authors = None
+        self._authors_source = None
+        self._ranking = None
+
+    @staticmethod
+    def week_of(day):
+        year, week, _ = date.fromisoformat(day).isocalendar()
+        return f"{year}-W{week:02d}"
+
+    def issued(self, isbn, member, day):
+        self._event(0, member, day)
+        self._titles.increment(isbn)
+        if member is not None:
+            self._members.increment(member.get_member_id())
+
+    def returned(self, member, day):
+        self._event(1, member, day)
+
+    def _event(self, column, member, day):
+        # Loans made before due dates existed cannot be dated, so they stay out of the rollups.
+        if day is not None:
+            for rollup, period in ((self._daily, day), (self._weekly, self.week_of(day))):
+                counts = rollup.get(period)
+                if counts is None:
+                    counts = rollup[period] = [0, 0]
+                counts[column] += 1
+        if isinstance(member, Faculty):
+            counts = self._departments.setdefault(member.get_department(), [0, 0])
+            counts[column] += 1
+
+    def stock_changed(self, author, owned, out):
+        if self._authors is not None:
+            counts = self._authors.setdefault(author, [0, 0])
+            if counts[0]:
+                self._ranking.remove((counts[1] / counts[0], author))
+            counts[0] += owned
+            counts[1] += out
+            if counts[0]:
+                self._ranking.add((counts[1] / counts[0], author))
+
+    def book_changed(self, old, new):
+        # Moves a book's copies from its old record's author counts to its new one's.
+        if old is not None:
+            self.stock_changed(old.get_author(), -old.get_total_quantity(),
+                               old.get_available_quantity() - old.get_total_quantity())
+        self.stock_changed(new.get_author(), new.get_total_quantity(),
+                           new.get_total_quantity() - new.get_available_quantity())
+
+    def top_titles(self, k):
+        return self._titles.top(k)
+
+    def top_members(self, k):
+        return self._members.top(k)
+
+    def title_issues(self, isbn):
+        return self._titles.get(isbn)
+
+    def departments(self):
+        return {department: {"issues": issues, "returns": returns, "on_loan": issues - returns}
+                for department, (issues, returns) in self._departments.items()}
+
+    def rollup(self, period, count, today=None):
+        # Issues and returns for the last `count` days or ISO weeks, most recent first.
+        today = today or date.today()
+        if period == "daily":
+            keys = [(today - timedelta(days=i)).isoformat() for i in range(count)]
+            since = today - timedelta(days=count - 1)
+        elif period == "weekly":
+            keys = [self.week_of((today - timedelta(weeks=i)).isoformat()) for i in range(count)]
+            since = today - timedelta(days=today.weekday(), weeks=count - 1)
+        else:
+            raise ValueError(f"Unknown rollup period '{period}'.")
+        rollup = self._period_counts(period, since)
+        return [{"period": key, "issues": rollup.get(key, (0, 0))[0], "returns": rollup.get(key, (0, 0))[1]}
+                for key in keys]
+
+    def _period_counts(self, period, since):
+        # {day or week: [issues, returns]}, covering at least the periods from the date since on.
+        return self._daily if period == "daily" else self._weekly
+
+    def utilization(self, books, author=None, k=10):
+        # One author's utilization, or the k most utilized authors.
+        if self._authors is None or self._authors_source is not books:
+            authors = {}
+            for book in books.values():
+                counts = authors.setdefault(book.get_author(), [0, 0])
+                counts[0] += book.get_total_quantity()
+                counts[1] += book.get_total_quantity() - book.get_available_quantity()
+            self._authors = authors
+            self._authors_source = books
+            self._ranking = SortedRanking((out / owned, author) for author, (owned, out) in authors.items() if owned)
+        if author is not None:
+            owned, out = self._authors.get(author, (0, 0))
+            return {"author": author, "owned": owned, "out": out, "utilization": out / owned if owned else 0.0}
+        return [{"author": author, "owned": self._authors[author][0], "out": self._authors[author][1],
+                 "utilization": ratio} for ratio, author in self._ranking.largest(k)]
+
+    def backfill(self, library):
+        # One-time start for data that predates the analytics: every outstanding loan counts as
+        # one issue, dated by its due date less the member's loan period.
+        self.clear()
+        issue_days = {}
+        for member_id in library._issued_books:
+            member = library._members.get(member_id)
+            period = member.get_loan_period_days() if member is not None else 0
+            for isbn, due_date in library.get_loans(member_id):
+                day = None
+                if due_date:
+                    day = issue_days.get((due_date, period))
+                    if day is None:
+                        day = issue_days[(due_date, period)] = (date.fromisoformat(due_date) - timedelta(days=period)).isoformat()
+                self.issued(isbn, member, day)
+
+    def to_dict(self):
+        return {"version": 1, "titles": dict(self._titles.items()),
+                "members": {str(member_id): count for member_id, count in self._members.items()},
+                "departments": self._departments, "daily": self._daily}
+
+    def load(self, data):
+        if data.get("version") != 1:
+            raise ValueError(f"Unsupported analytics version {data.get('version')}.")
+        self.clear()
+        self._titles.load(data["titles"].items())
+        self._members.load((int(member_id), count) for member_id, count in data["members"].items())
+        self._departments = {department: list(counts) for department, counts in data["departments"].items()}
+        self._daily = {day: list(counts) for day, counts in data["daily"].items()}
+        for day, (issues, returns) in self._daily.items():
+            counts = self._weekly.setdefault(self.week_of(day), [0, 0])
+            counts[0] += issues
+            counts[1] += returns
+
+    def clear(self):
+        self._titles.clear()
+        self._members.clear()
+        self._departments = {}
+        self._daily = {}
+        self._weekly = {}
+
+class SQLiteCirculationStats(CirculationStats):
+    # CirculationStats counterpart kept in the analytics_* tables. LibrarySystem._apply_change
+    # runs inside the mutation's transaction, so each counter moves in the same transaction as
+    # the change it counts: the counts survive restarts, and every desk sees the others' events.
+    # Author utilization is ranked by an index on copies out over copies owned.
+    SCHEMA = """
+        CREATE TABLE analytics_titles (isbn TEXT UNIQUE NOT NULL, issues INTEGER NOT NULL);
+        CREATE INDEX analytics_titles_top ON analytics_titles(issues DESC);
+        CREATE TABLE analytics_members (member_id INTEGER UNIQUE NOT NULL, issues INTEGER NOT NULL);
+        CREATE INDEX analytics_members_top ON analytics_members(issues DESC);
+        CREATE TABLE analytics_departments (department TEXT PRIMARY KEY, issues INTEGER NOT NULL, returns INTEGER NOT NULL);
+        CREATE TABLE analytics_daily (day TEXT PRIMARY KEY, issues INTEGER NOT NULL, returns INTEGER NOT NULL);
+        CREATE TABLE analytics_authors (author TEXT PRIMARY KEY, owned INTEGER NOT NULL, copies_out INTEGER NOT NULL);
+        CREATE INDEX analytics_authors_top ON analytics_authors(CAST(copies_out AS REAL) / owned DESC, author DESC)
+            WHERE owned > 0
+    """
+    TABLES = ("analytics_titles", "analytics_members", "analytics_departments", "analytics_daily", "analytics_authors")
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    @classmethod
+    def create(cls, conn):
+        # Creates the tables if the database predates them; returns whether it did.
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'analytics_titles'").fetchone():
+            return False
+        for statement in cls.SCHEMA.split(";"):
+            conn.execute(statement)
+        return True
+
+    def issued(self, isbn, member, day):
+        self._event(0, member, day)
+        self._increment("analytics_titles", "isbn", isbn)
+        if member is not None:
+            self._increment("analytics_members", "member_id", member.get_member_id())
+
+    def _increment(self, table, column, key):
+        # REPLACE gives the row the highest rowid, so ties rank in the order the keys reached
+        # their count, as in TopCounter.
+        self._conn.execute(f"INSERT OR REPLACE INTO {table} ({column}, issues) "
+                           f"VALUES (?, COALESCE((SELECT issues FROM {table} WHERE {column} = ?), 0) + 1)", (key, key))
+
+    def _event(self, column, member, day):
+        counts = (1, 0) if column == 0 else (0, 1)
+        if day is not None:
+            self._conn.execute("INSERT INTO analytics_daily (day, issues, returns) VALUES (?, ?, ?) ON CONFLICT(day) "
+                               "DO UPDATE SET issues = issues + excluded.issues, returns = returns + excluded.returns",
+                               (day, *counts))
+        if isinstance(member, Faculty):
+            self._conn.execute("INSERT INTO analytics_departments (department, issues, returns) VALUES (?, ?, ?) "
+                               "ON CONFLICT(department) DO UPDATE SET issues = issues + excluded.issues, "
+                               "returns = returns + excluded.returns", (member.get_department(), *counts))
+
+    def stock_changed(self, author, owned, out):
+        if owned or out:
+            self._conn.execute("INSERT INTO analytics_authors (author, owned, copies_out) VALUES (?, ?, ?) "
+                               "ON CONFLICT(author) DO UPDATE SET owned = owned + excluded.owned, "
+                               "copies_out = copies_out + excluded.copies_out", (author, owned, out))
+
+    def _top(self, table, column, k):
+        return [tuple(row) for row in self._conn.execute(
+            f"SELECT {column}, issues FROM {table} ORDER BY issues DESC, rowid LIMIT ?", (k,))]
+
+    def top_titles(self, k):
+        return self._top("analytics_titles", "isbn", k)
+
+    def top_members(self, k):
+        return self._top("analytics_members", "member_id", k)
+
+    def title_issues(self, isbn):
+        row = self._conn.execute("SELECT issues FROM analytics_titles WHERE isbn = ?", (isbn,)).fetchone()
+        return row[0] if row else 0
+
+    def departments(self):
+        return {department: {"issues": issues, "returns": returns, "on_loan": issues - returns}
+                for department, issues, returns in self._conn.execute("SELECT * FROM analytics_departments")}
+
+    def _period_counts(self, period, since):
+        days = self._conn.execute("SELECT day, issues, returns FROM analytics_daily WHERE day >= ?", (since.isoformat(),))
+        if period == "daily":
+            return {day: (issues, returns) for day, issues, returns in days}
+        weekly = {}
+        for day, issues, returns in days:
+            counts = weekly.setdefault(self.week_of(day), [0, 0])
+            counts[0] += issues
+            counts[1] += returns
+        return weekly
+
+    def utilization(self, books, author=None, k=10):
+        if author is not None:
+            owned, out = self._conn.execute("SELECT owned, copies_out FROM analytics_authors WHERE author = ?",
+                                            (author,)).fetchone() or (0, 0)
+            return {"author": author, "owned": owned, "out": out, "utilization": out / owned if owned else 0.0}
+        return [{"author": author, "owned": owned, "out": out, "utilization": out / owned}
+                for author, owned, out in self._conn.execute(
+                    "SELECT author, owned, copies_out FROM analytics_authors WHERE owned > 0 "
+                    "ORDER BY CAST(copies_out AS REAL) / owned DESC, author DESC LIMIT ?", (k,))]
+
+    def backfill(self, library):
+        super().backfill(library)
+        self._count_authors()
+
+    def load(self, data):
+        # Takes over a JSON desk's counters, e.g. when migrating to SQLite.
+        if data.get("version") != 1:
+            raise ValueError(f"Unsupported analytics version {data.get('version')}.")
+        self.clear()
+        for table, column, counts in (("analytics_titles", "isbn", data["titles"]),
+                                      ("analytics_members", "member_id", data["members"])):
+            self._conn.executemany(f"INSERT INTO {table} ({column}, issues) VALUES (?, ?)",
+                                   sorted(counts.items(), key=lambda item: item[1]))
+        self._conn.executemany("INSERT INTO analytics_departments VALUES (?, ?, ?)",
+                               ((department, *counts) for department, counts in data["departments"].items()))
+        self._conn.executemany("INSERT INTO analytics_daily VALUES (?, ?, ?)",
+                               ((day, *counts) for day, counts in data["daily"].items()))
+        self._count_authors()
+
+    def _count_authors(self):
+        self._conn.execute("DELETE FROM analytics_authors")
+        self._conn.execute("INSERT INTO analytics_authors (author, owned, copies_out) "
+                           "SELECT author, SUM(total_quantity), SUM(total_quantity - available_quantity) FROM books GROUP BY author")
+
+    def clear(self):
+        for table in self.TABLES:
+            self._conn.execute(f"DELETE FROM {table}")
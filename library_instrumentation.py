@@ -0,0 +1,200 @@
+import atexit
+import cProfile
+import functools
+import inspect
+import json
+import os
+import time
+import tracemalloc
+import types
+from collections import Counter
+
+from library_models import Book, Faculty, Student
+from library_storage import JsonStorage, ShardedStorage
+
+STATS_ENV = 'LIBRARY_STATS'
+STATS_DUMP_INTERVAL = 60
+
+class Instrumentation:
+    # Opt-in per-operation metrics for a LibrarySystem: calls, failures and time spent in every
+    # operation (each public method except the menus that wait on input() and the generators and
+    # context managers, which return before doing their work; loading, as "load", with the records'
+    # from_dict validation inside it as "load_from_dict"; and the storage's persist and compact),
+    # bytes written per store, and optional cProfile/tracemalloc sampling of chosen operations.
+    # Nothing is wrapped unless it is attached, so a disabled system pays nothing.
+    def __init__(self, path=None, interval=STATS_DUMP_INTERVAL):
+        # path receives the metrics in Prometheus text format every `interval` seconds and at exit.
+        self._path = path
+        self._interval = interval
+        self._next_dump = time.monotonic() + interval
+        # operation -> [calls, failures, total seconds, slowest call in seconds]
+        self._operations = {}
+        self._bytes_written = Counter()
+        # operation -> [mode, every, calls seen]; sampled results per operation.
+        self._profiles = {}
+        self._profilers = {}
+        self._allocations = {}
+        self._profiling = False
+        if path:
+            atexit.register(self.dump)
+
+    @classmethod
+    def from_env(cls, environ=None):
+        # LIBRARY_STATS=path enables instrumentation; LIBRARY_STATS_INTERVAL sets the dump period and
+        # LIBRARY_PROFILE=op[:mode],... (every LIBRARY_PROFILE_EVERY-th call) samples operations.
+        environ = os.environ if environ is None else environ
+        if not environ.get(STATS_ENV):
+            return None
+        instrumentation = cls(environ[STATS_ENV], float(environ.get("LIBRARY_STATS_INTERVAL", STATS_DUMP_INTERVAL)))
+        for spec in filter(None, environ.get("LIBRARY_PROFILE", "").split(",")):
+            operation, _, mode = spec.strip().partition(":")
+            instrumentation.profile(operation, mode or "cprofile", int(environ.get("LIBRARY_PROFILE_EVERY", 1)))
+        return instrumentation
+
+    def attach(self, library):
+        # Shadows the operations with timed wrappers on the instances themselves. Private helpers
+        # are left alone: they run inside an operation that is already timed.
+        menus = type(library).MENU_METHODS
+        for cls in reversed(type(library).__mro__):
+            for name, value in vars(cls).items():
+                if (isinstance(value, types.FunctionType) and not name.startswith("_") and name not in menus
+                        and not inspect.isgeneratorfunction(inspect.unwrap(value))):
+                    setattr(library, name, self._wrap(name, getattr(library, name)))
+        library._load_data = self._wrap_load(library._load_data)
+        storage = library._storage
+        for name in ("persist", "compact"):
+            setattr(storage, name, self._wrap(f"storage_{name}", getattr(storage, name)))
+        if isinstance(storage, (JsonStorage, ShardedStorage)):
+            storage._stats = self
+
+    def _wrap_load(self, load_data):
+        # Loading is timed as a whole, and the from_dict calls that validate each record while it
+        # runs as an operation of their own. The record classes' from_dict is shadowed for the
+        # duration of the load only.
+        load = self._wrap("load", load_data)
+        originals = {cls: vars(cls)["from_dict"] for cls in (Book, Student, Faculty)}
+        timed = {cls: classmethod(self._wrap("load_from_dict", method.__func__)) for cls, method in originals.items()}
+
+        @functools.wraps(load_data)
+        def wrapper():
+            for cls, method in timed.items():
+                cls.from_dict = method
+            try:
+                return load()
+            finally:
+                for cls, method in originals.items():
+                    cls.from_dict = method
+        return wrapper
+
+    def _wrap(self, name, method):
+        stats = self._operations.setdefault(name, [0, 0, 0.0, 0.0])
+        profiles = self._profiles
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            failed = True
+            start = time.perf_counter()
+            try:
+                if name in profiles and not self._profiling:
+                    result = self._sample(name, method, args, kwargs)
+                else:
+                    result = method(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                elapsed = time.perf_counter() - start
+                stats[0] += 1
+                stats[1] += failed
+                stats[2] += elapsed
+                if elapsed > stats[3]:
+                    stats[3] = elapsed
+                if self._path and time.monotonic() >= self._next_dump:
+                    self.dump()
+        return wrapper
+
+    def profile(self, operation, mode="cprofile", every=1):
+        # Runs every `every`-th call of an operation under cProfile (call graph, saved next to the
+        # stats file as <path>.<operation>.prof) or tracemalloc (bytes allocated by the call).
+        if mode not in ("cprofile", "tracemalloc"):
+            raise ValueError(f"Unknown profiling mode '{mode}'.")
+        self._profiles[operation] = [mode, max(1, every), 0]
+
+    def _sample(self, name, method, args, kwargs):
+        profile = self._profiles[name]
+        profile[2] += 1
+        if (profile[2] - 1) % profile[1]:
+            return method(*args, **kwargs)
+        # Samples do not nest: an operation called from a sampled one is only timed.
+        self._profiling = True
+        try:
+            if profile[0] == "cprofile":
+                profiler = self._profilers.setdefault(name, cProfile.Profile())
+                return profiler.runcall(method, *args, **kwargs)
+            started = not tracemalloc.is_tracing()
+            if started:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            try:
+                return method(*args, **kwargs)
+            finally:
+                current, peak = tracemalloc.get_traced_memory()
+                if started:
+                    tracemalloc.stop()
+                allocations = self._allocations.setdefault(name, [0, 0, 0])
+                allocations[0] += 1
+                allocations[1] += current - before
+                allocations[2] = max(allocations[2], peak - before)
+        finally:
+            self._profiling = False
+
+    def add_bytes(self, store, size):
+        self._bytes_written[store] += size
+
+    def snapshot(self):
+        return {"operations": {name: {"calls": calls, "failures": failures, "seconds": seconds, "max_seconds": slowest}
+                               for name, (calls, failures, seconds, slowest) in self._operations.items() if calls},
+                "bytes_written": dict(self._bytes_written),
+                "allocations": {name: {"samples": samples, "net_bytes": net, "peak_bytes": peak}
+                                for name, (samples, net, peak) in self._allocations.items()}}
+
+    def to_prometheus(self):
+        def label(value):
+            return json.dumps(str(value))
+
+        operations = sorted((name, stats) for name, stats in self._operations.items() if stats[0])
+        lines = ["# HELP library_operation_seconds Time spent in each LibrarySystem operation.",
+                 "# TYPE library_operation_seconds summary"]
+        for name, (calls, _, seconds, _) in operations:
+            lines.append(f"library_operation_seconds_sum{{operation={label(name)}}} {seconds:.9f}")
+            lines.append(f"library_operation_seconds_count{{operation={label(name)}}} {calls}")
+        lines += ["# HELP library_operation_failures_total Operations that raised an exception.",
+                  "# TYPE library_operation_failures_total counter"]
+        lines += [f"library_operation_failures_total{{operation={label(name)}}} {stats[1]}" for name, stats in operations]
+        lines += ["# HELP library_operation_max_seconds Slowest call of each operation.",
+                  "# TYPE library_operation_max_seconds gauge"]
+        lines += [f"library_operation_max_seconds{{operation={label(name)}}} {stats[3]:.9f}" for name, stats in operations]
+        lines += ["# HELP library_bytes_written_total Bytes written to each store.",
+                  "# TYPE library_bytes_written_total counter"]
+        lines += [f"library_bytes_written_total{{store={label(store)}}} {size}"
+                  for store, size in sorted(self._bytes_written.items())]
+        if self._allocations:
+            lines += ["# HELP library_operation_allocated_bytes_peak Largest tracemalloc peak of a sampled call.",
+                      "# TYPE library_operation_allocated_bytes_peak gauge"]
+            lines += [f"library_operation_allocated_bytes_peak{{operation={label(name)}}} {peak}"
+                      for name, (_, _, peak) in sorted(self._allocations.items())]
+        return "\n".join(lines) + "\n"
+
+    def dump(self):
+        self._next_dump = time.monotonic() + self._interval
+        if not self._path:
+            return
+        try:
+            tmp_path = f"{self._path}.tmp"
+            with open(tmp_path, 'w') as f:
+                f.write(self.to_prometheus())
+            os.replace(tmp_path, self._path)
+            for name, profiler in self._profilers.items():
+                profiler.dump_stats(f"{self._path}.{name}.prof")
+        except Exception as e:
+            print(f"Error writing stats to {self._path}: {e}")
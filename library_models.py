@@ -0,0 +1,596 @@
+import heapq
+import sys
+from collections import Counter
+from array import array
+
+class LibraryError(Exception):
+    # Raised by the programmatic LibrarySystem API when an operation cannot be carried out.
+    pass
+
+class BookNotFoundError(LibraryError):
+    pass
+
+class MemberNotFoundError(LibraryError):
+    pass
+
+class DuplicateStudentIdError(LibraryError):
+    pass
+
+class OutOfStockError(LibraryError):
+    pass
+
+class BorrowLimitError(LibraryError):
+    pass
+
+class HoldError(LibraryError):
+    pass
+
+class NotIssuedError(LibraryError):
+    pass
+
+class ReadOnlyCatalogError(LibraryError):
+    pass
+
+class Book:
+    # Encapsulation
+    # __slots__ drops the per-instance __dict__, which dominates memory for large catalogs.
+    __slots__ = ("_title", "_author", "_isbn", "_total_quantity", "_available_quantity", "_holds")
+
+    def __init__(self, title, author, isbn, quantity):
+        if not isinstance(title, str) or not title.strip():
+            raise ValueError("Book title cannot be empty.")
+        if not isinstance(author, str) or not author.strip():
+            raise ValueError("Book author cannot be empty.")
+        if not isinstance(isbn, str) or not isbn.strip():
+            raise ValueError("Book ISBN cannot be empty.")
+        if not isinstance(quantity, int) or quantity <= 0:
+            raise ValueError("Book quantity must be a positive integer.")
+
+        self._title = title.strip()
+        self._author = author.strip()
+        self._isbn = isbn.strip()
+        self._total_quantity = quantity
+        self._available_quantity = quantity
+        self._holds = () # Member IDs waiting for a copy, first come first served
+
+    def get_title(self):
+        return self._title
+
+    def get_author(self):
+        return self._author
+
+    def get_isbn(self):
+        return self._isbn
+
+    def get_total_quantity(self):
+        return self._total_quantity
+
+    def get_available_quantity(self):
+        return self._available_quantity
+
+    def set_available_quantity(self, quantity):
+        if not isinstance(quantity, int) or quantity < 0 or quantity > self._total_quantity:
+            raise ValueError("Available quantity must be non-negative and not exceed total quantity.")
+        self._available_quantity = quantity
+
+    def increment_available_quantity(self):
+        if self._available_quantity < self._total_quantity:
+            self._available_quantity += 1
+            return True
+        return False
+
+    def decrement_available_quantity(self):
+        if self._available_quantity > 0:
+            self._available_quantity -= 1
+            return True
+        return False
+
+    def get_holds(self):
+        return self._holds
+
+    def set_holds(self, member_ids):
+        if not all(isinstance(member_id, int) and member_id > 0 for member_id in member_ids):
+            raise ValueError("Holds must be a list of member IDs.")
+        self._holds = tuple(member_ids)
+
+    def to_dict(self):
+        data = {
+            "title": self._title,
+            "author": self._author,
+            "isbn": self._isbn,
+            "total_quantity": self._total_quantity,
+            "available_quantity": self._available_quantity
+        }
+        if self._holds:
+            data["holds"] = list(self._holds)
+        return data
+
+    @classmethod
+    def from_dict(cls, data, trusted=False):
+        if trusted:
+            # Persisted records were validated when they were created, so a trusted load
+            # skips __init__ and set_available_quantity and fills the slots directly.
+            book = cls.__new__(cls)
+            book._title = data['title']
+            book._author = data['author']
+            book._isbn = data['isbn']
+            book._total_quantity = data['total_quantity']
+            book._available_quantity = data['available_quantity']
+            book._holds = tuple(data['holds']) if 'holds' in data else ()
+            return book
+        book = cls(
+            data['title'],
+            data['author'],
+            data['isbn'],
+            data['total_quantity']
+        )
+        book.set_available_quantity(data['available_quantity'])
+        book.set_holds(data.get('holds', ()))
+        return book
+
+    @classmethod
+    def from_columns(cls, titles, authors, isbns, total_quantities, available_quantities):
+        # Trusted bulk construction from the columns of a binary snapshot, as from_dict(trusted=True).
+        new = cls.__new__
+        for title, author, isbn, total_quantity, available_quantity in zip(
+                titles, authors, isbns, total_quantities, available_quantities):
+            book = new(cls)
+            book._title = title
+            book._author = author
+            book._isbn = isbn
+            book._total_quantity = total_quantity
+            book._available_quantity = available_quantity
+            book._holds = ()
+            yield book
+
+    def __str__(self):
+        return (f"Title: {self._title}, Author: {self._author}, ISBN: {self._isbn}, "
+                f"Available: {self._available_quantity}/{self._total_quantity}")
+
+class Member:
+    __slots__ = ("_name", "_member_id")
+    _next_id = 1001
+
+    def __init__(self, name, member_id=None):
+        # Encapsulation: Attributes initialized and managed within the class.
+        if not isinstance(name, str) or not name.strip():
+            raise ValueError("Member name cannot be empty.")
+        self._name = name.strip()
+        if member_id is None:
+            self._member_id = Member._next_id
+            Member._next_id += 1
+        else:
+            if not isinstance(member_id, int) or member_id <= 0:
+                raise ValueError("Member ID must be a positive integer.")
+            self._member_id = member_id
+            if member_id >= Member._next_id:
+                Member._next_id = member_id + 1
+
+    def get_member_id(self):
+        return self._member_id
+
+    def get_name(self):
+        return self._name
+
+    @classmethod
+    def from_dict(cls, data, trusted=False):
+        # Polymorphism: the stored "type" decides which subclass rebuilds the record.
+        member_types = {"Student": Student, "Faculty": Faculty}
+        if data.get("type") not in member_types:
+            raise ValueError(f"Unknown member type: {data.get('type')}")
+        return member_types[data["type"]].from_dict(data, trusted)
+
+    def get_max_books_allowed(self):
+        # Polymorphism
+        # It forces derived classes to define their specific borrowing limit.
+        raise NotImplementedError("Subclasses must implement get_max_books_allowed()")
+
+    def get_loan_period_days(self):
+        # Polymorphism: each kind of member keeps a book for a different number of days.
+        raise NotImplementedError("Subclasses must implement get_loan_period_days()")
+
+    def to_dict(self):
+        return {
+            "member_id": self._member_id,
+            "name": self._name,
+            "type": self.__class__.__name__
+        }
+
+    def __str__(self):
+        return f"Member ID: {self._member_id}, Name: {self._name}"
+
+class Student(Member):
+    # Inheritance: Student class inherits from Member, gaining its attributes and methods.
+    __slots__ = ("_student_id",)
+    _max_books_allowed = 3 # Shared by every student rather than stored per instance
+    _loan_period_days = 14
+
+    def __init__(self, name, student_id, member_id=None):
+        super().__init__(name, member_id) 
+        if not isinstance(student_id, str) or not student_id.strip():
+            raise ValueError("Student ID cannot be empty.")
+        self._student_id = student_id.strip() # Encapsulation
+
+    def get_student_id(self):
+        return self._student_id
+
+    def get_max_books_allowed(self):
+        # Polymorphism
+        return self._max_books_allowed
+
+    def get_loan_period_days(self):
+        return self._loan_period_days
+
+    def to_dict(self):
+        data = super().to_dict()
+        data["student_id"] = self._student_id
+        return data
+
+    @classmethod
+    def from_dict(cls, data, trusted=False):
+        if trusted:
+            student = cls.__new__(cls)
+            student._name = data['name']
+            student._member_id = data['member_id']
+            student._student_id = data['student_id']
+            return student
+        return cls(data['name'], data['student_id'], data['member_id'])
+
+    def __str__(self):
+        return f"{super().__str__()}, Type: Student, Student ID: {self._student_id}, Max Books: {self._max_books_allowed}"
+
+class Faculty(Member):
+    # Inheritance: Faculty class also inherits from Member.
+    __slots__ = ("_department",)
+    _max_books_allowed = 10 # Shared by every faculty member rather than stored per instance
+    _loan_period_days = 30
+
+    def __init__(self, name, department, member_id=None):
+        super().__init__(name, member_id)
+        if not isinstance(department, str) or not department.strip():
+            raise ValueError("Department cannot be empty.")
+        self._department = department.strip() # Encapsulation
+
+    def get_department(self):
+        return self._department
+
+    def get_max_books_allowed(self):
+        # Polymorphism
+            return self._max_books_allowed
+
+    def get_loan_period_days(self):
+        return self._loan_period_days
+
+    def to_dict(self):
+        data = super().to_dict()
+        data["department"] = self._department
+        return data
+
+    @classmethod
+    def from_dict(cls, data, trusted=False):
+        if trusted:
+            faculty = cls.__new__(cls)
+            faculty._name = data['name']
+            faculty._member_id = data['member_id']
+            faculty._department = data['department']
+            return faculty
+        return cls(data['name'], data['department'], data['member_id'])
+
+    def __str__(self):
+        return f"{super().__str__()}, Type: Faculty, Department: {self._department}, Max Books: {self._max_books_allowed}"
+
+class ColumnarCatalog:
+    # Drop-in replacement for the isbn -> Book dict that stores the catalog as parallel
+    # columns: one list per string field (authors are interned, since they repeat a lot)
+    # and compact integer arrays for the quantities. Lookups return a CatalogBook view.
+    def __init__(self):
+        self._rows = {}
+        self._isbns = []
+        self._titles = []
+        self._authors = []
+        self._total_quantities = array('q')
+        self._available_quantities = array('q')
+        self._holds = {}  # row -> member IDs waiting; few books have any, so it stays sparse
+
+    def __setitem__(self, isbn, book):
+        row = self._rows.get(isbn)
+        if row is None:
+            self._rows[isbn] = len(self._isbns)
+            self._isbns.append(isbn)
+            self._titles.append(book.get_title())
+            self._authors.append(sys.intern(book.get_author()))
+            self._total_quantities.append(book.get_total_quantity())
+            self._available_quantities.append(book.get_available_quantity())
+        else:
+            self._titles[row] = book.get_title()
+            self._authors[row] = sys.intern(book.get_author())
+            self._total_quantities[row] = book.get_total_quantity()
+            self._available_quantities[row] = book.get_available_quantity()
+        if book.get_holds():
+            self._holds[self._rows[isbn]] = tuple(book.get_holds())
+        else:
+            self._holds.pop(self._rows[isbn], None)
+
+    def load_columns(self, isbns, titles, authors, total_quantities, available_quantities, holds):
+        # Replaces the catalog with whole columns at once (a binary snapshot holds no duplicate ISBNs).
+        self._isbns = list(isbns)
+        self._rows = dict(zip(self._isbns, range(len(self._isbns))))
+        self._titles = list(titles)
+        self._authors = [sys.intern(author) for author in authors]
+        self._total_quantities = array('q', total_quantities)
+        self._available_quantities = array('q', available_quantities)
+        self._holds = {row: tuple(member_ids) for row, member_ids in holds}
+
+    def __getitem__(self, isbn):
+        return CatalogBook(self, self._rows[isbn])
+
+    def get(self, isbn, default=None):
+        row = self._rows.get(isbn)
+        return default if row is None else CatalogBook(self, row)
+
+    def __contains__(self, isbn):
+        return isbn in self._rows
+
+    def __len__(self):
+        return len(self._isbns)
+
+    def __iter__(self):
+        return iter(self._isbns)
+
+    def keys(self):
+        return self._rows.keys()
+
+    def values(self):
+        return (CatalogBook(self, row) for row in range(len(self._isbns)))
+
+    def items(self):
+        return ((self._isbns[row], CatalogBook(self, row)) for row in range(len(self._isbns)))
+
+class CatalogBook:
+    # A lightweight view of one ColumnarCatalog row with the same accessors as Book.
+    __slots__ = ("_catalog", "_row")
+
+    def __init__(self, catalog, row):
+        self._catalog = catalog
+        self._row = row
+
+    def get_title(self):
+        return self._catalog._titles[self._row]
+
+    def get_author(self):
+        return self._catalog._authors[self._row]
+
+    def get_isbn(self):
+        return self._catalog._isbns[self._row]
+
+    def get_total_quantity(self):
+        return self._catalog._total_quantities[self._row]
+
+    def get_available_quantity(self):
+        return self._catalog._available_quantities[self._row]
+
+    def set_available_quantity(self, quantity):
+        if not isinstance(quantity, int) or quantity < 0 or quantity > self.get_total_quantity():
+            raise ValueError("Available quantity must be non-negative and not exceed total quantity.")
+        self._catalog._available_quantities[self._row] = quantity
+
+    def increment_available_quantity(self):
+        if self.get_available_quantity() < self.get_total_quantity():
+            self._catalog._available_quantities[self._row] += 1
+            return True
+        return False
+
+    def decrement_available_quantity(self):
+        if self.get_available_quantity() > 0:
+            self._catalog._available_quantities[self._row] -= 1
+            return True
+        return False
+
+    def get_holds(self):
+        return self._catalog._holds.get(self._row, ())
+
+    def set_holds(self, member_ids):
+        if not all(isinstance(member_id, int) and member_id > 0 for member_id in member_ids):
+            raise ValueError("Holds must be a list of member IDs.")
+        if member_ids:
+            self._catalog._holds[self._row] = tuple(member_ids)
+        else:
+            self._catalog._holds.pop(self._row, None)
+
+    def to_dict(self):
+        data = {
+            "title": self.get_title(),
+            "author": self.get_author(),
+            "isbn": self.get_isbn(),
+            "total_quantity": self.get_total_quantity(),
+            "available_quantity": self.get_available_quantity()
+        }
+        if self.get_holds():
+            data["holds"] = list(self.get_holds())
+        return data
+
+    def __str__(self):
+        return (f"Title: {self.get_title()}, Author: {self.get_author()}, ISBN: {self.get_isbn()}, "
+                f"Available: {self.get_available_quantity()}/{self.get_total_quantity()}")
+
+class LoanIndex:
+    # Reverse index over _issued_books, kept in step by LibrarySystem._apply_change:
+    # isbn -> {member_id: copies} for the members holding it, and member_id -> {isbn: copies},
+    # so borrower lookups and "is this issued to them" checks never scan every loan.
+    def __init__(self):
+        self._borrowers = {}  # isbn -> {member_id: copies}
+        self._held = {}       # member_id -> {isbn: copies}
+
+    def rebuild(self, issued_books):
+        self._borrowers.clear()
+        self._held.clear()
+        for member_id, isbns in issued_books.items():
+            for isbn in isbns:
+                self._change(member_id, isbn, 1)
+
+    def update(self, member_id, old_isbns, new_isbns):
+        # Loan lists are bounded by the borrowing limit, so taking their difference is cheap.
+        old, new = Counter(old_isbns), Counter(new_isbns)
+        for isbn, copies in (old - new).items():
+            self._change(member_id, isbn, -copies)
+        for isbn, copies in (new - old).items():
+            self._change(member_id, isbn, copies)
+
+    def _change(self, member_id, isbn, delta):
+        for index, outer, inner in ((self._borrowers, isbn, member_id), (self._held, member_id, isbn)):
+            counts = index.get(outer)
+            if counts is None:
+                counts = index[outer] = {}
+            copies = counts.get(inner, 0) + delta
+            if copies > 0:
+                counts[inner] = copies
+            else:
+                counts.pop(inner, None)
+                if not counts:
+                    del index[outer]
+
+    def borrowers(self, isbn):
+        return dict(self._borrowers.get(isbn, {}))
+
+    def holds(self, member_id, isbn):
+        return self._held.get(member_id, {}).get(isbn, 0)
+
+    def issued_count(self, isbn):
+        return sum(self._borrowers.get(isbn, {}).values())
+
+    def issued_isbns(self):
+        return list(self._borrowers)
+
+class OverdueSchedule:
+    # Calendar queue over loan due dates: a bucket of loans per due date plus a min-heap of the
+    # dates, so a pass only drains the buckets that fell due since the previous pass. A return
+    # takes its loan straight out of its bucket; dates left empty are skipped when popped.
+    # The cursor (the horizon and the loans drained so far) is saved after every pass as a delta:
+    # the loans drained by the pass and the drained loans returned since the last one. The next
+    # process carries on where this one stopped instead of reporting every loan again.
+    REWRITE_SLACK = 1000  # entries and lines the saved cursor may hold beyond twice the live entries
+
+    def __init__(self, source, load_cursor=None, save_cursor=None):
+        self._source = source  # yields (member_id, isbns, due dates) for every member with loans
+        self._load_cursor = load_cursor
+        self._save_cursor = save_cursor  # (cursor, append) -> None; append=False replaces it
+        self._buckets = {}     # ISO due date -> {(member_id, isbn): copies}, not yet drained
+        self._dates = []
+        self._overdue = {}     # (due_date, member_id, isbn) -> copies, drained
+        self._returned = {}    # (due_date, member_id, isbn) -> drained copies returned since the last save
+        self._logged = 0       # drained and returned entries the saved cursor holds
+        self._horizon = ""     # every loan dated before this was drained, unless it is in a bucket
+        self._built = False
+
+    def reset(self):
+        # The loans were reloaded; the buckets are refilled from source on the next pass.
+        self._buckets.clear()
+        self._dates.clear()
+        self._overdue.clear()
+        self._returned.clear()
+        self._logged = 0
+        self._horizon = ""
+        self._built = False
+
+    def _build(self):
+        self._built = True
+        cursor = self._load_cursor() if self._load_cursor is not None else None
+        drained = {}
+        if cursor:
+            self._horizon = cursor["horizon"]
+            drained = {(due_date, member_id, isbn): copies for due_date, member_id, isbn, copies in cursor["drained"]}
+            self._logged = cursor.get("logged", len(drained))
+        buckets = self._buckets
+        for member_id, isbns, due_dates in self._source():
+            for isbn, due_date in zip(isbns, due_dates):
+                if due_date is None:
+                    continue
+                # A loan the last pass drained stays drained; any other, even one already past
+                # the horizon (say, issued after the pass with an old due date), is new.
+                key = (due_date, member_id, isbn)
+                if drained.get(key, 0) > 0:
+                    drained[key] -= 1
+                    self._overdue[key] = self._overdue.get(key, 0) + 1
+                    continue
+                bucket = buckets.get(due_date)
+                if bucket is None:
+                    bucket = buckets[due_date] = {}
+                bucket[(member_id, isbn)] = bucket.get((member_id, isbn), 0) + 1
+        # Drained loans returned while no process was running are pruned at the next save.
+        for key, copies in drained.items():
+            if copies > 0:
+                self._returned[key] = copies
+        self._dates = list(buckets)
+        heapq.heapify(self._dates)
+
+    def add(self, member_id, isbn, due_date):
+        # New loans always go into a bucket, so the next pass reports them even if they were
+        # past due when they were issued.
+        if self._built and due_date is not None:
+            bucket = self._buckets.get(due_date)
+            if bucket is None:
+                bucket = self._buckets[due_date] = {}
+                heapq.heappush(self._dates, due_date)
+            key = (member_id, isbn)
+            bucket[key] = bucket.get(key, 0) + 1
+
+    def remove(self, member_id, isbn, due_date):
+        if self._built and due_date is not None:
+            counts, key = self._buckets.get(due_date), (member_id, isbn)
+            if counts is None or key not in counts:
+                counts, key = self._overdue, (due_date, member_id, isbn)
+                if key in counts:
+                    self._returned[key] = self._returned.get(key, 0) + 1
+            if counts.get(key, 0) > 1:
+                counts[key] -= 1
+            else:
+                counts.pop(key, None)
+
+    def collect(self, as_of):
+        # Drains the buckets dated before as_of (an ISO date); returns the loans they held, once
+        # per copy. Only what changed is saved, unless the saved cursor has grown to more than
+        # twice the loans still drained, when it is rewritten whole.
+        if not self._built:
+            self._build()
+        drained = []
+        counts = []
+        while self._dates and self._dates[0] < as_of:
+            due_date = heapq.heappop(self._dates)
+            for (member_id, isbn), copies in self._buckets.pop(due_date, {}).items():
+                key = (due_date, member_id, isbn)
+                self._overdue[key] = self._overdue.get(key, 0) + copies
+                drained += [key] * copies
+                counts.append([*key, copies])
+        horizon = max(self._horizon, as_of)
+        if self._save_cursor is not None and (counts or self._returned or horizon != self._horizon):
+            returned = [[*key, copies] for key, copies in self._returned.items()]
+            # Every line counts as an entry too, or a run of quiet nights would grow it forever.
+            logged = self._logged + len(counts) + len(returned) + 1
+            if logged > 2 * len(self._overdue) + self.REWRITE_SLACK:
+                self._save_cursor({"horizon": horizon,
+                                   "drained": [[*key, copies] for key, copies in self._overdue.items()]}, False)
+                self._logged = len(self._overdue) + 1
+            else:
+                self._save_cursor({"horizon": horizon, "drained": counts, "returned": returned}, True)
+                self._logged = logged
+            self._returned.clear()
+        self._horizon = horizon
+        return drained
+
+    def overdue(self, as_of):
+        # Every loan due before as_of, oldest first and once per copy. Listing them drains
+        # nothing: the heap is walked without popping, and only down to the dates before as_of,
+        # since every date below one that is not is later still.
+        if not self._built:
+            self._build()
+        loans = [key for key, copies in self._overdue.items() if key[0] < as_of for _ in range(copies)]
+        dates = self._dates
+        stack = [0] if dates and dates[0] < as_of else []
+        while stack:
+            i = stack.pop()
+            due_date = dates[i]
+            for (member_id, isbn), copies in self._buckets.get(due_date, {}).items():
+                loans += [(due_date, member_id, isbn)] * copies
+            stack += [child for child in (2 * i + 1, 2 * i + 2) if child < len(dates) and dates[child] < as_of]
+        loans.sort()
+        return loans
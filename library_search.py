@@ -0,0 +1,649 @@
+import heapq
+import mmap
+import os
+import re
+import threading
+from bisect import bisect_left
+from collections import Counter
+
+class TrigramVocabulary:
+    # Trigram index over a vocabulary of words, for fuzzy matching: finds the words whose trigram
+    # similarity (Jaccard) to a query word reaches THRESHOLD. Numbers are left out.
+    THRESHOLD = 0.3  # least trigram similarity for a word to count as a match
+
+    def __init__(self, words=()):
+        self._trigrams = {}     # trigram -> [vocabulary words containing it]
+        self._gram_counts = {}  # vocabulary word -> number of distinct trigrams in it
+        for word in words:
+            self.add(word)
+
+    @staticmethod
+    def trigrams(word):
+        # Padded like pg_trgm, so the start and end of a word weigh more than its middle.
+        padded = f"  {word} "
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    @classmethod
+    def similarity(cls, grams, word):
+        # Similarity of the word to a query word with these trigrams, or 0 below THRESHOLD.
+        if word.isdigit():
+            return 0
+        other = cls.trigrams(word)
+        shared = len(grams & other)
+        similarity = shared / (len(grams) + len(other) - shared)
+        return similarity if similarity >= cls.THRESHOLD else 0
+
+    def add(self, word):
+        if word.isdigit() or word in self._gram_counts:
+            return
+        grams = self.trigrams(word)
+        self._gram_counts[word] = len(grams)
+        for gram in grams:
+            self._trigrams.setdefault(gram, []).append(word)
+
+    def clear(self):
+        self._trigrams.clear()
+        self._gram_counts.clear()
+
+    def similar(self, token):
+        # word -> similarity for the vocabulary words similar enough to the token.
+        grams = self.trigrams(token)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._trigrams.get(gram, ()))
+        # Jaccard similarity can only reach the threshold with this many trigrams in common.
+        needed = self.THRESHOLD * len(grams)
+        similar = {}
+        for word in [word for word, count in shared.items() if count >= needed]:
+            count = shared[word]
+            similarity = count / (len(grams) + self._gram_counts[word] - count)
+            if similarity >= self.THRESHOLD:
+                similar[word] = similarity
+        return similar
+
+class BookSearchIndex:
+    # Inverted index from normalized title/author tokens to ISBNs, so a search only touches the
+    # postings of the query words instead of every book. The tokens are also kept sorted, so the
+    # words starting with a query word are one bisected run of them rather than a posting list
+    # per prefix of every word.
+    # Fuzzy search matches query words against the vocabulary of indexed words by trigram
+    # similarity, so a misspelt word still finds the books containing the word it was meant to be.
+    TITLE = 1
+    AUTHOR = 2
+
+    def __init__(self):
+        self._exact = {}     # token -> {isbn: fields the token appears in}
+        self._tokens = []    # the keys of _exact, sorted
+        self._titles = {}    # isbn -> normalized title, used to rank and break ties
+        self._authors = {}   # isbn -> author as indexed, to tell whether a re-added book changed
+        self._vocabulary = TrigramVocabulary()  # every indexed word, for fuzzy search
+        # Books are queued by add() and tokenized by a background thread started after loading
+        # (see index_in_background), or by the next search if that comes first. Tokenizing holds
+        # the lock; add() only appends to the queue, which is safe without it.
+        self._pending = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @staticmethod
+    def tokenize(text):
+        return re.findall(r"\w+", text.casefold())
+
+    def add(self, book):
+        # A restock re-adds its book unchanged; only a new book or a changed title or author is queued.
+        isbn, title, author = book.get_isbn(), book.get_title(), book.get_author()
+        if self._authors.get(isbn) != author or self._titles.get(isbn) != title.casefold():
+            self._pending.append((isbn, title, author))
+
+    def add_columns(self, isbns, titles, authors):
+        self._pending.extend(zip(isbns, titles, authors))
+
+    def index_in_background(self):
+        if self._pending:
+            self._thread = threading.Thread(target=self._index_pending, name="search-index", daemon=True)
+            self._thread.start()
+
+    def join_background(self):
+        # Waits for the background pass, e.g. so that no thread holds a lock when the process forks.
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+    def _index_pending(self):
+        # Also waits for a background pass that is still running, so no search sees half an index.
+        with self._lock:
+            # Books queued while this runs stay queued for the next pass.
+            count = len(self._pending)
+            pending = self._pending[:count]
+            del self._pending[:count]
+            self._index_books(pending)
+
+    def _index_books(self, pending):
+        new_tokens = []
+        for isbn, title, author in pending:
+            if isbn in self._titles:
+                if self._titles[isbn] == title.casefold() and self._authors[isbn] == author:
+                    continue
+                self._unindex(isbn)
+            self._titles[isbn] = title.casefold()
+            self._authors[isbn] = author
+            for field, text in ((self.TITLE, title), (self.AUTHOR, author)):
+                for token in set(self.tokenize(text)):
+                    postings = self._exact.get(token)
+                    if postings is None:
+                        postings = self._exact[token] = {}
+                        self._vocabulary.add(token)
+                        new_tokens.append(token)
+                    postings[isbn] = postings.get(isbn, 0) | field
+        if new_tokens:
+            # Appended and re-sorted once per pass; the sort merges the new run into the old one.
+            self._tokens += sorted(new_tokens)
+            self._tokens.sort()
+
+    def _unindex(self, isbn):
+        # Drops the postings of the book's old title and author. Their words stay in the
+        # vocabulary with whatever postings remain, possibly none.
+        for token in set(self.tokenize(self._titles.pop(isbn)) + self.tokenize(self._authors.pop(isbn))):
+            self._exact[token].pop(isbn, None)
+
+    def _prefix_postings(self, prefix):
+        # isbn -> fields, over every indexed word that starts with prefix.
+        tokens = self._tokens
+        start = end = bisect_left(tokens, prefix)
+        while end < len(tokens) and tokens[end].startswith(prefix):
+            end += 1
+        if end - start == 1:
+            return self._exact[tokens[start]]
+        merged = {}
+        for token in tokens[start:end]:
+            for isbn, fields in self._exact[token].items():
+                merged[isbn] = merged.get(isbn, 0) | fields
+        return merged
+
+    def clear(self):
+        with self._lock:
+            self._exact.clear()
+            self._tokens.clear()
+            self._titles.clear()
+            self._authors.clear()
+            self._vocabulary.clear()
+            self._pending.clear()
+
+    def search(self, term, limit=None, offset=0):
+        return self._top(self._search_scores(term), limit, offset)
+
+    def fuzzy_search(self, term, limit=None, offset=0):
+        return self._top(self._fuzzy_scores(term), limit, offset)
+
+    def ranked(self, term, count=None, fuzzy=False):
+        # The first count matches as their (-score, title, isbn) sort keys, so the rankings of
+        # several indexes (one per shard) can be merged.
+        scores = self._fuzzy_scores(term) if fuzzy else self._search_scores(term)
+        keys = ((-score, self._titles[isbn], isbn) for isbn, score in scores.items())
+        return sorted(keys) if count is None else heapq.nsmallest(count, keys)
+
+    def _search_scores(self, term):
+        # Every query word must match a whole word or the start of a word in the title or author.
+        self._index_pending()
+        tokens = self.tokenize(term)
+        if not tokens:
+            return {}
+        prefixes = {token: self._prefix_postings(token) for token in set(tokens)}
+        postings = sorted(prefixes.values(), key=len)
+        candidates = set(postings[0])
+        for other in postings[1:]:
+            candidates.intersection_update(other)
+            if not candidates:
+                return {}
+
+        phrase = " ".join(tokens)
+        scores = {}
+        for isbn in candidates:
+            score = 0
+            for token in tokens:
+                exact = self._exact.get(token, {}).get(isbn, 0)
+                prefix = prefixes[token][isbn]
+                if exact & self.TITLE:
+                    score += 4
+                elif prefix & self.TITLE:
+                    score += 2
+                if exact & self.AUTHOR:
+                    score += 3
+                elif prefix & self.AUTHOR:
+                    score += 1
+            if self._titles[isbn] == phrase:
+                score += 10
+            scores[isbn] = score
+        return scores
+
+    def _fuzzy_scores(self, term):
+        # Each query word matches the indexed words whose trigram similarity to it reaches
+        # TrigramVocabulary.THRESHOLD, and a book must contain a match for every query word that
+        # has any. A book scores the sum, over the query words, of its most similar matching word.
+        self._index_pending()
+        matches = [similar for similar in map(self._vocabulary.similar, set(self.tokenize(term))) if similar]
+        if not matches:
+            return {}
+        # Start from the query word with the fewest postings, so later words only narrow it down.
+        matches.sort(key=lambda similar: sum(len(self._exact[word]) for word in similar))
+        scores = self._word_scores(matches[0])
+        for similar in matches[1:]:
+            if not scores:
+                break
+            scores = {isbn: scores[isbn] + score for isbn, score in self._word_scores(similar, scores).items()}
+        return scores
+
+    def _word_scores(self, similar, candidates=None):
+        # isbn -> best similarity among the similar words each book contains, restricted to the
+        # candidates if given. Walks the candidates or the postings, whichever is shorter.
+        best = {}
+        if candidates is not None and len(candidates) * len(similar) < sum(len(self._exact[word]) for word in similar):
+            for isbn in candidates:
+                for word, similarity in similar.items():
+                    if isbn in self._exact[word] and similarity > best.get(isbn, 0):
+                        best[isbn] = similarity
+            return best
+        for word, similarity in similar.items():
+            for isbn in self._exact[word]:
+                if (candidates is None or isbn in candidates) and similarity > best.get(isbn, 0):
+                    best[isbn] = similarity
+        return best
+
+    def _top(self, scores, limit, offset):
+        # Best first, then by title. A page only needs the first offset + limit, which a heap
+        # selects without sorting every match.
+        key = lambda isbn: (-scores[isbn], self._titles[isbn], isbn)
+        if limit is None:
+            return sorted(scores, key=key)[offset:]
+        return heapq.nsmallest(offset + limit, scores, key=key)[offset:]
+
+class TokenIndex:
+    # On-disk search index over the catalog for lazy mode and kiosks, enough to rank a search
+    # like BookSearchIndex does without reading a single book. It holds three fixed-width
+    # tables: every distinct title and author word in sorted order, each pointing at its
+    # postings; the postings, each a book's position in title order plus whether the word is in
+    # its title (1), author (2) or both (3); and the books in title order (casefolded title, then
+    # ISBN), each pointing at its title in a string heap at the end. The file is memory-mapped,
+    # and like OffsetIndex the header stamps the size and mtime of the file the catalog was read from.
+    MAGIC = b"LIBTOK1"
+    POSTING = 12  # 10-digit title-order position, field digit, newline
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._start = self._map.find(b"\n") + 1
+        fields = self._map[:self._start].split()
+        if len(fields) != 9 or fields[0] != self.MAGIC:
+            self._map.close()
+            raise ValueError(f"{path} is not a token index.")
+        self._stamp = (int(fields[1]), int(fields[2]))
+        self._count, self._word_width = int(fields[3]), int(fields[4])
+        self._book_count, self._isbn_width = int(fields[6]), int(fields[7])
+        # word, 12-digit first posting and 10-digit posting count, separated by spaces and newline-terminated
+        self._stride = self._word_width + 25
+        self._postings = self._start + self._count * self._stride
+        self._books = self._postings + int(fields[5]) * self.POSTING
+        # ISBN, 12-digit heap offset and 10-digit length of the title, likewise
+        self._book_stride = self._isbn_width + 25
+        self._heap = self._books + self._book_count * self._book_stride
+        if len(self._map) != self._heap + int(fields[8]):
+            self._map.close()
+            raise ValueError(f"{path} is truncated.")
+        self._vocabulary = None  # TrigramVocabulary over the words, built by the first fuzzy search
+
+    @classmethod
+    def write(cls, path, source_path, rows):
+        # rows are (isbn, title, author); for a repeated ISBN the last row wins. Returns the
+        # number of bytes written.
+        try:
+            stat = os.stat(source_path)
+            source_stamp = (stat.st_size, stat.st_mtime_ns)
+        except FileNotFoundError:
+            source_stamp = (0, 0)
+        rows = {isbn: (title, author) for isbn, title, author in rows}
+        books = sorted((title.casefold(), isbn) for isbn, (title, _) in rows.items())
+        words = {}
+        for order, (_, isbn) in enumerate(books):
+            title, author = rows[isbn]
+            for field, text in ((BookSearchIndex.TITLE, title), (BookSearchIndex.AUTHOR, author)):
+                for word in set(BookSearchIndex.tokenize(text)):
+                    postings = words.setdefault(word.encode('utf-8', 'surrogatepass'), {})
+                    postings[order] = postings.get(order, 0) | field
+        words = sorted(words.items())
+        word_width = max((len(word) for word, _ in words), default=1)
+        books = [(title.encode('utf-8', 'surrogatepass'), isbn.encode('utf-8', 'surrogatepass')) for title, isbn in books]
+        isbn_width = max((len(isbn) for _, isbn in books), default=1)
+        table, postings, count = [], [], 0
+        for word, orders in words:
+            table.append(b"%s %012d %010d\n" % (word.ljust(word_width), count, len(orders)))
+            postings.extend(b"%010d%d\n" % (order, orders[order]) for order in sorted(orders))
+            count += len(orders)
+        book_table, heap = [], bytearray()
+        for title, isbn in books:
+            book_table.append(b"%s %012d %010d\n" % (isbn.ljust(isbn_width), len(heap), len(title)))
+            heap += title
+        # Kiosks and a lazy desk may rebuild the index at once, so each writes its own temporary file.
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(b"%s %d %d %d %d %d %d %d %d\n" % (cls.MAGIC, *source_stamp, len(table), word_width, count,
+                                                       len(book_table), isbn_width, len(heap)))
+            f.write(b"".join(table))
+            f.write(b"".join(postings))
+            f.write(b"".join(book_table))
+            f.write(heap)
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+        os.replace(tmp_path, path)
+        return size
+
+    def is_current(self, source_path):
+        try:
+            stat = os.stat(source_path)
+        except FileNotFoundError:
+            return self._stamp == (0, 0)
+        return self._stamp == (stat.st_size, stat.st_mtime_ns)
+
+    def _word(self, i):
+        position = self._start + i * self._stride
+        return self._map[position:position + self._word_width].rstrip(b" ").decode('utf-8', 'surrogatepass')
+
+    def words(self):
+        return (self._word(i) for i in range(self._count))
+
+    def vocabulary(self):
+        # The file never changes once written, so one vocabulary serves every fuzzy search.
+        if self._vocabulary is None:
+            self._vocabulary = TrigramVocabulary(self.words())
+        return self._vocabulary
+
+    def _find_word(self, word):
+        # Position of the first word not below word.
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._word(mid) < word:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _postings_at(self, i):
+        # {title-order position: field flags} for the i-th word.
+        line = self._start + i * self._stride + self._word_width
+        first, count = int(self._map[line + 1:line + 13]), int(self._map[line + 14:line + 24])
+        start = self._postings + first * self.POSTING
+        block = self._map[start:start + count * self.POSTING]
+        return {int(block[j:j + 10]): block[j + 10] - 48 for j in range(0, len(block), self.POSTING)}
+
+    def postings(self, word):
+        i = self._find_word(word)
+        return self._postings_at(i) if i < self._count and self._word(i) == word else {}
+
+    def _book(self, order):
+        # (casefolded title, ISBN) of the book at this position in title order.
+        line = self._map[self._books + order * self._book_stride:self._books + (order + 1) * self._book_stride]
+        offset, length = int(line[self._isbn_width + 1:self._isbn_width + 13]), int(line[self._isbn_width + 14:-1])
+        title = self._map[self._heap + offset:self._heap + offset + length].decode('utf-8', 'surrogatepass')
+        return title, line[:self._isbn_width].rstrip(b" ").decode('utf-8', 'surrogatepass')
+
+    def _titled(self, title):
+        # Title-order positions of the books with this casefolded title.
+        lo, hi = 0, self._book_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._book(mid)[0] < title:
+                lo = mid + 1
+            else:
+                hi = mid
+        while lo < self._book_count and self._book(lo)[0] == title:
+            yield lo
+            lo += 1
+
+    def ranked(self, tokens, count=None):
+        # The first count matches for these query words, as BookSearchIndex.ranked() sort keys.
+        scores = None
+        # Longer words match fewer books, so they narrow the candidates down fastest.
+        for token in sorted(set(tokens), key=len, reverse=True):
+            weight = tokens.count(token)
+            points = {}
+            i = self._find_word(token)
+            while i < self._count and self._word(i).startswith(token):
+                exact = self._word(i) == token
+                title_points, author_points = (4, 3) if exact else (2, 1)
+                for order, field in self._postings_at(i).items():
+                    if scores is not None and order not in scores:
+                        continue
+                    title, author = points.get(order, (0, 0))
+                    points[order] = (max(title, title_points if field & BookSearchIndex.TITLE else 0),
+                                     max(author, author_points if field & BookSearchIndex.AUTHOR else 0))
+                i += 1
+            scores = {order: (scores[order] if scores is not None else 0) + weight * (title + author)
+                      for order, (title, author) in points.items()}
+            if not scores:
+                return []
+        for order in self._titled(" ".join(tokens)):
+            if order in scores:
+                scores[order] += 10
+        # Title order already breaks ties by title and then ISBN.
+        keys = ((-score, order) for order, score in scores.items())
+        top = sorted(keys) if count is None else heapq.nsmallest(count, keys)
+        return [(score, *self._book(order)) for score, order in top]
+
+    def fuzzy_ranked(self, matches, count=None):
+        # ranked() for a fuzzy search: matches holds, for each query word, {similar word: similarity},
+        # and a book scores the sum over them of its most similar word, as in BookSearchIndex.
+        scores = None
+        for similar in matches:
+            best = {}
+            for word, similarity in similar.items():
+                for order in self.postings(word):
+                    if (scores is None or order in scores) and similarity > best.get(order, 0):
+                        best[order] = similarity
+            scores = best if scores is None else {order: scores[order] + score for order, score in best.items()}
+            if not scores:
+                return []
+        keys = ((-score, order) for order, score in scores.items())
+        top = sorted(keys) if count is None else heapq.nsmallest(count, keys)
+        return [(score, *self._book(order)) for score, order in top]
+
+    def close(self):
+        self._map.close()
+
+class LazySearchIndex:
+    # Search for lazy mode and kiosks: rather than keeping postings for the whole catalog in
+    # memory, each search is ranked from the on-disk TokenIndex, with the books changed since it
+    # was written ranked by a throwaway BookSearchIndex. Without a token index it streams the
+    # catalog instead.
+    def __init__(self, books, tokens=None):
+        self._books = books
+        self._tokens = tokens
+
+    def add(self, book):
+        pass  # every search reads the catalog afresh
+
+    def clear(self):
+        pass
+
+    def index_in_background(self):
+        pass
+
+    def join_background(self):
+        pass
+
+    def search(self, term, limit=None, offset=0):
+        tokens = BookSearchIndex.tokenize(term)
+        if not tokens:
+            return []
+        if self._tokens is not None:
+            return self._search_tokens(tokens, term, limit, offset)
+        matches = BookSearchIndex()
+        for book in self._books.values():
+            words = BookSearchIndex.tokenize(f"{book.get_title()} {book.get_author()}")
+            if all(any(word.startswith(token) for word in words) for token in tokens):
+                matches.add(book)
+        return matches.search(term, limit, offset)
+
+    def _search_tokens(self, tokens, term, limit, offset):
+        # The token index ranks the catalog as it was written; books changed since are ranked
+        # separately and merged in, replacing their stale entries.
+        changed = {book.get_isbn(): book for book in self._books.changed()}
+        count = None if limit is None else offset + limit
+        ranking = self._tokens.ranked(tokens, None if count is None else count + len(changed))
+        rankings = [[key for key in ranking if key[2] not in changed][:count]]
+        if changed:
+            index = BookSearchIndex()
+            for book in changed.values():
+                index.add(book)
+            rankings.append(index.ranked(term, count))
+        return [isbn for _, _, isbn in list(heapq.merge(*rankings))[offset:count]]
+
+    def fuzzy_search(self, term, limit=None, offset=0):
+        # The token index's vocabulary finds the words close to each query word, as in
+        # BookSearchIndex; the books changed since it was written are scored directly.
+        tokens = list(set(BookSearchIndex.tokenize(term)))
+        if not tokens:
+            return []
+        count = None if limit is None else offset + limit
+        if self._tokens is None:
+            # As search() does without the token index: one pass over the catalog.
+            return [isbn for _, _, isbn in self._scored(self._books.values(), tokens)[offset:count]]
+        changed = {book.get_isbn(): book for book in self._books.changed()}
+        vocabulary = self._tokens.vocabulary()
+        changed_words = TrigramVocabulary(word for book in changed.values()
+                                          for word in BookSearchIndex.tokenize(f"{book.get_title()} {book.get_author()}"))
+        matches = []
+        for token in tokens:
+            similar = vocabulary.similar(token)
+            similar.update(changed_words.similar(token))
+            matches.append(similar)
+        if not any(matches):
+            return []
+        ranking = self._tokens.fuzzy_ranked([similar for similar in matches if similar],
+                                            None if count is None else count + len(changed))
+        rankings = [[key for key in ranking if key[2] not in changed][:count],
+                    self._scored(changed.values(), tokens, [bool(similar) for similar in matches])]
+        return [isbn for _, _, isbn in list(heapq.merge(*rankings))[offset:count]]
+
+    @staticmethod
+    def _scored(books, tokens, counted=None):
+        # Sorted ranking keys of the books with a close match for every counted query word (by
+        # default, each one that any of the books matches), scoring their words directly.
+        grams = [TrigramVocabulary.trigrams(token) for token in tokens]
+        similarities = {}  # word -> its similarity to each query word, as titles share many words
+        scored = []
+        for book in books:
+            best = [0] * len(tokens)
+            for word in set(BookSearchIndex.tokenize(f"{book.get_title()} {book.get_author()}")):
+                if word not in similarities:
+                    similarities[word] = [TrigramVocabulary.similarity(token_grams, word) for token_grams in grams]
+                best = list(map(max, best, similarities[word]))
+            if any(best):
+                scored.append((best, book))
+        if counted is None:
+            counted = [any(best[i] for best, _ in scored) for i in range(len(tokens))]
+        return sorted((-sum(best), book.get_title().casefold(), book.get_isbn()) for best, book in scored
+                      if all(score or not wanted for score, wanted in zip(best, counted)))
+
+class ShardedSearchIndex:
+    # One BookSearchIndex per shard. A search runs on all of them at once in the storage's thread
+    # pool, and their rankings, each sorted by (-score, title, isbn), are merged into one.
+    def __init__(self, indexes, shard, pool):
+        self._indexes = indexes
+        self._shard = shard
+        self._pool = pool
+
+    def add(self, book):
+        self._indexes[self._shard(book.get_isbn())].add(book)
+
+    def clear(self):
+        for index in self._indexes:
+            index.clear()
+
+    def index_in_background(self):
+        for index in self._indexes:
+            index.index_in_background()
+
+    def join_background(self):
+        for index in self._indexes:
+            index.join_background()
+
+    def search(self, term, limit=None, offset=0):
+        return self._merge(term, limit, offset, False)
+
+    def fuzzy_search(self, term, limit=None, offset=0):
+        return self._merge(term, limit, offset, True)
+
+    def _merge(self, term, limit, offset, fuzzy):
+        # A page needs no more than the first offset + limit matches of any one shard.
+        count = None if limit is None else offset + limit
+        rankings = self._pool.map(lambda index: index.ranked(term, count, fuzzy), self._indexes)
+        return [isbn for _, _, isbn in list(heapq.merge(*rankings))[offset:count]]
+
+class SQLiteSearchIndex:
+    # BookSearchIndex counterpart backed by the books_fts table, which triggers keep current.
+    def __init__(self, conn):
+        self._conn = conn
+        # Fuzzy search's trigram vocabulary over the books_vocab terms, kept between searches,
+        # and the database version it was read at.
+        self._vocabulary = TrigramVocabulary()
+        self._terms = set()
+        self._version = None
+
+    def add(self, book):
+        pass
+
+    def clear(self):
+        pass
+
+    def index_in_background(self):
+        pass
+
+    def join_background(self):
+        pass
+
+    def search(self, term, limit=None, offset=0):
+        tokens = BookSearchIndex.tokenize(term)
+        if not tokens:
+            return []
+        # Every word must match the start of a word in the title or author, as in BookSearchIndex.
+        query = " ".join(f'"{token}"*' for token in tokens)
+        cursor = self._conn.execute(
+            "SELECT books.isbn FROM books_fts JOIN books ON books.rowid = books_fts.rowid "
+            "WHERE books_fts MATCH ? ORDER BY bm25(books_fts, 4.0, 3.0), books.title LIMIT ? OFFSET ?",
+            (query, -1 if limit is None else limit, offset))
+        return [row[0] for row in cursor]
+
+    def fuzzy_search(self, term, limit=None, offset=0):
+        # books_fts has no typo tolerance: the words close to each query word come from the trigram
+        # vocabulary, and books_fts then finds the books with a close word for every query word
+        # that has any, which are scored as in BookSearchIndex.
+        vocabulary = self._current_vocabulary()
+        matches = [similar for similar in map(vocabulary.similar, set(BookSearchIndex.tokenize(term))) if similar]
+        if not matches:
+            return []
+        query = " AND ".join("(" + " OR ".join(f'"{word}"' for word in similar) + ")" for similar in matches)
+        keys = []
+        for isbn, title, author in self._conn.execute(
+                "SELECT books.isbn, books.title, books.author FROM books_fts JOIN books ON books.rowid = books_fts.rowid "
+                "WHERE books_fts MATCH ?", (query,)):
+            words = set(BookSearchIndex.tokenize(f"{title} {author}"))
+            best = [max((similar.get(word, 0) for word in words), default=0) for similar in matches]
+            if all(best):
+                keys.append((-sum(best), title.casefold(), isbn))
+        top = sorted(keys) if limit is None else heapq.nsmallest(offset + limit, keys)
+        return [isbn for _, _, isbn in top[offset:]]
+
+    def _current_vocabulary(self):
+        # Brought up to date when this or another connection has written since it was read. Only
+        # new words are added, unless a word has gone, which means starting over.
+        version = (self._conn.execute("PRAGMA data_version").fetchone()[0], self._conn.total_changes)
+        if version != self._version:
+            terms = {row[0] for row in self._conn.execute("SELECT term FROM books_vocab")}
+            if not terms >= self._terms:
+                self._vocabulary.clear()
+                self._terms = set()
+            for word in terms - self._terms:
+                self._vocabulary.add(word)
+            self._terms = terms
+            self._version = version
+        return self._vocabulary
@@ -0,0 +1,302 @@
+import argparse
+import asyncio
+import json
+import os
+import signal
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from library_system import (CHANGES_FILE, SQLITE_FILE, BookNotFoundError, LibraryError, LibrarySystem,
+                            MemberNotFoundError, ReplicaStorage, SQLiteStorage)
+
+DEFAULT_PORT = 8080
+MAX_GROUP_COMMIT = 256
+MAX_BODY_SIZE = 1 << 20
+MAX_SEARCH_RESULTS = 100
+REPLICA_POLL_INTERVAL = 0.005
+STATUS_TEXT = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def _integer(body, field):
+    # JSON true and false would pass for 1 and 0 further down, so they are refused here.
+    value = body[field]
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError(f"{field} must be an integer.")
+    return value
+
+def _count(query, name, default):
+    # A page size or top-k query parameter, capped at MAX_SEARCH_RESULTS.
+    value = int(query.get(name, [default])[0])
+    if value < 1:
+        raise ValueError(f"{name} must be at least 1.")
+    return min(value, MAX_SEARCH_RESULTS)
+
+class LibraryServer:
+    # HTTP/JSON front-end over a LibrarySystem, for kiosks and the web catalog.
+    # Reads are served on the event loop straight from the library's in-memory stores, so any
+    # number of them interleave. Mutations are queued for a single writer task, which applies
+    # everything queued so far inside one library.staged_batch(): a burst of requests shares one
+    # journal write and fsync (group commit), and each client is answered once its group is
+    # persisted. The write runs on a worker thread, so reads go on meanwhile (and may already see
+    # the group being written). Compactions run on the loop once a group's lock is released.
+    # With refresh_interval set (read replicas), the library is refreshed that often between requests.
+    def __init__(self, library, host="127.0.0.1", port=DEFAULT_PORT, max_group=MAX_GROUP_COMMIT, refresh_interval=None):
+        self._library = library
+        self._host = host
+        self._port = port
+        self._max_group = max_group
+        self._refresh_interval = refresh_interval
+        self._server = None
+        self._writes = None
+        self._writer = None
+        self._follower = None
+        self._stats = {"requests": 0, "writes": 0, "groups": 0, "largest_group": 0}
+        # POST path -> (status on success, function applying the request body). Results are
+        # serialized by the writer, before a later write in the same group can change them.
+        self._mutations = {
+            "/books": (201, lambda body: library.process_add_book(
+                body["title"], body["author"], body["isbn"], _integer(body, "quantity")).to_dict()),
+            "/members": (201, lambda body: library.process_add_member(
+                body["type"], body["name"], body.get("student_id"), body.get("department")).to_dict()),
+            "/issue": (200, lambda body: library.process_issue(_integer(body, "member_id"), body["isbn"]).to_dict()),
+            "/return": (200, lambda body: library.process_return(_integer(body, "member_id"), body["isbn"]).to_dict()),
+        }
+
+    def get_port(self):
+        return self._port
+
+    async def start(self):
+        self._writes = asyncio.Queue()
+        self._writer = asyncio.create_task(self._write_loop())
+        if self._refresh_interval:
+            self._follower = asyncio.create_task(self._follow_loop())
+        self._server = await asyncio.start_server(self._handle_connection, self._host, self._port)
+        # Port 0 asks the OS for a free port; report the one it picked.
+        self._port = self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        self._server.close()
+        await self._server.wait_closed()
+        # Let the writer finish the groups already queued before stopping it.
+        await self._writes.join()
+        self._writer.cancel()
+        if self._follower is not None:
+            self._follower.cancel()
+
+    async def _follow_loop(self):
+        while True:
+            await asyncio.sleep(self._refresh_interval)
+            try:
+                self._library.refresh()
+            except Exception as e:
+                print(f"Error refreshing the library: {e}")
+
+    async def _write_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            group = [await self._writes.get()]
+            while len(group) < self._max_group and not self._writes.empty():
+                group.append(self._writes.get_nowait())
+            outcomes = []
+            try:
+                with self._library.staged_batch() as records:
+                    for apply, body, future in group:
+                        try:
+                            outcomes.append((future, apply(body), None))
+                        except Exception as e:
+                            outcomes.append((future, None, e))
+                    if records:
+                        await loop.run_in_executor(None, self._library.persist_staged, records)
+            except Exception as e:
+                outcomes = [(future, None, e) for _, _, future in group]
+            for future, result, error in outcomes:
+                if future.cancelled():
+                    continue
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+            # Compaction runs here on the loop, between reads, rather than on the worker thread:
+            # in lazy mode it reopens the data files the reads are served from.
+            try:
+                self._library.compact_if_due()
+            except Exception as e:
+                print(f"Error compacting the journal: {e}")
+            self._stats["writes"] += len(group)
+            self._stats["groups"] += 1
+            self._stats["largest_group"] = max(self._stats["largest_group"], len(group))
+            for _ in group:
+                self._writes.task_done()
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                keep_alive = False
+                try:
+                    request_line, *header_lines = head.decode('latin-1').split("\r\n")
+                    method, target, version = request_line.split(" ", 2)
+                    headers = {}
+                    for line in header_lines:
+                        name, _, value = line.partition(":")
+                        headers[name.strip().lower()] = value.strip()
+                    connection = headers.get("connection", "").lower()
+                    keep_alive = connection == "keep-alive" or (version == "HTTP/1.1" and connection != "close")
+                    if "transfer-encoding" in headers:
+                        raise HttpError(400, "Chunked request bodies are not supported; send a Content-Length.")
+                    length = int(headers.get("content-length", 0))
+                    if length > MAX_BODY_SIZE:
+                        keep_alive = False
+                        raise HttpError(413, f"Request bodies are limited to {MAX_BODY_SIZE} bytes.")
+                    body = await reader.readexactly(length) if length else b""
+                    status, payload = await self._dispatch(method, target, body)
+                except HttpError as e:
+                    status, payload = e.status, {"error": str(e)}
+                except ValueError:
+                    status, payload, keep_alive = 400, {"error": "Malformed HTTP request."}, False
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                data = json.dumps(payload).encode()
+                writer.write(f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+                             f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                             f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method, target, body):
+        self._stats["requests"] += 1
+        url = urlsplit(target)
+        path = unquote(url.path).rstrip("/") or "/"
+        try:
+            if method == "GET":
+                return 200, self._read(path, parse_qs(url.query))
+            if path not in self._mutations:
+                raise HttpError(404, f"No such resource '{path}'.")
+            if method != "POST":
+                raise HttpError(405, f"{path} accepts POST only.")
+            data = json.loads(body or b"{}")
+            if not isinstance(data, dict):
+                raise ValueError("The request body must be a JSON object.")
+            status, apply = self._mutations[path]
+            future = asyncio.get_running_loop().create_future()
+            self._writes.put_nowait((apply, data, future))
+            return status, await future
+        except HttpError as e:
+            return e.status, {"error": str(e)}
+        except (BookNotFoundError, MemberNotFoundError) as e:
+            return 404, {"error": str(e)}
+        except LibraryError as e:
+            return 409, {"error": str(e)}
+        except KeyError as e:
+            return 400, {"error": f"Missing field {e}."}
+        except (ValueError, TypeError, AttributeError) as e:
+            return 400, {"error": str(e)}
+        except Exception as e:
+            return 500, {"error": f"An unexpected error occurred: {e}"}
+
+    def _read(self, path, query):
+        library = self._library
+        if path == "/books":
+            term = query.get("q", [""])[0]
+            limit = _count(query, "limit", "20")
+            if not term.strip():
+                # No search term: one page of the whole catalog in ISBN order.
+                books, cursor = library.page_books(query.get("after", [None])[0], limit)
+                return {"books": [book.to_dict() for book in books], "next": cursor}
+            offset = max(int(query.get("offset", ["0"])[0]), 0)
+            fuzzy = query.get("fuzzy", ["0"])[0].lower() in ("1", "true", "yes")
+            return {"books": [book.to_dict() for book in library.find_books(term, limit, offset, fuzzy)]}
+        if path.startswith("/books/"):
+            isbn = path[len("/books/"):]
+            book = library.get_book(isbn)
+            return dict(book.to_dict(), issued=library.get_issued_count(book.get_isbn()))
+        if path == "/members":
+            limit = _count(query, "limit", "20")
+            after = query.get("after", [None])[0]
+            members, cursor = library.page_members(None if after is None else int(after), limit)
+            return {"members": [member.to_dict() for member in members], "next": cursor}
+        if path.startswith("/members/"):
+            member = library.get_member(int(path[len("/members/"):]))
+            loans = [{"isbn": isbn, "due_date": due_date} for isbn, due_date in library.get_loans(member.get_member_id())]
+            return dict(member.to_dict(), loans=loans)
+        if path == "/analytics":
+            k = _count(query, "top", "10")
+            return library.get_analytics(k, author=query.get("author", [None])[0])
+        if path == "/stats":
+            return dict(self._stats, library=library.get_stats())
+        if path in self._mutations:
+            raise HttpError(405, f"{path} accepts POST only.")
+        raise HttpError(404, f"No such resource '{path}'.")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Library Management System HTTP/JSON service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--data-dir", default=".", help="directory holding the JSON data files")
+    parser.add_argument("--storage", choices=["json", "sqlite"], default="json", help="storage backend")
+    parser.add_argument("--db", help=f"SQLite database path (default: DATA_DIR/{SQLITE_FILE})")
+    parser.add_argument("--trusted-load", action="store_true", help="skip re-validating records from the JSON files at startup")
+    parser.add_argument("--lazy", action="store_true", help="load books and members from the JSON files on first use")
+    parser.add_argument("--shards", type=int, metavar="N", help="split the JSON files across N shard directories")
+    parser.add_argument("--change-stream", action="store_true", help=f"publish every change to {CHANGES_FILE} for read replicas")
+    parser.add_argument("--replica", action="store_true", help=f"serve reads only, following {CHANGES_FILE}")
+    parser.add_argument("--max-group", type=int, default=MAX_GROUP_COMMIT, help="most writes persisted together")
+    args = parser.parse_args(argv)
+    if args.lazy and args.storage == "sqlite":
+        parser.error("--lazy applies to the JSON storage only")
+    if args.shards and (args.lazy or args.storage == "sqlite"):
+        parser.error("--shards cannot be combined with --lazy or --storage sqlite")
+    if args.replica and (args.lazy or args.shards or args.change_stream or args.storage == "sqlite"):
+        parser.error("--replica cannot be combined with --lazy, --shards, --change-stream or --storage sqlite")
+    if args.change_stream and (args.shards or args.storage == "sqlite"):
+        parser.error("--change-stream applies to the unsharded JSON storage only")
+
+    storage = SQLiteStorage(args.db or os.path.join(args.data_dir, SQLITE_FILE)) if args.storage == "sqlite" else None
+    if args.replica:
+        storage = ReplicaStorage(args.data_dir, trusted=args.trusted_load)
+    library = LibrarySystem(data_dir=args.data_dir, storage=storage, trusted_load=args.trusted_load, lazy=args.lazy,
+                            shards=args.shards, change_stream=args.change_stream)
+    server = LibraryServer(library, args.host, args.port, args.max_group,
+                           REPLICA_POLL_INTERVAL if args.replica else None)
+
+    async def serve():
+        await server.start()
+        # Stop on Ctrl+C or SIGTERM once the queued writes are persisted.
+        stop = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                asyncio.get_running_loop().add_signal_handler(signum, stop.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+        print(f"Serving the library on http://{args.host}:{server.get_port()}")
+        await stop.wait()
+        await server.close()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        library.compact()
+        library.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,2949 @@
+import gc
+import heapq
+import json
+import mmap
+import os
+import re
+import sqlite3
+import struct
+import sys
+import time
+import zlib
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from array import array
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: shared mode is unavailable.
+    fcntl = None
+
+from library_analytics import SQLiteCirculationStats
+from library_models import Book, ColumnarCatalog, Faculty, Member, ReadOnlyCatalogError, Student
+from library_search import BookSearchIndex, LazySearchIndex, ShardedSearchIndex, SQLiteSearchIndex, TokenIndex
+
+BOOKS_FILE = 'books.json'
+MEMBERS_FILE = 'members.json'
+ISSUED_BOOKS_FILE = 'issued_books.json'
+JOURNAL_FILE = 'journal.log'
+JOURNAL_COMPACT_THRESHOLD = 1000
+META_FILE = 'library_meta.json'
+LOCK_FILE = 'library.lock'
+SQLITE_FILE = 'library.db'
+BOOKS_INDEX_FILE = 'books.idx'
+MEMBERS_INDEX_FILE = 'members.idx'
+TOKENS_FILE = 'books.tok'
+BOOKS_SNAPSHOT_FILE = 'books.snap'
+MEMBERS_SNAPSHOT_FILE = 'members.snap'
+ISSUED_BOOKS_SNAPSHOT_FILE = 'issued_books.snap'
+CATALOG_FILE = 'books.cat'
+ANALYTICS_FILE = 'analytics.json'
+OVERDUE_FILE = 'overdue.json'
+SHARDS_FILE = 'shards.json'
+CHANGES_FILE = 'changes.log'
+CHANGES_ROTATE_SIZE = 16 << 20
+REPLICA_BOOTSTRAP_ATTEMPTS = 3
+SHARD_DIR = 'shard-{:02d}'
+LAZY_CACHE_SIZE = 10000
+
+def _write_json_atomic(path, data, compact=False):
+    # Write to a temporary file and swap it in, so a crash never leaves a half-written store.
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        if compact:
+            json.dump(data, f, separators=(',', ':'))
+        else:
+            json.dump(data, f, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+    os.replace(tmp_path, path)
+    return size
+
+def _write_json_array(f, records, level, on_record):
+    # One array laid out the way json.dump(indent=4) lays it out at nesting depth `level`.
+    pad = "\n" + " " * (4 * (level + 1))
+    # Flat records, nearly all of them, get the same layout from the C encoder via the item
+    # separator; indent= would send every record through the pure-Python encoder.
+    field_separator = ",\n" + " " * (4 * (level + 2))
+    flat_encoder = json.JSONEncoder(separators=(field_separator, ": "))
+    opened = False
+    for record in records:
+        f.write((("," if opened else "[") + pad).encode())
+        opened = True
+        if not record or any(isinstance(value, (dict, list)) for value in record.values()):
+            text = json.dumps(record, indent=4).replace("\n", pad).encode()
+        else:
+            text = ("{" + field_separator[1:] + flat_encoder.encode(record)[1:-1] + pad + "}").encode()
+        if on_record is not None:
+            on_record(record, f.tell(), len(text))
+        f.write(text)
+    f.write(("\n" + " " * (4 * level) + "]").encode() if opened else b"[]")
+
+def _write_json_records_atomic(path, records, on_record=None):
+    # Streams records to disk instead of building the whole document first. `records` is an
+    # iterable (a top-level array) or a dict of iterables (an object of arrays), and
+    # on_record(record, offset, length) is told the byte span every record was written to.
+    # Returns the number of bytes written, as _write_json_atomic does.
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        if isinstance(records, dict):
+            f.write(b"{")
+            for i, (key, items) in enumerate(records.items()):
+                f.write(f"{',' if i else ''}\n    {json.dumps(key)}: ".encode())
+                _write_json_array(f, items, 1, on_record)
+            f.write(b"\n}" if records else b"}")
+        else:
+            _write_json_array(f, records, 0, on_record)
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+    os.replace(tmp_path, path)
+    return size
+
+class JsonStreamReader:
+    # Incremental reader for the data files: decodes one array element or object member
+    # at a time from a bounded buffer, instead of json.load()-ing the whole file at once.
+    WHITESPACE = re.compile(r"[ \t\r\n]*")
+    SEPARATOR = re.compile(r"[ \t\r\n]*([,\]}])[ \t\r\n]*")
+
+    def __init__(self, f, chunk_size=1 << 16):
+        self._f = f
+        self._chunk_size = chunk_size
+        self._buffer = ""
+        self._pos = 0
+        # Offset in the file of self._buffer[0], so values can be located in the file.
+        self._offset = 0
+        self._start = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self):
+        chunk = self._f.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        self._offset += self._pos
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _peek(self):
+        while True:
+            self._pos = self.WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return ""
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise json.JSONDecodeError(f"Expecting '{char}'", self._buffer, self._pos)
+        self._pos += 1
+
+    def _value(self):
+        self._peek()
+        self._start = self._offset + self._pos
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+                # A value ending exactly at the buffer edge may continue in the next chunk.
+                if end < len(self._buffer) or self._eof:
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            self._fill()
+
+    def _separator(self, close):
+        match = self.SEPARATOR.match(self._buffer, self._pos)
+        if match and match.end() < len(self._buffer):
+            char = match.group(1)
+            self._pos = match.end()
+        else:
+            char = self._peek()
+            self._pos += 1
+        if char not in (",", close):
+            raise json.JSONDecodeError(f"Expecting ',' or '{close}'", self._buffer, self._pos - 1)
+        return char == close
+
+    def _members(self, close, read_item):
+        if self._peek() == close:
+            self._pos += 1
+            return
+        while True:
+            yield read_item()
+            if self._separator(close):
+                return
+
+    def _key(self):
+        key = self._value()
+        if not isinstance(key, str):
+            raise json.JSONDecodeError("Expecting property name", self._buffer, self._pos)
+        self._expect(":")
+        return key
+
+    def _key_value(self):
+        return self._key(), self._value()
+
+    def iter_array(self, spans=False):
+        # Elements of a top-level array, e.g. books.json. With spans=True each element comes
+        # with the (start, end) offsets of its text, in characters from the start of the file.
+        self._expect("[")
+        if self._peek() == "]":
+            self._pos += 1
+            return
+        decode = self._decoder.raw_decode
+        separator = self.SEPARATOR.match
+        while True:
+            # Fast path: the element and the separator after it both lie inside the buffer.
+            try:
+                start = self._pos
+                value, end = decode(self._buffer, start)
+                match = separator(self._buffer, end)
+            except json.JSONDecodeError:
+                match = None
+            if match is not None and match.end() < len(self._buffer) and match.group(1) in ",]":
+                self._pos = match.end()
+                yield (value, self._offset + start, self._offset + end) if spans else value
+                if match.group(1) == "]":
+                    return
+                continue
+            value = self._value()
+            yield (value, self._start, self._offset + self._pos) if spans else value
+            if self._separator("]"):
+                return
+
+    def iter_object(self):
+        # (key, value) pairs of a top-level object, e.g. issued_books.json.
+        self._expect("{")
+        yield from self._members("}", self._key_value)
+
+    def iter_object_arrays(self, spans=False):
+        # (key, element) pairs of a top-level object of arrays, e.g. members.json.
+        self._expect("{")
+        # Each key is yielded before its array is read, so the array is consumed in place.
+        for key in self._members("}", self._key):
+            for item in self.iter_array(spans):
+                yield key, item
+
+class OffsetIndex:
+    # Sorted, fixed-width text index from a record key (ISBN or member ID) to the byte span of
+    # that record in books.json/members.json. Lookups binary-search the memory-mapped file, so
+    # opening it costs the same for any catalog size. The header stamps the size and mtime of
+    # the data file it describes, so an index left stale by an outside edit is detected.
+    MAGIC = b"LIBIDX1"
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._start = self._map.find(b"\n") + 1
+        fields = self._map[:self._start].split()
+        if len(fields) != 7 or fields[0] != self.MAGIC:
+            self._map.close()
+            raise ValueError(f"{path} is not an offset index.")
+        self._stamp = (int(fields[1]), int(fields[2]))
+        self._count = int(fields[3])
+        self._key_width = int(fields[4])
+        self._numeric = fields[6] == b"1"
+        # key, 15-digit offset, 10-digit length and extra, separated by spaces and newline-terminated
+        self._stride = self._key_width + int(fields[5]) + 29
+        if len(self._map) != self._start + self._count * self._stride:
+            self._map.close()
+            raise ValueError(f"{path} is truncated.")
+
+    @staticmethod
+    def _pad(key, width, numeric):
+        return key.rjust(width, b"0") if numeric else key.ljust(width)
+
+    @classmethod
+    def write(cls, path, data_path, entries, numeric=False):
+        # entries are (key, offset, length, extra) in file order; for a repeated key the
+        # last record wins, as it does when the file is loaded eagerly.
+        entries = [(str(key).encode(), offset, length, extra.encode()) for key, offset, length, extra in entries]
+        key_width = max((len(entry[0]) for entry in entries), default=1)
+        extra_width = max((len(entry[3]) for entry in entries), default=0)
+        entries = [(cls._pad(key, key_width, numeric), i, offset, length, extra)
+                   for i, (key, offset, length, extra) in enumerate(entries)]
+        entries.sort()
+        entries = [entry for i, entry in enumerate(entries) if i + 1 == len(entries) or entries[i + 1][0] != entry[0]]
+        stat = os.stat(data_path)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(b"%s %d %d %d %d %d %d\n" % (cls.MAGIC, stat.st_size, stat.st_mtime_ns, len(entries),
+                                                key_width, extra_width, numeric))
+            for key, _, offset, length, extra in entries:
+                f.write(b"%s %015d %010d %s\n" % (key, offset, length, extra.ljust(extra_width)))
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+        os.replace(tmp_path, path)
+        return size
+
+    def is_current(self, data_path):
+        stat = os.stat(data_path)
+        return self._stamp == (stat.st_size, stat.st_mtime_ns)
+
+    def _entry(self, i):
+        line = self._map[self._start + i * self._stride:self._start + (i + 1) * self._stride]
+        key = line[:self._key_width]
+        offset, length = int(line[self._key_width + 1:self._key_width + 16]), int(line[self._key_width + 17:self._key_width + 27])
+        key = int(key) if self._numeric else key.rstrip(b" ").decode()
+        return key, offset, length, line[self._key_width + 28:-1].rstrip(b" ").decode()
+
+    def find(self, key):
+        # (offset, length, extra) of the record stored under key, or None.
+        if self._numeric != isinstance(key, int):
+            return None
+        key = str(key).encode()
+        if len(key) > self._key_width:
+            return None
+        key = self._pad(key, self._key_width, self._numeric)
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            position = self._start + mid * self._stride
+            probe = self._map[position:position + self._key_width]
+            if probe < key:
+                lo = mid + 1
+            elif probe > key:
+                hi = mid
+            else:
+                return self._entry(mid)[1:]
+        return None
+
+    def entries(self):
+        for i in range(self._count):
+            yield self._entry(i)
+
+    def last_key(self):
+        return self._entry(self._count - 1)[0] if self._count else None
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        self._map.close()
+
+class BinarySnapshot:
+    # Compact alternative to the JSON snapshots: a header holding a magic number, the format
+    # version, flags and the CRC-32 and length of the payload, then a payload of length-prefixed
+    # blocks, optionally zlib-compressed. Each block is one whole column (every title, every
+    # quantity, ...), so a store is written and read with a few bulk operations instead of
+    # encoding and decoding one JSON object per record.
+    MAGIC = b"LIBSNAP\x00"
+    VERSION = 1
+    COMPRESSED = 1
+    HEADER = struct.Struct("<8sHHIQ")
+    LENGTH = struct.Struct("<Q")
+
+    @classmethod
+    def write(cls, path, blocks, compress=False):
+        # Returns the number of bytes written.
+        payload = b"".join(part for block in blocks for part in (cls.LENGTH.pack(len(block)), block))
+        if compress:
+            payload = zlib.compress(payload, 1)
+        header = cls.HEADER.pack(cls.MAGIC, cls.VERSION, cls.COMPRESSED if compress else 0, zlib.crc32(payload),
+                                 len(payload))
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(header)
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return len(header) + len(payload)
+
+    @classmethod
+    def read(cls, path):
+        # Returns (blocks, compressed); raises ValueError for anything but an intact snapshot.
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) < cls.HEADER.size:
+            raise ValueError(f"{path} is truncated.")
+        magic, version, flags, checksum, length = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC:
+            raise ValueError(f"{path} is not a library snapshot.")
+        if version > cls.VERSION:
+            raise ValueError(f"{path} was written by a newer version (snapshot format {version}).")
+        payload = memoryview(data)[cls.HEADER.size:]
+        if len(payload) != length or zlib.crc32(payload) != checksum:
+            raise ValueError(f"{path} failed its checksum; the snapshot is corrupted.")
+        if flags & cls.COMPRESSED:
+            payload = memoryview(zlib.decompress(payload))
+        blocks = []
+        position = 0
+        while position < len(payload):
+            size = cls.LENGTH.unpack_from(payload, position)[0]
+            position += cls.LENGTH.size
+            blocks.append(payload[position:position + size])
+            position += size
+        return blocks, bool(flags & cls.COMPRESSED)
+
+    @staticmethod
+    def pack_strings(strings):
+        # One UTF-8 block per column. Strings are NUL-separated unless one of them contains a NUL,
+        # in which case their lengths are stored in front of the text instead.
+        text = "\0".join(strings)
+        if text.count("\0") == max(len(strings) - 1, 0):
+            return b"\0" + text.encode('utf-8', 'surrogatepass')
+        lengths = BinarySnapshot.pack_ints(map(len, strings))
+        return b"\1" + BinarySnapshot.LENGTH.pack(len(lengths)) + lengths + "".join(strings).encode('utf-8', 'surrogatepass')
+
+    @staticmethod
+    def unpack_strings(block, count):
+        if not count:
+            return []
+        if block[0] == 0:
+            return bytes(block[1:]).decode('utf-8', 'surrogatepass').split("\0")
+        size = BinarySnapshot.LENGTH.unpack_from(block, 1)[0]
+        start = 1 + BinarySnapshot.LENGTH.size
+        text = bytes(block[start + size:]).decode('utf-8', 'surrogatepass')
+        strings = []
+        position = 0
+        for length in BinarySnapshot.unpack_ints(block[start:start + size]):
+            strings.append(text[position:position + length])
+            position += length
+        return strings
+
+    @staticmethod
+    def pack_ints(values):
+        # Little-endian 64-bit integers, whatever the byte order of the machine writing them.
+        column = array('q', values)
+        if sys.byteorder == "big":
+            column.byteswap()
+        return column.tobytes()
+
+    @staticmethod
+    def unpack_ints(block):
+        column = array('q')
+        column.frombytes(block)
+        if sys.byteorder == "big":
+            column.byteswap()
+        return column
+
+class MappedCatalog:
+    # Read-only catalog for lookup kiosks: a header, fixed-stride records sorted by ISBN, then a
+    # string heap holding the UTF-8 text the records point into. Lookups binary-search the
+    # memory-mapped records, so opening costs the same for any catalog size and every process
+    # shares the OS page cache instead of keeping its own copy. The header stamps the size and
+    # mtime of the books.json/books.snap it was built from; when the file is replaced, open
+    # catalogs notice within CHECK_INTERVAL seconds and remap it. Books changed since the file
+    # was built (see CatalogStorage) are layered on top of the mapped records.
+    MAGIC = b"LIBCAT1\x00"
+    HEADER = struct.Struct("<8sQQq")  # magic, record count, source size, source mtime_ns
+    # (heap offset, length) of the ISBN, title, author and holds JSON, then the two quantities.
+    RECORD = struct.Struct("<QIQIQIQIqq")
+    KEY = struct.Struct("<QI")
+    CHECK_INTERVAL = 1.0
+
+    def __init__(self, path):
+        self._path = path
+        self._map = None
+        self._changed = {}   # isbn -> Book, in place of the mapped record
+        self._added = []     # the ISBNs in _changed that have no mapped record, in the order added
+        self._open()
+
+    def _open(self):
+        with open(self._path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, count, source_size, source_mtime = self.HEADER.unpack_from(mapped)
+            if magic != self.MAGIC:
+                raise ValueError(f"{self._path} is not a catalog file.")
+            if stat.st_size < self.HEADER.size + count * self.RECORD.size:
+                raise ValueError(f"{self._path} is truncated.")
+        except (ValueError, struct.error):
+            mapped.close()
+            raise
+        self.close()
+        self._map = mapped
+        self._count = count
+        self._heap = self.HEADER.size + count * self.RECORD.size
+        self._source_stamp = (source_size, source_mtime)
+        self._file_stamp = (stat.st_ino, stat.st_mtime_ns)
+        self._next_check = time.monotonic() + self.CHECK_INTERVAL
+
+    @classmethod
+    def write(cls, path, books, source_path):
+        # Builds the file from Book-like objects; returns the number of bytes written.
+        try:
+            stat = os.stat(source_path)
+            source_stamp = (stat.st_size, stat.st_mtime_ns)
+        except FileNotFoundError:
+            source_stamp = (0, 0)
+        entries = sorted(((book.get_isbn().encode('utf-8', 'surrogatepass'), book) for book in books),
+                         key=lambda entry: entry[0])
+        heap = bytearray()
+        records = []
+        for isbn, book in entries:
+            fields = []
+            for text in (isbn, book.get_title().encode('utf-8', 'surrogatepass'),
+                         book.get_author().encode('utf-8', 'surrogatepass'),
+                         json.dumps(list(book.get_holds())).encode() if book.get_holds() else b""):
+                fields += (len(heap), len(text))
+                heap += text
+            records.append(cls.RECORD.pack(*fields, book.get_total_quantity(), book.get_available_quantity()))
+        # Several kiosks may rebuild a stale catalog at once, so each writes its own temporary file.
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(cls.HEADER.pack(cls.MAGIC, len(records), *source_stamp))
+            f.write(b"".join(records))
+            f.write(heap)
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+        os.replace(tmp_path, path)
+        return size
+
+    def is_current(self, source_path):
+        try:
+            stat = os.stat(source_path)
+        except FileNotFoundError:
+            return self._source_stamp == (0, 0)
+        return self._source_stamp == (stat.st_size, stat.st_mtime_ns)
+
+    def refresh(self):
+        # Remaps the file if it was replaced since it was opened.
+        self._next_check = time.monotonic() + self.CHECK_INTERVAL
+        try:
+            stat = os.stat(self._path)
+        except FileNotFoundError:
+            return
+        if (stat.st_ino, stat.st_mtime_ns) != self._file_stamp:
+            self._open()
+
+    def _text(self, offset, length):
+        start = self._heap + offset
+        return self._map[start:start + length].decode('utf-8', 'surrogatepass')
+
+    def _find(self, isbn):
+        if time.monotonic() >= self._next_check:
+            self.refresh()
+        if not isinstance(isbn, str):
+            return None
+        key = isbn.encode('utf-8', 'surrogatepass')
+        mapped, heap, base, stride, unpack = self._map, self._heap, self.HEADER.size, self.RECORD.size, self.KEY.unpack_from
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset, length = unpack(mapped, base + mid * stride)
+            if mapped[heap + offset:heap + offset + length] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._count:
+            offset, length = unpack(mapped, base + lo * stride)
+            if mapped[heap + offset:heap + offset + length] == key:
+                return lo
+        return None
+
+    def _book(self, row):
+        (isbn_offset, isbn_length, title_offset, title_length, author_offset, author_length,
+         holds_offset, holds_length, total_quantity, available_quantity) = self.RECORD.unpack_from(
+            self._map, self.HEADER.size + row * self.RECORD.size)
+        data = {"title": self._text(title_offset, title_length), "author": self._text(author_offset, author_length),
+                "isbn": self._text(isbn_offset, isbn_length), "total_quantity": total_quantity,
+                "available_quantity": available_quantity}
+        if holds_length:
+            data["holds"] = json.loads(self._text(holds_offset, holds_length))
+        return Book.from_dict(data, trusted=True)
+
+    def get(self, isbn, default=None):
+        book = self._changed.get(isbn) if isinstance(isbn, str) else None
+        if book is not None:
+            return book
+        row = self._find(isbn)
+        return default if row is None else self._book(row)
+
+    def __getitem__(self, isbn):
+        book = self.get(isbn)
+        if book is None:
+            raise KeyError(isbn)
+        return book
+
+    def __setitem__(self, isbn, book):
+        raise ReadOnlyCatalogError("This catalog is read-only; make changes at a desk that loads the full catalog.")
+
+    def __contains__(self, isbn):
+        return (isinstance(isbn, str) and isbn in self._changed) or self._find(isbn) is not None
+
+    def __len__(self):
+        return self._count + len(self._added)
+
+    def _isbn(self, row):
+        offset, length = self.KEY.unpack_from(self._map, self.HEADER.size + row * self.RECORD.size)
+        return self._text(offset, length)
+
+    def __iter__(self):
+        for row in range(self._count):
+            yield self._isbn(row)
+        yield from list(self._added)
+
+    def keys(self):
+        return iter(self)
+
+    def values(self):
+        for row in range(self._count):
+            book = self._changed.get(self._isbn(row)) if self._changed else None
+            yield book if book is not None else self._book(row)
+        for isbn in list(self._added):
+            yield self._changed[isbn]
+
+    def items(self):
+        return ((book.get_isbn(), book) for book in self.values())
+
+    def set_changed(self, book):
+        # Layers a book changed since the file was built over its mapped record, if any.
+        isbn = book.get_isbn()
+        if isbn not in self._changed and self._find(isbn) is None:
+            self._added.append(isbn)
+        self._changed[isbn] = book
+
+    def clear_changed(self):
+        self._changed.clear()
+        self._added.clear()
+
+    def changed(self):
+        return list(self._changed.values())
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+class LazyStore:
+    # Lazy mode's stand-in for the _books/_members dicts: records stay in the JSON file and are
+    # materialized from their indexed byte span on first access. The most recently used clean
+    # objects are kept in an LRU; changed ones are pinned until the next save writes them back.
+    def __init__(self, path, index, scan, key_of, decode, label, cache_size=LAZY_CACHE_SIZE):
+        self._path = path
+        self._index = index    # OffsetIndex, or None when there is no data file yet
+        self._scan = scan      # yields (kind, record) for every record in file order
+        self._key_of = key_of
+        self._decode = decode  # (record, kind) -> object; kind is the first character of the index extra
+        self._label = label
+        self._cache_size = cache_size
+        self._cache = OrderedDict()
+        self._dirty = {}
+        self._new = set()      # dirty keys the index does not know about yet
+        self._file = None
+
+    def _find(self, key):
+        return self._index.find(key) if self._index is not None else None
+
+    def _materialize(self, data, kind):
+        try:
+            return self._decode(data, kind)
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"Error loading {self._label} data: {data} - {e}")
+            return None
+
+    def get(self, key, default=None):
+        if key in self._dirty:
+            return self._dirty[key]
+        obj = self._cache.get(key)
+        if obj is not None:
+            self._cache.move_to_end(key)
+            return obj
+        span = self._find(key)
+        if span is None:
+            return default
+        if self._file is None:
+            self._file = open(self._path, 'rb')
+        self._file.seek(span[0])
+        obj = self._materialize(json.loads(self._file.read(span[1])), span[2][:1])
+        if obj is None:
+            return default
+        self._cache[key] = obj
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return obj
+
+    def __getitem__(self, key):
+        obj = self.get(key)
+        if obj is None:
+            raise KeyError(key)
+        return obj
+
+    def __setitem__(self, key, obj):
+        if key not in self._dirty:
+            self._cache.pop(key, None)
+            if self._find(key) is None:
+                self._new.add(key)
+        self._dirty[key] = obj
+
+    def __contains__(self, key):
+        return key in self._dirty or self._find(key) is not None
+
+    def __len__(self):
+        return (len(self._index) if self._index is not None else 0) + len(self._new)
+
+    def __iter__(self):
+        return self.keys()
+
+    def keys(self):
+        if self._index is not None:
+            for key, _, _, _ in self._index.entries():
+                yield key
+        yield from list(self._new)
+
+    def items(self):
+        # Streams the data file rather than seeking record by record; nothing read here enters the LRU.
+        seen = set()
+        for kind, data in (self._scan() if self._index is not None else ()):
+            try:
+                key = self._key_of(data)
+            except (KeyError, TypeError, ValueError):
+                key = None
+            if key in self._dirty:
+                seen.add(key)
+                yield key, self._dirty[key]
+                continue
+            obj = self._cache.get(key) if key is not None else None
+            if obj is None:
+                obj = self._materialize(data, kind)
+            if obj is not None:
+                yield key, obj
+        for key, obj in list(self._dirty.items()):
+            if key not in seen:
+                yield key, obj
+
+    def values(self):
+        for _, obj in self.items():
+            yield obj
+
+    def changed(self):
+        # The objects changed since the last save, which the data file does not hold yet.
+        return list(self._dirty.values())
+
+    def extras(self):
+        # (key, extra) for every record in the index; changes since the last save are not included.
+        if self._index is not None:
+            for key, _, _, extra in self._index.entries():
+                yield key, extra
+
+    def reopen(self, index):
+        # The data file was just rewritten with every dirty object in it, so they turn clean.
+        self.close()
+        self._index = index
+        for key, obj in self._dirty.items():
+            self._cache[key] = obj
+        self._dirty.clear()
+        self._new.clear()
+        while len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._index is not None:
+            self._index.close()
+
+class DeferredDict(dict):
+    # A dict that loader(self) fills the first time it is used, e.g. the member indexes in lazy mode.
+    def __init__(self, loader):
+        super().__init__()
+        self._loader = loader
+
+    def _load(self):
+        if self._loader is not None:
+            loader, self._loader = self._loader, None
+            loader(self)
+
+    def get(self, key, default=None):
+        self._load()
+        return super().get(key, default)
+
+    def setdefault(self, key, default=None):
+        self._load()
+        return super().setdefault(key, default)
+
+    def __getitem__(self, key):
+        self._load()
+        return super().__getitem__(key)
+
+    def __setitem__(self, key, value):
+        self._load()
+        super().__setitem__(key, value)
+
+    def __contains__(self, key):
+        self._load()
+        return super().__contains__(key)
+
+    def __len__(self):
+        self._load()
+        return super().__len__()
+
+    def __iter__(self):
+        self._load()
+        return super().__iter__()
+
+    def items(self):
+        self._load()
+        return super().items()
+
+    def values(self):
+        self._load()
+        return super().values()
+
+    def keys(self):
+        self._load()
+        return super().keys()
+
+class ChangeStream:
+    # changes.log: every change record applied at any desk, numbered by "seq", for read replicas
+    # to tail. Records are post-images, like the journal's, but the stream outlives compaction.
+    # Each file starts with a {"op": "checkpoint", "seq": n} line, n being the seq of the last
+    # event before it; once it passes CHANGES_ROTATE_SIZE, compaction (which has folded every
+    # event so far into the snapshots) replaces it with a fresh file that starts where it ended.
+    def __init__(self, path):
+        self._path = path
+        self._fd = None
+        self._ino = None
+        self._offset = 0
+        self._seq = 0
+        # Reader side: the open file, its inode, and a torn last line held back until complete.
+        self._reader = None
+        self._reader_ino = None
+        self._partial = b""
+
+    def exists(self):
+        return os.path.exists(self._path)
+
+    def _start(self, seq):
+        data = json.dumps({"op": "checkpoint", "seq": seq}) + "\n"
+        tmp_path = f"{self._path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._path)
+        return len(data)
+
+    def _catch_up(self, base):
+        # Follows what other desks appended (or a rotation by one of them) since this desk last
+        # wrote, so the next seq is one past the last in the file. Only the file's tail is read.
+        try:
+            stat = os.stat(self._path)
+        except FileNotFoundError:
+            self._start(base)
+            stat = os.stat(self._path)
+        if stat.st_ino != self._ino:
+            if self._fd is not None:
+                os.close(self._fd)
+            self._fd = os.open(self._path, os.O_WRONLY | os.O_APPEND)
+            self._ino = stat.st_ino
+            self._offset = 0
+        if stat.st_size != self._offset:
+            with open(self._path, 'rb') as f:
+                f.seek(max(0, stat.st_size - 65536))
+                lines = f.read().split(b"\n")
+            self._seq = json.loads(lines[-2])["seq"]
+            self._offset = stat.st_size
+
+    def last_seq(self, base=0):
+        self._catch_up(base)
+        return self._seq
+
+    def publish(self, records, base=0):
+        # O_APPEND writes under the desks' lock, so lines from several desks never interleave.
+        # Not fsync'd: the journal is the durable copy, and a replica only reads what reached the
+        # page cache. The records' seqs are only taken once all of them are written; if a write
+        # fails, whatever part of them reached the file is cut off again and the error raised.
+        self._catch_up(base)
+        seq = self._seq
+        lines = []
+        for record in records:
+            seq += 1
+            lines.append(json.dumps(dict(record, seq=seq), separators=(',', ':')) + "\n")
+        data = "".join(lines).encode()
+        written = 0
+        try:
+            while written < len(data):
+                written += os.write(self._fd, data[written:])
+        except OSError:
+            if written:
+                try:
+                    os.ftruncate(self._fd, self._offset)
+                except OSError as e:
+                    print(f"Error truncating the torn end of {self._path}: {e}")
+            raise
+        self._seq = seq
+        self._offset += len(data)
+        return len(data)
+
+    def rotate(self, seq, force=False):
+        # Called at compaction, once the snapshots hold every event up to seq. force=True starts a
+        # new file however small this one is; after events that were never published, its
+        # checkpoint is ahead of the last event replicas read, which sends them back to the snapshots.
+        if self._offset < CHANGES_ROTATE_SIZE and not force:
+            return 0
+        size = self._start(seq)
+        self._catch_up(seq)
+        return size
+
+    def seek(self, after):
+        # Positions the reader just past event `after`, bisecting the file on the seq of the first
+        # whole line after each probe. False if the file starts later than that (it was rotated).
+        reader = open(self._path, 'rb')
+        try:
+            first = json.loads(reader.readline())["seq"]
+        except (ValueError, KeyError, TypeError):
+            first = None
+        if first is None or first > after:
+            reader.close()
+            return False
+        lo, hi = 0, os.fstat(reader.fileno()).st_size
+        while hi - lo > 65536:
+            mid = (lo + hi) // 2
+            reader.seek(mid)
+            reader.readline()
+            line = reader.readline()
+            if line.endswith(b"\n") and json.loads(line)["seq"] <= after:
+                lo = mid
+            else:
+                hi = mid
+        reader.seek(lo)
+        if lo:
+            reader.readline()
+        while True:
+            position = reader.tell()
+            line = reader.readline()
+            if not line.endswith(b"\n") or json.loads(line)["seq"] > after:
+                reader.seek(position)
+                break
+        if self._reader is not None:
+            self._reader.close()
+        self._reader = reader
+        self._reader_ino = os.fstat(reader.fileno()).st_ino
+        self._partial = b""
+        return True
+
+    def read(self):
+        # The records appended since the last read, following the stream into a new file after a
+        # rotation. The path is checked before the old file is drained, so nothing written to the
+        # old file before the rotation is missed.
+        records = []
+        while True:
+            try:
+                rotated = os.stat(self._path).st_ino != self._reader_ino
+            except FileNotFoundError:
+                rotated = False
+            data = self._partial + self._reader.read()
+            lines = data.split(b"\n")
+            self._partial = lines.pop()
+            records.extend(json.loads(line) for line in lines)
+            if not rotated:
+                return records
+            self._reader.close()
+            self._reader = open(self._path, 'rb')
+            self._reader_ino = os.fstat(self._reader.fileno()).st_ino
+            self._partial = b""
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+class JsonStorage:
+    # The JSON backend: books.json, members.json and issued_books.json snapshots plus the
+    # append-only journal. It loads into and saves from the LibrarySystem it is opened with.
+    def __init__(self, data_dir='.', use_journal=True, shared=False, streaming=True, trusted=False, lazy=False,
+                 cache_size=LAZY_CACHE_SIZE, snapshot_format=None, compress=False, change_stream=False):
+        self._library = None
+        # streaming=True parses the snapshots record by record with JsonStreamReader;
+        # trusted=True skips re-validating records that were validated before being saved.
+        self._streaming = streaming
+        self._trusted = trusted
+        # lazy=True reads only the offset indexes at startup and materializes books and members
+        # on first access, keeping at most cache_size clean ones of each in memory.
+        self._lazy = lazy
+        self._cache_size = cache_size
+        self._books_index_file = os.path.join(data_dir, BOOKS_INDEX_FILE)
+        self._members_index_file = os.path.join(data_dir, MEMBERS_INDEX_FILE)
+        # Word index that lazy mode and kiosks search instead of reading the whole catalog.
+        self._tokens_file = os.path.join(data_dir, TOKENS_FILE)
+        self._tokens = None
+        self._books_file = os.path.join(data_dir, BOOKS_FILE)
+        self._members_file = os.path.join(data_dir, MEMBERS_FILE)
+        self._issued_books_file = os.path.join(data_dir, ISSUED_BOOKS_FILE)
+        # Snapshot format: "json", "binary" (BinarySnapshot files, zlib-compressed if compress=True),
+        # or None to save every store in the format it was found in, JSON for new stores.
+        if snapshot_format not in (None, "json", "binary"):
+            raise ValueError(f"Unknown snapshot format '{snapshot_format}'.")
+        self._snapshot_format = snapshot_format
+        self._compress = compress
+        self._formats = {}  # store -> ("json" or "binary", compressed) as last loaded or saved
+        self._snapshot_files = {"books": os.path.join(data_dir, BOOKS_SNAPSHOT_FILE),
+                                "members": os.path.join(data_dir, MEMBERS_SNAPSHOT_FILE),
+                                "issued": os.path.join(data_dir, ISSUED_BOOKS_SNAPSHOT_FILE)}
+        # Lookup kiosks map the catalog from books.cat (see CatalogStorage); once one exists it is
+        # rebuilt every time books are saved.
+        self._catalog_file = os.path.join(data_dir, CATALOG_FILE)
+        self._journal_file = os.path.join(data_dir, JOURNAL_FILE)
+        self._meta_file = os.path.join(data_dir, META_FILE)
+        # Circulation analytics as of the last compaction; the journal holds the events since.
+        self._analytics_file = os.path.join(data_dir, ANALYTICS_FILE)
+        # Where the nightly overdue pass stopped (see OverdueSchedule).
+        self._overdue_file = os.path.join(data_dir, OVERDUE_FILE)
+        # Present once ShardedStorage has split the directory (see _refuse_sharded).
+        self._layout_file = os.path.join(data_dir, SHARDS_FILE)
+        self._analytics_stamp = None
+        # change_stream=True publishes every change to changes.log for read replicas; once the file
+        # exists, every desk publishes. The checkpoint, saved with the analytics, is the seq of the
+        # last event the snapshots hold.
+        self._stream = ChangeStream(os.path.join(data_dir, CHANGES_FILE))
+        self._change_stream = change_stream
+        self._publishing = False
+        self._checkpoint = None
+        # Changes committed since a publish failed, which replicas have not seen (see _publish).
+        self._unpublished = 0
+        self._lock_file = os.path.join(data_dir, LOCK_FILE)
+        # Persistence mode: append one record per mutation and fold the journal
+        # into the JSON snapshots during compaction, instead of rewriting them every time.
+        self._use_journal = use_journal
+        self._journal = None
+        self._journal_records = 0
+        self._journal_offset = 0
+        # Stores ("books", "members", "issued") changed since they were last written.
+        self._dirty = set()
+        # Multi-desk mode: several processes share one data directory. Every mutation
+        # runs under an advisory lock and first catches up with what the other desks wrote,
+        # using the version stamps in META_FILE to reload only the stores that changed.
+        if shared and fcntl is None:
+            raise ValueError("Shared mode needs fcntl file locking, which is not available on this platform.")
+        self._shared = shared
+        self._lock_fd = None
+        self._lock_depth = 0
+        self._versions = {"books": 0, "members": 0, "issued": 0}
+        self._generation = 0
+        self._meta_stamp = None
+        # An Instrumentation to report bytes written to, set while instrumentation is enabled.
+        self._stats = None
+
+    def open(self, library):
+        if self._lazy and library._columnar:
+            raise ValueError("Lazy mode keeps its own catalog and cannot be combined with columnar=True.")
+        if self._lazy and (self._snapshot_format == "binary" or any(map(self._binary_snapshot, ("books", "members")))):
+            raise ValueError("Lazy mode reads the JSON files; convert binary snapshots back with 'convert --to json'.")
+        self._refuse_sharded()
+        self._library = library
+        # (Re)loading replays the whole journal.
+        self._journal_offset = 0
+        self._journal_records = 0
+        # Loaded records hold no reference cycles, so pausing the cyclic garbage collector
+        # spares it from rescanning the growing heap while millions of objects are created.
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            with self.locked(refresh=False):
+                self._read_meta()
+                self._load_books()
+                self._load_members()
+                self._load_issued_books()
+                analytics_loaded = self._load_analytics()
+
+                # Changes made since the last compaction only live in the journal.
+                self._replay_journal()
+                if not analytics_loaded:
+                    # First start with analytics: count the loans on record, journaled ones included.
+                    library._analytics.backfill(library)
+                    self._write_analytics()
+                self.compact_if_due()
+                if self._change_stream or self._stream.exists():
+                    self._start_stream()
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+    def _start_stream(self):
+        # Publishing starts from snapshots that hold everything, so the checkpoint marks where
+        # the stream takes over. Journaled changes were published when they were made, or, if
+        # the stream is new, are older than it; compacting folds them in either way.
+        self._publishing = True
+        seq = self._stream.last_seq(self._checkpoint or 0)
+        if self._journal_records:
+            self.compact()
+        elif self._checkpoint is None:
+            self._checkpoint = seq
+            self._write_analytics()
+
+    def _read_array(self, f):
+        return JsonStreamReader(f).iter_array() if self._streaming else iter(json.load(f))
+
+    def _read_object(self, f):
+        return JsonStreamReader(f).iter_object() if self._streaming else iter(json.load(f).items())
+
+    def _read_object_arrays(self, f):
+        if self._streaming:
+            return JsonStreamReader(f).iter_object_arrays()
+        return ((key, item) for key, items in json.load(f).items() for item in items)
+
+    # Lazy mode tags each members.json record in the offset index with its section's initial.
+    MEMBER_KINDS = {"students": "s", "faculty": "f"}
+
+    @staticmethod
+    def _book_index_entry(kind, data):
+        return data["isbn"].strip(), ""
+
+    @staticmethod
+    def _member_index_entry(kind, data):
+        # (member_id, "s:<student ID>" or "f:<department>"): enough to rebuild the member indexes.
+        value = data["student_id"] if kind == "s" else data["department"]
+        return int(data["member_id"]), f"{kind}:{value.strip()}"
+
+    def _scan_books(self):
+        with open(self._books_file, 'r') as f:
+            for data in JsonStreamReader(f).iter_array():
+                yield "", data
+
+    def _scan_members(self):
+        with open(self._members_file, 'r') as f:
+            for section, data in JsonStreamReader(f).iter_object_arrays():
+                if section in self.MEMBER_KINDS:
+                    yield self.MEMBER_KINDS[section], data
+
+    def _decode_book(self, data, kind):
+        return Book.from_dict(data, self._trusted)
+
+    def _decode_member(self, data, kind):
+        # Polymorphism: the section a record is stored in decides whether it becomes a Student or Faculty.
+        return (Student if kind == "s" else Faculty).from_dict(data, self._trusted)
+
+    def _open_index(self, data_path, index_path, index_entry, label):
+        # The data file's offset index, rebuilt by one streaming pass if it is missing or stale.
+        if not os.path.exists(data_path):
+            return None
+        try:
+            index = OffsetIndex(index_path)
+            if index.is_current(data_path):
+                return index
+            index.close()
+        except (OSError, ValueError):
+            pass
+        entries = []
+        # Decoding bytes above 0x7f as surrogates keeps one character per byte, so the
+        # reader's character offsets are byte offsets.
+        with open(data_path, 'r', encoding='ascii', errors='surrogateescape') as f:
+            reader = JsonStreamReader(f)
+            if label == "member":
+                records = ((self.MEMBER_KINDS.get(section), item) for section, item in reader.iter_object_arrays(spans=True))
+            else:
+                records = (("", item) for item in reader.iter_array(spans=True))
+            for kind, (data, start, end) in records:
+                if kind is None:
+                    continue
+                try:
+                    key, extra = index_entry(kind, data)
+                except (ValueError, KeyError, TypeError, AttributeError) as e:
+                    print(f"Error loading {label} data: {data} - {e}")
+                    continue
+                if isinstance(key, str):
+                    key = key.encode('utf-8', 'surrogateescape').decode('utf-8', 'replace')
+                extra = extra.encode('utf-8', 'surrogateescape').decode('utf-8', 'replace')
+                entries.append((key, start, end - start, extra))
+        self._written("index", OffsetIndex.write(index_path, data_path, entries, numeric=label == "member"))
+        return OffsetIndex(index_path)
+
+    def _load_lazy_books(self):
+        library = self._library
+        index = None
+        try:
+            index = self._open_index(self._books_file, self._books_index_file, self._book_index_entry, "book")
+        except json.JSONDecodeError:
+            print(f"Warning: {self._books_file} is corrupted or empty. Starting with no books.")
+        except Exception as e:
+            print(f"An unexpected error occurred while indexing {self._books_file}: {e}")
+        if isinstance(library._books, LazyStore):
+            library._books.close()
+        library._books = LazyStore(self._books_file, index, self._scan_books, lambda data: data["isbn"].strip(),
+                                   self._decode_book, "book", self._cache_size)
+        tokens = self._open_tokens(self._books_file, self._book_rows) if index is not None else None
+        library._search_index = LazySearchIndex(library._books, tokens)
+
+    def _book_rows(self):
+        for _, data in self._scan_books():
+            try:
+                yield data["isbn"].strip(), data["title"], data["author"]
+            except (KeyError, TypeError, AttributeError):
+                continue
+
+    def _open_tokens(self, source_path, rows, rebuild=False):
+        # The catalog's token index, rebuilt from rows() if it is missing or no longer matches
+        # source_path, or None (after a warning) if it cannot be built.
+        if self._tokens is not None:
+            self._tokens.close()
+            self._tokens = None
+        try:
+            if not rebuild:
+                try:
+                    tokens = TokenIndex(self._tokens_file)
+                    if tokens.is_current(source_path):
+                        self._tokens = tokens
+                        return tokens
+                    tokens.close()
+                except (OSError, ValueError):
+                    pass
+            self._written("index", TokenIndex.write(self._tokens_file, source_path, rows()))
+            self._tokens = TokenIndex(self._tokens_file)
+        except Exception as e:
+            print(f"Warning: could not build {self._tokens_file} ({e}); searches will read the whole catalog.")
+        return self._tokens
+
+    def _refuse_sharded(self):
+        # The unsharded files a split leaves behind are stale, and analytics.json is shared with the
+        # shards, so a desk opening them would diverge from the sharded desk.
+        if os.path.exists(self._layout_file):
+            raise ValueError(f"{os.path.dirname(self._layout_file) or '.'} is split into shards; open it with --shards.")
+
+    def _member_index_loader(self, kind):
+        # Fills _student_ids ("s") or _departments ("f") from the members offset index on first use.
+        def load(target):
+            for member_id, extra in self._library._members.extras():
+                if extra[:2] != f"{kind}:":
+                    continue
+                if kind == "s":
+                    target[extra[2:]] = member_id
+                else:
+                    target.setdefault(extra[2:].casefold(), set()).add(member_id)
+        return load
+
+    def _load_lazy_members(self):
+        library = self._library
+        index = None
+        try:
+            index = self._open_index(self._members_file, self._members_index_file, self._member_index_entry, "member")
+        except json.JSONDecodeError:
+            print(f"Warning: {self._members_file} is corrupted or empty. Starting with no members.")
+        except Exception as e:
+            print(f"An unexpected error occurred while indexing {self._members_file}: {e}")
+        if isinstance(library._members, LazyStore):
+            library._members.close()
+        library._members = LazyStore(self._members_file, index, self._scan_members, lambda data: data["member_id"],
+                                     self._decode_member, "member", self._cache_size)
+        library._student_ids = DeferredDict(self._member_index_loader("s"))
+        library._departments = DeferredDict(self._member_index_loader("f"))
+        # The index is sorted by member ID, so its last key is the highest ID in use.
+        last_id = index.last_key() if index is not None else None
+        if last_id is not None and last_id >= Member._next_id:
+            Member._next_id = last_id + 1
+
+    STORE_LABELS = {"books": "books", "members": "members", "issued": "issued records"}
+
+    def _binary_snapshot(self, store):
+        # A store was last saved as a binary snapshot if one exists that is no older than its JSON file.
+        try:
+            stamp = os.stat(self._snapshot_files[store]).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        json_file = {"books": self._books_file, "members": self._members_file, "issued": self._issued_books_file}[store]
+        try:
+            return stamp >= os.stat(json_file).st_mtime_ns
+        except FileNotFoundError:
+            return True
+
+    def _read_snapshot(self, store):
+        # The blocks of a store's binary snapshot, or None (after a warning) if it is unreadable.
+        path = self._snapshot_files[store]
+        try:
+            blocks, compressed = BinarySnapshot.read(path)
+            if bytes(blocks[0]) != store.encode():
+                raise ValueError(f"{path} holds the '{bytes(blocks[0]).decode(errors='replace')}' store.")
+        except (OSError, ValueError, IndexError, zlib.error) as e:
+            print(f"Warning: {e} Starting with no {self.STORE_LABELS[store]}.")
+            return None
+        self._formats[store] = ("binary", compressed)
+        return blocks
+
+    def _load_binary_books(self):
+        library = self._library
+        library._books = library._new_catalog()
+        library._search_index.clear()
+        blocks = self._read_snapshot("books")
+        if blocks is None:
+            return
+        count = BinarySnapshot.unpack_ints(blocks[1])[0]
+        isbns, titles, authors = (BinarySnapshot.unpack_strings(block, count) for block in blocks[2:5])
+        total_quantities, available_quantities = BinarySnapshot.unpack_ints(blocks[5]), BinarySnapshot.unpack_ints(blocks[6])
+        holds = json.loads(bytes(blocks[7]))
+        if isinstance(library._books, ColumnarCatalog):
+            library._books.load_columns(isbns, titles, authors, total_quantities, available_quantities, holds)
+        else:
+            library._books = dict(zip(isbns, Book.from_columns(titles, authors, isbns, total_quantities,
+                                                               available_quantities)))
+            for row, member_ids in holds:
+                library._books[isbns[row]].set_holds(member_ids)
+        library._search_index.add_columns(isbns, titles, authors)
+
+    def _load_binary_members(self):
+        library = self._library
+        blocks = self._read_snapshot("members")
+        if blocks is None:
+            return
+        member_ids = BinarySnapshot.unpack_ints(blocks[1])
+        kinds = bytes(blocks[2])
+        names, extras = (BinarySnapshot.unpack_strings(block, len(member_ids)) for block in blocks[3:5])
+        for member_id, kind, name, extra in zip(member_ids, kinds, names, extras):
+            # Polymorphism: the stored kind decides whether the record becomes a Student or Faculty.
+            if kind == ord("s"):
+                member = Student.from_dict({"member_id": member_id, "name": name, "student_id": extra}, trusted=True)
+            else:
+                member = Faculty.from_dict({"member_id": member_id, "name": name, "department": extra}, trusted=True)
+            library._members[member_id] = member
+            library._index_member(member)
+        if member_ids and max(member_ids) >= Member._next_id:
+            Member._next_id = max(member_ids) + 1
+
+    def _load_binary_issued_books(self):
+        library = self._library
+        blocks = self._read_snapshot("issued")
+        if blocks is None:
+            return
+        member_ids, counts = BinarySnapshot.unpack_ints(blocks[1]), BinarySnapshot.unpack_ints(blocks[2])
+        isbns, due_dates = (BinarySnapshot.unpack_strings(block, sum(counts)) for block in blocks[3:5])
+        position = 0
+        for member_id, count in zip(member_ids, counts):
+            library._issued_books[member_id] = isbns[position:position + count]
+            # Loans that predate due dates are stored with an empty one.
+            library._due_dates[member_id] = [due_date or None for due_date in due_dates[position:position + count]]
+            position += count
+
+    def _load_books(self):
+        if self._lazy:
+            self._load_lazy_books()
+            return
+        if self._binary_snapshot("books"):
+            self._load_binary_books()
+            return
+        self._formats["books"] = ("json", False)
+        library = self._library
+        library._books = library._new_catalog()
+        library._search_index.clear()
+        if os.path.exists(self._books_file):
+            try:
+                with open(self._books_file, 'r') as f:
+                    for data in self._read_array(f):
+                        try:
+                            book = Book.from_dict(data, self._trusted)
+                            library._books[book.get_isbn()] = book
+                            library._search_index.add(book)
+                        except (ValueError, KeyError) as e:
+                            print(f"Error loading book data: {data} - {e}")
+            except json.JSONDecodeError:
+                print(f"Warning: {self._books_file} is corrupted or empty. Starting with no books.")
+                library._books = library._new_catalog()
+                library._search_index.clear()
+            except Exception as e:
+                print(f"An unexpected error occurred while loading {self._books_file}: {e}")
+
+    def _load_members(self):
+        if self._lazy:
+            self._load_lazy_members()
+            return
+        library = self._library
+        library._members = {}
+        library._student_ids = {}
+        library._departments = {}
+        if self._binary_snapshot("members"):
+            self._load_binary_members()
+            return
+        self._formats["members"] = ("json", False)
+        # Polymorphism: the section a record is stored in decides whether it becomes a Student or Faculty.
+        sections = {"students": (Student, "student"), "faculty": (Faculty, "faculty")}
+        if os.path.exists(self._members_file):
+            try:
+                with open(self._members_file, 'r') as f:
+                    for section, data in self._read_object_arrays(f):
+                        if section not in sections:
+                            continue
+                        member_class, label = sections[section]
+                        try:
+                            member = member_class.from_dict(data, self._trusted)
+                            library._members[member.get_member_id()] = member
+                            library._index_member(member)
+                            if member.get_member_id() >= Member._next_id:
+                                Member._next_id = member.get_member_id() + 1
+                        except (ValueError, KeyError) as e:
+                            print(f"Error loading {label} data: {data} - {e}")
+
+            except json.JSONDecodeError:
+                print(f"Warning: {self._members_file} is corrupted or empty. Starting with no members.")
+                library._members = {}
+                library._student_ids = {}
+                library._departments = {}
+            except Exception as e:
+                print(f"An unexpected error occurred while loading {self._members_file}: {e}")
+
+    def _load_issued_books(self):
+        library = self._library
+        library._issued_books = {}
+        library._due_dates = {}
+        if self._binary_snapshot("issued"):
+            self._load_binary_issued_books()
+        elif os.path.exists(self._issued_books_file):
+            self._formats["issued"] = ("json", False)
+            try:
+                with open(self._issued_books_file, 'r') as f:
+                    for member_id, loans in self._read_object(f):
+                        # A loan is {"isbn": ..., "due_date": ...}, or a bare ISBN if it predates due dates.
+                        library._issued_books[int(member_id)] = [loan if isinstance(loan, str) else loan["isbn"] for loan in loans]
+                        library._due_dates[int(member_id)] = [None if isinstance(loan, str) else loan.get("due_date") for loan in loans]
+            except json.JSONDecodeError:
+                print(f"Warning: {self._issued_books_file} is corrupted or empty. Starting with no issued records.")
+                library._issued_books = {}
+                library._due_dates = {}
+            except Exception as e:
+                print(f"An unexpected error occurred while loading {self._issued_books_file}: {e}")
+        library._loans.rebuild(library._issued_books)
+        library._overdue.reset()
+
+    def _read_meta(self):
+        # Returns the stores whose version stamp moved since this instance last read them.
+        try:
+            stamp = os.stat(self._meta_file).st_mtime_ns
+        except FileNotFoundError:
+            return set()
+        if stamp == self._meta_stamp:
+            return set()
+        try:
+            with open(self._meta_file, 'r') as f:
+                meta = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Warning: could not read {self._meta_file}: {e}")
+            return set(self._versions)
+        self._meta_stamp = stamp
+        changed = {store for store, version in meta.get("versions", {}).items()
+                   if store in self._versions and version != self._versions[store]}
+        self._versions.update({store: meta["versions"][store] for store in changed})
+        if meta.get("generation", 0) != self._generation:
+            self._generation = meta.get("generation", 0)
+            changed.add("journal")
+        return changed
+
+    def _load_analytics(self):
+        # False when there is no usable analytics file, so the caller backfills from the loans.
+        library = self._library
+        library._analytics.clear()
+        try:
+            self._analytics_stamp = os.stat(self._analytics_file).st_mtime_ns
+            with open(self._analytics_file, 'r') as f:
+                data = json.load(f)
+            library._analytics.load(data)
+            self._checkpoint = data.get("seq")
+            return True
+        except FileNotFoundError:
+            self._analytics_stamp = None
+            self._checkpoint = None
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            print(f"Warning: could not read {self._analytics_file}: {e} Rebuilding analytics from the loans on record.")
+            library._analytics.clear()
+        return False
+
+    def load_overdue_cursor(self):
+        # overdue.json holds one cursor per line: a whole one, then the deltas appended after it
+        # (see OverdueSchedule.collect). They are added up here; "logged" counts lines and entries.
+        horizon, drained, logged = "", Counter(), 0
+        try:
+            with open(self._overdue_file, 'rb') as f:
+                lines = f.read().split(b"\n")
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            print(f"Warning: could not read {self._overdue_file}: {e} The next overdue pass reports every overdue loan.")
+            return None
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                cursor = json.loads(line)
+                horizon = max(horizon, cursor["horizon"])
+                for due_date, member_id, isbn, copies in cursor["drained"]:
+                    drained[(due_date, member_id, isbn)] += copies
+                for due_date, member_id, isbn, copies in cursor.get("returned", ()):
+                    drained[(due_date, member_id, isbn)] -= copies
+                logged += len(cursor["drained"]) + len(cursor.get("returned", ())) + 1
+            except (ValueError, KeyError, TypeError) as e:
+                # A torn line is a delta that was never saved: its loans are simply reported again.
+                if number < len(lines):
+                    print(f"Warning: skipping line {number} of {self._overdue_file}: {e}")
+        return {"horizon": horizon, "logged": logged,
+                "drained": [[*key, copies] for key, copies in drained.items() if copies > 0]}
+
+    def save_overdue_cursor(self, cursor, append=True):
+        # append=True adds a delta line to overdue.json; otherwise it is replaced by the cursor.
+        if not append:
+            self._written("overdue", _write_json_atomic(self._overdue_file, cursor, compact=True))
+            return
+        size = os.path.getsize(self._overdue_file) if os.path.exists(self._overdue_file) else 0
+        line = (("\n" if size else "") + json.dumps(cursor, separators=(',', ':'))).encode()
+        try:
+            with open(self._overdue_file, 'ab') as f:
+                f.write(line)
+        except OSError:
+            os.truncate(self._overdue_file, size)
+            raise
+        self._written("overdue", len(line))
+
+    def _write_analytics(self):
+        data = self._library._analytics.to_dict()
+        if self._checkpoint is not None:
+            data["seq"] = self._checkpoint
+        try:
+            self._written("analytics", _write_json_atomic(self._analytics_file, data, compact=True))
+            self._analytics_stamp = os.stat(self._analytics_file).st_mtime_ns
+        except Exception as e:
+            print(f"Error saving {self._analytics_file}: {e}")
+
+    def _write_meta(self):
+        try:
+            self._written("meta", _write_json_atomic(self._meta_file, {"generation": self._generation,
+                                                                       "versions": self._versions}))
+            self._meta_stamp = os.stat(self._meta_file).st_mtime_ns
+        except Exception as e:
+            print(f"Error saving {self._meta_file}: {e}")
+
+    @contextmanager
+    def locked(self, refresh=True):
+        # Re-entrant; a no-op unless the instance was opened in shared mode.
+        if not self._shared:
+            yield
+            return
+        if self._lock_depth == 0:
+            self._lock_fd = os.open(self._lock_file, os.O_RDWR | os.O_CREAT)
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+        self._lock_depth += 1
+        try:
+            if refresh and self._lock_depth == 1:
+                self._refresh()
+            yield
+        finally:
+            self._lock_depth -= 1
+            if self._lock_depth == 0:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+                os.close(self._lock_fd)
+                self._lock_fd = None
+
+    def refresh(self):
+        if self._shared:
+            with self.locked():
+                pass
+
+    def rollback(self):
+        # Undoes changes applied in memory that were never written, by reloading from the disk.
+        self._library._load_data()
+
+    def close(self):
+        # Closes the journal, the change stream and the files lazy stores and kiosks map.
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        self._stream.close()
+        if self._tokens is not None:
+            self._tokens.close()
+            self._tokens = None
+        if self._library is not None:
+            for store in (self._library._books, self._library._members):
+                if isinstance(store, (LazyStore, MappedCatalog)):
+                    store.close()
+
+    def _refresh(self):
+        # Catch up with other desks: reload only re-versioned stores, then replay the journal
+        # tail (or the whole journal if another desk compacted it in the meantime).
+        changed = self._read_meta()
+        loaders = {"books": self._load_books, "members": self._load_members, "issued": self._load_issued_books}
+        for store in ("books", "members", "issued"):
+            if store in changed:
+                loaders[store]()
+                self._dirty.discard(store)
+        if "journal" in changed:
+            self._journal_offset = 0
+            self._journal_records = 0
+        if not self._publishing and self._stream.exists():
+            # Another desk turned the change stream on.
+            self._publishing = True
+        # A desk that compacted (or saved, without a journal) also wrote the analytics it had counted.
+        try:
+            analytics_stamp = os.stat(self._analytics_file).st_mtime_ns
+        except FileNotFoundError:
+            analytics_stamp = None
+        if analytics_stamp != self._analytics_stamp and not self._load_analytics():
+            self._library._analytics.backfill(self._library)
+        if os.path.exists(self._journal_file) and os.path.getsize(self._journal_file) != self._journal_offset:
+            self._replay_journal()
+
+    def _replay_journal(self):
+        if not os.path.exists(self._journal_file):
+            return
+        valid_size = self._journal_offset
+        try:
+            with open(self._journal_file, 'rb') as f:
+                f.seek(self._journal_offset)
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        # A crash in the middle of an append leaves a torn last record.
+                        break
+                    valid_size += len(line)
+                    try:
+                        self._library._apply_change(json.loads(line))
+                        self._journal_records += 1
+                    except (ValueError, KeyError) as e:
+                        print(f"Error replaying journal record: {line.decode(errors='replace').strip()} - {e}")
+            if valid_size < os.path.getsize(self._journal_file):
+                with open(self._journal_file, 'r+b') as f:
+                    f.truncate(valid_size)
+            self._journal_offset = valid_size
+        except Exception as e:
+            print(f"An unexpected error occurred while replaying {self._journal_file}: {e}")
+
+    def persist(self, records, compact=True):
+        # compact=False leaves a compaction that falls due to a later compact_if_due(). Without the
+        # journal the records are journaled all the same, and every compaction falls due at once.
+        self._append_journal(records)
+        self._publish(records)
+        if compact:
+            self.compact_if_due()
+
+    def compact_if_due(self):
+        # The records are committed by now, so a compaction that fails is not the caller's error:
+        # they stay in the journal, and the next compaction folds them in.
+        if self._journal_records >= JOURNAL_COMPACT_THRESHOLD or (self._journal_records and not self._use_journal):
+            try:
+                self.compact()
+            except Exception as e:
+                print(f"Error compacting {self._journal_file}: {e}")
+
+    def _publish(self, records):
+        # The records are committed by now, so a failed publish is not the caller's error, but
+        # replicas must not carry on without them. Nothing more is published until a compaction
+        # has folded the unpublished changes into the snapshots and restarted the stream with a
+        # checkpoint past them, from which replicas reload (see compact and ReplicaStorage.refresh).
+        if not self._publishing:
+            return
+        if not self._unpublished:
+            try:
+                self._written("changes", self._stream.publish(records, self._checkpoint or 0))
+                return
+            except Exception as e:
+                print(f"Error publishing changes: {e} Compacting so that replicas reload.")
+        self._unpublished += len(records)
+        try:
+            self.compact()
+        except Exception as e:
+            print(f"Error restarting the change stream: {e} Retrying after the next change.")
+
+    def _append_journal(self, records):
+        # Raises unless every record reached the disk. Whatever part of them was written is cut
+        # off again first, so a torn line never ends up in front of the next record.
+        try:
+            if self._journal is None:
+                self._journal = open(self._journal_file, 'a')
+            self._journal.write("".join(json.dumps(r, separators=(',', ':')) + "\n" for r in records))
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+        except Exception:
+            self._discard_journal_tail()
+            raise
+        self._journal_records += len(records)
+        self._written("journal", self._journal.tell() - self._journal_offset)
+        self._journal_offset = self._journal.tell()
+
+    def _discard_journal_tail(self):
+        journal, self._journal = self._journal, None
+        try:
+            if journal is not None:
+                journal.close()
+        except OSError:
+            pass
+        try:
+            if os.path.exists(self._journal_file):
+                os.truncate(self._journal_file, self._journal_offset)
+        except OSError as e:
+            print(f"Error truncating the torn end of {self._journal_file}: {e}")
+
+    def compact(self):
+        # Folds the journal back into the three JSON snapshots.
+        with self.locked():
+            if not self._journal_records and not self._dirty and not self._unpublished:
+                return
+            # Raises if a snapshot cannot be saved; the journal is then still the only copy of those changes.
+            self.save()
+            try:
+                if self._journal is not None:
+                    self._journal.close()
+                    self._journal = None
+                if os.path.exists(self._journal_file):
+                    with open(self._journal_file, 'w'):
+                        pass
+                self._journal_records = 0
+                self._journal_offset = 0
+                self._generation += 1
+                self._write_meta()
+            except Exception as e:
+                print(f"Error truncating journal: {e}")
+                return
+            # Written once the journal is empty, so no event is in both. A crash in between loses
+            # the analytics of this journal's events rather than counting them twice.
+            # Unpublished changes take up seqs of their own, so the new checkpoint is past them.
+            if self._publishing:
+                self._checkpoint = self._stream.last_seq(self._checkpoint or 0) + self._unpublished
+            self._write_analytics()
+            if self._publishing:
+                self._written("changes", self._stream.rotate(self._checkpoint, force=bool(self._unpublished)))
+                self._unpublished = 0
+
+    def save(self, force=False):
+        # Only the stores touched since the last save are rewritten, unless forced. Every one of
+        # them is written out before any replaces its file, so a save that fails raises and leaves
+        # the files as they were.
+        self._install(self._stage(force))
+
+    def _stage(self, force=False):
+        # Writes each store to save next to its file, as "<file>.new". If one cannot be written,
+        # the ones already written are removed again and the error is raised.
+        staged = []
+        try:
+            for store in ("books", "members", "issued"):
+                if force or store in self._dirty:
+                    staged.append(self._stage_store(store))
+        except BaseException:
+            self._discard_staged(staged)
+            raise
+        return staged
+
+    def _stage_store(self, store):
+        library = self._library
+        json_path = {"books": self._books_file, "members": self._members_file, "issued": self._issued_books_file}[store]
+        binary = self._saves_binary(store)
+        target = self._snapshot_files[store] if binary else json_path
+        staged = {"store": store, "target": target, "path": f"{target}.new", "binary": binary,
+                  "entries": None, "rows": None}
+        try:
+            if binary:
+                blocks = {"books": self._book_blocks, "members": self._member_blocks, "issued": self._issued_blocks}[store]
+                staged["compress"] = (self._compress if self._snapshot_format
+                                      else self._formats.get(store, ("binary", self._compress))[1])
+                staged["size"] = BinarySnapshot.write(staged["path"], blocks(), staged["compress"])
+            elif store == "issued":
+                staged["size"] = _write_json_atomic(staged["path"], {
+                    str(member_id): [isbn if due_date is None else {"isbn": isbn, "due_date": due_date}
+                                     for isbn, due_date in library.get_loans(member_id)]
+                    for member_id in library._issued_books})
+            else:
+                if store == "books":
+                    records = (book.to_dict() for book in library._books.values())
+                    index_path, index_entry = self._books_index_file, self._book_index_entry
+                else:
+                    members = library._members
+                    # Polymorphism: Checks the type of member at runtime to save them to the correct section.
+                    records = {
+                        "students": (member.to_dict() for member in members.values() if isinstance(member, Student)),
+                        "faculty": (member.to_dict() for member in members.values() if isinstance(member, Faculty))
+                    }
+                    index_path, index_entry = self._members_index_file, self._member_index_entry
+                # The offset index, and for books the token index, are rewritten along with the store
+                # whenever lazy mode uses them or an earlier session left them behind, so they never
+                # drift apart.
+                entries = staged["entries"] = [] if self._lazy or os.path.exists(index_path) else None
+                rows = staged["rows"] = ([] if store == "books" and (self._lazy or os.path.exists(self._tokens_file))
+                                         else None)
+
+                def on_record(record, offset, length):
+                    if entries is not None:
+                        kind = "s" if record.get("type") == "Student" else "f" if record.get("type") == "Faculty" else ""
+                        key, extra = index_entry(kind, record)
+                        entries.append((key, offset, length, extra))
+                    if rows is not None:
+                        rows.append((record["isbn"], record["title"], record["author"]))
+
+                indexed = entries is not None or rows is not None
+                staged["size"] = _write_json_records_atomic(staged["path"], records, on_record if indexed else None)
+        except BaseException:
+            self._discard_staged([staged])
+            raise
+        return staged
+
+    def _discard_staged(self, staged):
+        for item in staged:
+            for path in (item["path"], f"{item['path']}.tmp"):
+                try:
+                    if os.path.exists(path):
+                        os.remove(path)
+                except OSError as e:
+                    print(f"Error removing {path}: {e}")
+
+    def _install(self, staged):
+        # Swaps the staged stores in, then brings what is derived from them up to date: the other
+        # format's files, the offset and token indexes, the kiosks' catalog and the version stamps.
+        for item in staged:
+            os.replace(item["path"], item["target"])
+        saved = dict(self._versions)
+        for item in staged:
+            store = item["store"]
+            self._written(store, item["size"])
+            if item["binary"]:
+                # The JSON file and its offset index are removed once the snapshot replaces them.
+                json_path, index_path = {"books": (self._books_file, self._books_index_file),
+                                         "members": (self._members_file, self._members_index_file),
+                                         "issued": (self._issued_books_file, None)}[store]
+                for path in (json_path, index_path):
+                    if path and os.path.exists(path):
+                        os.remove(path)
+                self._formats[store] = ("binary", item["compress"])
+            else:
+                self._saved_as_json(store)
+                if store != "issued":
+                    self._index_store(store, item["target"], item["entries"], item["rows"])
+            if store == "books" and os.path.exists(self._catalog_file):
+                self._write_catalog()
+            self._dirty.discard(store)
+            self._versions[store] += 1
+        if saved != self._versions:
+            self._write_meta()
+
+    def _index_store(self, store, path, entries, rows):
+        index_path = self._books_index_file if store == "books" else self._members_index_file
+        if entries is not None:
+            self._written("index", OffsetIndex.write(index_path, path, entries, numeric=store == "members"))
+        if rows is not None:
+            tokens = self._open_tokens(path, lambda: rows, rebuild=True)
+        if self._lazy:
+            getattr(self._library, f"_{store}").reopen(OffsetIndex(index_path))
+            if rows is not None:
+                self._library._search_index = LazySearchIndex(self._library._books, tokens)
+
+    def _catalog_source(self):
+        return self._snapshot_files["books"] if self._binary_snapshot("books") else self._books_file
+
+    def _write_catalog(self):
+        self._written("catalog", MappedCatalog.write(self._catalog_file, self._library._books.values(),
+                                                     self._catalog_source()))
+
+    def _saves_binary(self, store):
+        return (self._snapshot_format or self._formats.get(store, ("json",))[0]) == "binary"
+
+    def _saved_as_json(self, store):
+        # A binary snapshot left from an earlier format would otherwise shadow the new JSON file.
+        if os.path.exists(self._snapshot_files[store]):
+            os.remove(self._snapshot_files[store])
+        self._formats[store] = ("json", False)
+
+    def _book_blocks(self):
+        books = self._library._books
+        if isinstance(books, ColumnarCatalog):
+            isbns, titles, authors = books._isbns, books._titles, books._authors
+            total_quantities, available_quantities = books._total_quantities, books._available_quantities
+            holds = sorted(books._holds.items())
+        else:
+            values = list(books.values())
+            isbns = [book.get_isbn() for book in values]
+            titles = [book.get_title() for book in values]
+            authors = [book.get_author() for book in values]
+            total_quantities = [book.get_total_quantity() for book in values]
+            available_quantities = [book.get_available_quantity() for book in values]
+            holds = [(row, book.get_holds()) for row, book in enumerate(values) if book.get_holds()]
+        return [b"books", BinarySnapshot.pack_ints([len(isbns)]), BinarySnapshot.pack_strings(isbns),
+                BinarySnapshot.pack_strings(titles), BinarySnapshot.pack_strings(authors),
+                BinarySnapshot.pack_ints(total_quantities), BinarySnapshot.pack_ints(available_quantities),
+                json.dumps([[row, list(member_ids)] for row, member_ids in holds]).encode()]
+
+    def _member_blocks(self):
+        # Polymorphism: students are stored with their student ID, faculty with their department.
+        members = list(self._library._members.values())
+        kinds = bytes(b"s"[0] if isinstance(member, Student) else b"f"[0] for member in members)
+        extras = [member.get_student_id() if isinstance(member, Student) else member.get_department()
+                  for member in members]
+        return [b"members", BinarySnapshot.pack_ints([member.get_member_id() for member in members]), kinds,
+                BinarySnapshot.pack_strings([member.get_name() for member in members]),
+                BinarySnapshot.pack_strings(extras)]
+
+    def _issued_blocks(self):
+        library = self._library
+        member_ids = list(library._issued_books)
+        loans = [loan for member_id in member_ids for loan in library.get_loans(member_id)]
+        return [b"issued", BinarySnapshot.pack_ints(member_ids),
+                BinarySnapshot.pack_ints([len(library._issued_books[member_id]) for member_id in member_ids]),
+                BinarySnapshot.pack_strings([isbn for isbn, _ in loans]),
+                BinarySnapshot.pack_strings([due_date or "" for _, due_date in loans])]
+
+    def mark_dirty(self, *stores):
+        self._dirty.update(stores)
+
+    def _written(self, store, size):
+        if self._stats is not None:
+            self._stats.add_bytes(store, size)
+
+class CatalogStorage(JsonStorage):
+    # Read-only storage for lookup kiosks. The catalog is a MappedCatalog over books.cat, which is
+    # built from books.json (or books.snap) on first use and rebuilt whenever it falls behind it,
+    # with the book changes in journal.log layered on top and followed on every refresh().
+    # Members and loans are not loaded, and every mutation is refused with ReadOnlyCatalogError.
+    def __init__(self, data_dir='.'):
+        super().__init__(data_dir, use_journal=False)
+
+    def open(self, library):
+        if library._columnar:
+            raise ValueError("The read-only catalog is memory-mapped and cannot be combined with columnar=True.")
+        self._refuse_sharded()
+        self._library = library
+        # Kiosks report on the analytics the desks save, without counting anything themselves.
+        self._load_analytics()
+        source = self._catalog_source()
+        try:
+            library._books = MappedCatalog(self._catalog_file)
+            if library._books.is_current(source):
+                library._search_index = LazySearchIndex(library._books, self._open_tokens(source, self._catalog_rows))
+                self._follow_journal(reset=True)
+                return
+            library._books.close()
+        except (OSError, ValueError):
+            pass
+        self._rebuild_catalog()
+
+    def _rebuild_catalog(self):
+        # One full load of the catalog, written out as books.cat and then dropped again.
+        library = self._library
+        library._search_index = BookSearchIndex()
+        self._load_books()
+        self._write_catalog()
+        library._books = MappedCatalog(self._catalog_file)
+        library._search_index = LazySearchIndex(library._books, self._open_tokens(self._catalog_source(), self._catalog_rows))
+        self._follow_journal(reset=True)
+
+    def _catalog_rows(self):
+        return ((book.get_isbn(), book.get_title(), book.get_author()) for book in self._library._books.values())
+
+    def locked(self, refresh=True):
+        # Every mutation takes the lock first, so refusing it here refuses them all.
+        raise ReadOnlyCatalogError("This desk has a read-only catalog; make changes at a desk that loads the full catalog.")
+
+    def refresh(self):
+        if os.path.exists(self._analytics_file) and os.stat(self._analytics_file).st_mtime_ns != self._analytics_stamp:
+            self._load_analytics()
+        books = self._library._books
+        books.refresh()
+        source = self._catalog_source()
+        if not books.is_current(source):
+            books.close()
+            self._rebuild_catalog()
+        elif self._tokens is not None and not self._tokens.is_current(source):
+            # Another kiosk rebuilt books.cat; the token index has to follow it.
+            self._library._search_index = LazySearchIndex(books, self._open_tokens(source, self._catalog_rows))
+        self._follow_journal()
+
+    def _follow_journal(self, reset=False):
+        # Layers the book changes the desks journaled since the last compaction (issues, returns,
+        # holds, new books, restocks) over the mapped catalog, reading only what was appended
+        # since the last call. A compaction empties the journal and bumps the generation in
+        # library_meta.json; by then books.cat holds those changes, so the layer starts over.
+        books = self._library._books
+        try:
+            size = os.path.getsize(self._journal_file)
+        except FileNotFoundError:
+            size = 0
+        if "journal" in self._read_meta() or size < self._journal_offset or reset:
+            books.clear_changed()
+            self._journal_offset = 0
+        if size == self._journal_offset:
+            return
+        try:
+            with open(self._journal_file, 'rb') as f:
+                f.seek(self._journal_offset)
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break  # still being written
+                    self._journal_offset += len(line)
+                    try:
+                        self._apply_book_change(json.loads(line))
+                    except (ValueError, KeyError, TypeError, AttributeError) as e:
+                        print(f"Error replaying journal record: {line.decode(errors='replace').strip()} - {e}")
+        except OSError as e:
+            print(f"Error reading {self._journal_file}: {e}")
+
+    def _apply_book_change(self, record):
+        # The books part of LibrarySystem._apply_change; members and loans are not kept here.
+        books = self._library._books
+        op = record["op"]
+        if op in ("add_book", "restock"):
+            book = Book.from_dict(record["book"], trusted=True)
+        elif op in ("hold", "issue", "return"):
+            book = books.get(record["isbn"])
+            if book is None:
+                return
+            if op == "hold":
+                book.set_holds(record["holds"])
+            else:
+                book.set_available_quantity(record["available"])
+                if "holds" in record:
+                    book.set_holds(record["holds"])
+        else:
+            return
+        books.set_changed(book)
+
+    def persist(self, records, compact=True):
+        raise ReadOnlyCatalogError("This desk has a read-only catalog.")
+
+    def save(self, force=False):
+        pass
+
+    def compact(self):
+        pass
+
+class ReplicaStorage(JsonStorage):
+    # Read-only storage for kiosks and reporting jobs that must stay current. It loads the
+    # snapshots once and then, on every refresh(), applies the events the desks published to
+    # changes.log since, so it never reparses the data files to catch up.
+    def __init__(self, data_dir='.', trusted=False):
+        super().__init__(data_dir, use_journal=False, trusted=trusted)
+        self._seq = 0
+
+    def open(self, library):
+        self._refuse_sharded()
+        self._library = library
+        self._bootstrap()
+
+    def _bootstrap(self):
+        # The checkpoint is read before the snapshots, so they hold at least every event up to it
+        # and replaying the stream from there catches them up. If a desk rotated the stream past
+        # the checkpoint in the meantime, the load starts over.
+        for _ in range(REPLICA_BOOTSTRAP_ATTEMPTS):
+            self._load_analytics()
+            if self._checkpoint is None or not self._stream.exists():
+                raise ValueError("There is no change stream to follow; start a desk with --change-stream first.")
+            gc_was_enabled = gc.isenabled()
+            gc.disable()
+            try:
+                self._load_books()
+                self._load_members()
+                self._load_issued_books()
+            finally:
+                if gc_was_enabled:
+                    gc.enable()
+            if self._stream.seek(self._checkpoint):
+                self._seq = self._checkpoint
+                self.refresh()
+                return
+        raise ValueError("The change stream kept moving past the snapshots; try again.")
+
+    def locked(self, refresh=True):
+        raise ReadOnlyCatalogError("This desk is a read-only replica; make changes at a desk that writes the data files.")
+
+    def refresh(self):
+        try:
+            records = self._stream.read()
+        except (OSError, ValueError) as e:
+            print(f"Warning: could not read the change stream: {e}")
+            return
+        for record in records:
+            seq = record["seq"]
+            if seq <= self._seq:
+                continue
+            if seq != self._seq + 1 or record["op"] == "checkpoint":
+                # Too far behind, so the events in between were rotated out, or a checkpoint past
+                # the last event read, after changes that were never published: either way they
+                # are only in the snapshots. Reload and follow on.
+                self._bootstrap()
+                return
+            self._seq = seq
+            try:
+                self._library._apply_change(record)
+            except (ValueError, KeyError) as e:
+                print(f"Error applying change {seq}: {e}")
+
+    def get_seq(self):
+        return self._seq
+
+    def persist(self, records, compact=True):
+        raise ReadOnlyCatalogError("This desk is a read-only replica.")
+
+    def save(self, force=False):
+        pass
+
+    def compact(self):
+        pass
+
+class ShardState:
+    # What one shard's JsonStorage loads into and saves from, in place of a LibrarySystem: the
+    # shard's part of each store and its own search index. Members are indexed in the library's
+    # student ID and department indexes; the loan index and overdue schedule are rebuilt once
+    # for the whole library after every shard has loaded. get_loans is the library class's own.
+    _columnar = False
+
+    def __init__(self, library, search_index):
+        self._books = {}
+        self._members = {}
+        self._issued_books = {}
+        self._due_dates = {}
+        self._search_index = search_index
+        self._index_member = library._index_member
+        self._loans = self._overdue = self
+        self._system = type(library)
+
+    def _new_catalog(self):
+        return {}
+
+    def get_loans(self, member_id):
+        return self._system.get_loans(self, member_id)
+
+    def rebuild(self, issued_books):
+        pass
+
+    def reset(self):
+        pass
+
+class ShardedDict:
+    # One store split over the shards' dicts by shard(key). Writes record which shards of the
+    # store changed, so only those are saved again.
+    def __init__(self, store, shards, shard, dirty):
+        self._store = store
+        self._shards = shards
+        self._shard = shard
+        self._dirty = dirty
+
+    def get(self, key, default=None):
+        return self._shards[self._shard(key)].get(key, default)
+
+    def __getitem__(self, key):
+        return self._shards[self._shard(key)][key]
+
+    def __setitem__(self, key, value):
+        shard = self._shard(key)
+        self._shards[shard][key] = value
+        self._dirty.add((self._store, shard))
+
+    def pop(self, key, *default):
+        shard = self._shard(key)
+        self._dirty.add((self._store, shard))
+        return self._shards[shard].pop(key, *default)
+
+    def __contains__(self, key):
+        return key in self._shards[self._shard(key)]
+
+    def __len__(self):
+        return sum(map(len, self._shards))
+
+    def __iter__(self):
+        for records in self._shards:
+            yield from records
+
+    def keys(self):
+        return iter(self)
+
+    def values(self):
+        for records in self._shards:
+            yield from records.values()
+
+    def items(self):
+        for records in self._shards:
+            yield from records.items()
+
+class ShardedStorage:
+    # The JSON backend split into `shards` directories (shard-00, shard-01, ...), each with its
+    # own snapshots and journal. Books are placed by a hash of their ISBN, members and their loans
+    # by member ID. A mutation is journaled in, and at compaction saved to, only the shards it
+    # touched: one for a new book or member, at most two for an issue or return. Every record
+    # carries a sequence number, so the shard journals replay in the order they were written.
+    def __init__(self, data_dir='.', shards=4, use_journal=True, trusted=False, snapshot_format=None, compress=False,
+                 shared=False):
+        if shards < 1:
+            raise ValueError("The number of shards must be at least 1.")
+        self._data_dir = data_dir
+        self._shards = shards
+        self._use_journal = use_journal
+        self._trusted = trusted
+        self._layout_file = os.path.join(data_dir, SHARDS_FILE)
+        self._storages = [JsonStorage(os.path.join(data_dir, SHARD_DIR.format(shard)), trusted=trusted,
+                                      snapshot_format=snapshot_format, compress=compress) for shard in range(shards)]
+        # Analytics.json is kept for the whole library, next to the shard directories.
+        self._top = JsonStorage(data_dir)
+        self._library = None
+        self._journals = {}
+        self._journal_records = 0
+        self._seq = 0
+        # (store, shard) pairs changed since they were last saved.
+        self._dirty = set()
+        # Searches fan out to, and multi-shard journal writes are fsynced by, these threads.
+        self._pool = ThreadPoolExecutor(max_workers=shards)
+        self._stats = None
+        # Multi-desk mode, as in JsonStorage: every mutation runs under an advisory lock on the
+        # directory and first replays what the other desks appended to the shard journals. The
+        # sequence numbers stay global, since they are only handed out under that lock.
+        if shared and fcntl is None:
+            raise ValueError("Shared mode needs fcntl file locking, which is not available on this platform.")
+        self._shared = shared
+        self._lock_file = os.path.join(data_dir, LOCK_FILE)
+        self._lock_fd = None
+        self._lock_depth = 0
+        # Bytes of each shard's journal applied so far, and the compaction count kept in shards.json;
+        # a desk that finds a newer one reloads, since the snapshots moved under it.
+        self._journal_offsets = [0] * shards
+        self._generation = 0
+
+    def book_shard(self, isbn):
+        return zlib.crc32(isbn.encode()) % self._shards
+
+    def member_shard(self, member_id):
+        return member_id % self._shards
+
+    def open(self, library):
+        if library._columnar:
+            raise ValueError("Sharded storage keeps one dict of books per shard and cannot be combined with columnar=True.")
+        self._library = library
+        self._top._library = library
+        # A reload (after a failed write) starts over from what the journals hold.
+        self._seq = 0
+        self._journal_records = 0
+        self._journal_offsets = [0] * self._shards
+        self._dirty.clear()
+        for storage in self._storages:
+            storage._stats = self._stats
+        self._top._stats = self._stats
+        with self.locked(refresh=False):
+            self._load(library)
+
+    def _load(self, library):
+        if os.path.exists(self._layout_file):
+            with open(self._layout_file, 'r') as f:
+                layout = json.load(f)
+            if layout["shards"] != self._shards:
+                raise ValueError(f"{self._data_dir} is split into {layout['shards']} shards, not {self._shards}.")
+            self._generation = layout.get("generation", 0)
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            states = [ShardState(library, BookSearchIndex()) for _ in self._storages]
+            library._student_ids = {}
+            library._departments = {}
+            for storage, state in zip(self._storages, states):
+                storage._library = state
+                storage._load_books()
+                storage._load_members()
+                storage._load_issued_books()
+            self._bind(library, states)
+            analytics_loaded = self._top._load_analytics()
+            self._replay_journals()
+            if not os.path.exists(self._layout_file):
+                self._split_unsharded()
+            elif not analytics_loaded:
+                library._analytics.backfill(library)
+                self._top._write_analytics()
+            self.compact_if_due()
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+    def _bind(self, library, states):
+        # Points the library's stores at the shards' dicts.
+        library._books = ShardedDict("books", [state._books for state in states], self.book_shard, self._dirty)
+        library._members = ShardedDict("members", [state._members for state in states], self.member_shard, self._dirty)
+        library._issued_books = ShardedDict("issued", [state._issued_books for state in states], self.member_shard,
+                                            self._dirty)
+        library._due_dates = ShardedDict("issued", [state._due_dates for state in states], self.member_shard, self._dirty)
+        library._search_index = ShardedSearchIndex([state._search_index for state in states], self.book_shard, self._pool)
+        library._loans.rebuild(library._issued_books)
+        library._overdue.reset()
+
+    def _split_unsharded(self):
+        # First start: the unsharded data files in data_dir, if any, are split across the shards.
+        # They are left in place but ignored from now on: JsonStorage refuses the directory once
+        # shards.json exists.
+        library = self._library
+        if any(os.path.exists(os.path.join(self._data_dir, name))
+               for name in (BOOKS_FILE, BOOKS_SNAPSHOT_FILE, MEMBERS_FILE, MEMBERS_SNAPSHOT_FILE)):
+            source = type(library)(storage=JsonStorage(self._data_dir, trusted=self._trusted))
+            # Compacting folds the journal into the snapshots and writes the analytics it counted.
+            source.compact()
+            for isbn, book in source._books.items():
+                library._books[isbn] = book
+                library._search_index.add(book)
+            for member_id, member in source._members.items():
+                library._members[member_id] = member
+                library._index_member(member)
+            for member_id in source._issued_books:
+                loans = source.get_loans(member_id)
+                library._issued_books[member_id] = [isbn for isbn, _ in loans]
+                library._due_dates[member_id] = [due_date for _, due_date in loans]
+            library._loans.rebuild(library._issued_books)
+            library._overdue.reset()
+            if not self._top._load_analytics():
+                library._analytics.backfill(library)
+            print(f"Split {len(library._books)} books and {len(library._members)} members into {self._shards} shards.")
+        self.save(force=True)
+        self._top._write_analytics()
+        self._write_layout()
+
+    def _write_layout(self):
+        self._written("meta", _write_json_atomic(self._layout_file, {"shards": self._shards,
+                                                                     "generation": self._generation}))
+
+    def _replay_journals(self):
+        # Each shard's journal is in sequence order; a record journaled in two shards is applied once.
+        # Only what lies past the offsets already applied is read.
+        journals = []
+        for shard, storage in enumerate(self._storages):
+            records, self._journal_offsets[shard] = self._read_journal(storage._journal_file,
+                                                                       self._journal_offsets[shard])
+            journals.append(records)
+        for record in heapq.merge(*journals, key=lambda record: record["seq"]):
+            if record["seq"] == self._seq:
+                continue
+            self._seq = record["seq"]
+            try:
+                self._library._apply_change(record)
+                self._journal_records += 1
+            except (ValueError, KeyError) as e:
+                print(f"Error replaying journal record: {record} - {e}")
+
+    def _read_journal(self, path, start=0):
+        # The journal's records from byte `start` on, and the size up to its last complete record.
+        records = []
+        if not os.path.exists(path):
+            return records, 0
+        valid_size = start
+        try:
+            with open(path, 'rb') as f:
+                f.seek(start)
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        # A crash in the middle of an append leaves a torn last record.
+                        break
+                    valid_size += len(line)
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError as e:
+                        print(f"Error reading journal record: {line.decode(errors='replace').strip()} - {e}")
+            if valid_size < os.path.getsize(path):
+                with open(path, 'r+b') as f:
+                    f.truncate(valid_size)
+        except Exception as e:
+            print(f"An unexpected error occurred while reading {path}: {e}")
+        return [record for record in records if isinstance(record, dict) and isinstance(record.get("seq"), int)], valid_size
+
+    @contextmanager
+    def locked(self, refresh=True):
+        # Re-entrant; a no-op unless the instance was opened in shared mode. One lock covers every
+        # shard, since an issue or return writes to two of them.
+        if not self._shared:
+            yield
+            return
+        if self._lock_depth == 0:
+            self._lock_fd = os.open(self._lock_file, os.O_RDWR | os.O_CREAT)
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+        self._lock_depth += 1
+        try:
+            if refresh and self._lock_depth == 1:
+                self._refresh()
+            yield
+        finally:
+            self._lock_depth -= 1
+            if self._lock_depth == 0:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+                os.close(self._lock_fd)
+                self._lock_fd = None
+
+    def refresh(self):
+        if self._shared:
+            with self.locked():
+                pass
+
+    def rollback(self):
+        self._library._load_data()
+
+    def _refresh(self):
+        # Catch up with other desks: replay the shard journals' new tails, or reload everything if
+        # another desk compacted in the meantime.
+        generation = self._generation
+        if os.path.exists(self._layout_file):
+            with open(self._layout_file, 'r') as f:
+                generation = json.load(f).get("generation", 0)
+        if generation != self._generation:
+            self._library._load_data()
+            return
+        self._replay_journals()
+
+    def _bump_generation(self):
+        # Tells the other desks that the snapshots changed under them.
+        if self._shared:
+            self._generation += 1
+            self._write_layout()
+
+    def _record_shards(self, record):
+        if record["op"] in ("add_book", "restock"):
+            return {self.book_shard(record["book"]["isbn"])}
+        if record["op"] == "add_member":
+            return {self.member_shard(record["member"]["member_id"])}
+        if record["op"] == "hold":
+            return {self.book_shard(record["isbn"])}
+        return {self.book_shard(record["isbn"]), self.member_shard(record["member_id"])}
+
+    def persist(self, records, compact=True):
+        # Without the journal the records are journaled all the same, and compacted right after.
+        lines = {}
+        for record in records:
+            self._seq += 1
+            line = json.dumps(dict(record, seq=self._seq), separators=(',', ':')) + "\n"
+            for shard in self._record_shards(record):
+                lines.setdefault(shard, []).append(line)
+        # Raises unless every shard's part reached the disk. Each touched journal is cut back to
+        # where it started first, so no shard keeps records the others lack.
+        starts = {}
+        try:
+            for shard in lines:
+                starts[shard] = self._journal(shard).tell()
+            if len(lines) == 1:
+                sizes = [self._append_journal(*lines.popitem())]
+            else:
+                # fsync releases the GIL, so the shards' journals are flushed side by side. Every
+                # write finishes before any result is looked at, so none is still running when
+                # the journals are cut back.
+                writes = [self._pool.submit(self._append_journal, shard, shard_lines) for shard, shard_lines in lines.items()]
+                wait(writes)
+                sizes = [write.result() for write in writes]
+        except Exception:
+            self._seq -= len(records)
+            for shard, start in starts.items():
+                self._discard_journal_tail(shard, start)
+            raise
+        for shard in starts:
+            self._journal_offsets[shard] = self._journals[shard].tell()
+        self._journal_records += len(records)
+        self._written("journal", sum(sizes))
+        if compact:
+            self.compact_if_due()
+
+    def compact_if_due(self):
+        # As in JsonStorage, a compaction that fails leaves the committed records in the journals.
+        if self._journal_records >= JOURNAL_COMPACT_THRESHOLD or (self._journal_records and not self._use_journal):
+            try:
+                self.compact()
+            except Exception as e:
+                print(f"Error compacting the shard journals: {e}")
+
+    def _journal(self, shard):
+        journal = self._journals.get(shard)
+        if journal is None:
+            journal = self._journals[shard] = open(self._storages[shard]._journal_file, 'a')
+        return journal
+
+    def _append_journal(self, shard, lines):
+        journal = self._journal(shard)
+        data = "".join(lines)
+        journal.write(data)
+        journal.flush()
+        os.fsync(journal.fileno())
+        return len(data)
+
+    def _discard_journal_tail(self, shard, start):
+        journal = self._journals.pop(shard, None)
+        try:
+            if journal is not None:
+                journal.close()
+        except OSError:
+            pass
+        path = self._storages[shard]._journal_file
+        try:
+            if os.path.exists(path):
+                os.truncate(path, start)
+        except OSError as e:
+            print(f"Error truncating the torn end of {path}: {e}")
+
+    def compact(self):
+        # Saves the changed shards and empties every shard's journal.
+        if not self._journal_records and not self._dirty:
+            return
+        # Raises if a shard cannot be saved; the journals are then still the only copy of those changes.
+        self.save()
+        try:
+            for journal in self._journals.values():
+                journal.close()
+            self._journals = {}
+            for storage in self._storages:
+                if os.path.exists(storage._journal_file):
+                    with open(storage._journal_file, 'w'):
+                        pass
+            self._journal_records = 0
+            self._journal_offsets = [0] * self._shards
+        except Exception as e:
+            print(f"Error truncating journal: {e}")
+            return
+        self._top._write_analytics()
+        self._bump_generation()
+
+    def save(self, force=False):
+        # Only the stores of the shards touched since the last save are rewritten, unless forced.
+        # As in JsonStorage.save, every shard's stores are written out before any replaces its file.
+        staged = []
+        try:
+            for shard, storage in enumerate(self._storages):
+                stores = {store for store, dirty_shard in self._dirty if dirty_shard == shard}
+                if not (force or stores):
+                    continue
+                os.makedirs(os.path.dirname(storage._books_file), exist_ok=True)
+                storage._dirty = set(stores)
+                staged.append((shard, storage, storage._stage(force)))
+        except BaseException:
+            for _, storage, items in staged:
+                storage._discard_staged(items)
+            raise
+        for shard, storage, items in staged:
+            storage._install(items)
+            self._dirty.difference_update((item["store"], shard) for item in items)
+
+    def mark_dirty(self, *stores):
+        # The sharded stores record which shards changed as they are written.
+        pass
+
+    def load_overdue_cursor(self):
+        return self._top.load_overdue_cursor()
+
+    def save_overdue_cursor(self, cursor, append=True):
+        self._top.save_overdue_cursor(cursor, append)
+
+    def close(self):
+        # Closes the shard journals and stops the search and fsync threads.
+        for journal in self._journals.values():
+            journal.close()
+        self._journals = {}
+        self._pool.shutdown()
+
+    def _written(self, store, size):
+        if self._stats is not None:
+            self._stats.add_bytes(store, size)
+
+class SQLiteStorage:
+    # The SQLite backend (WAL mode). Nothing is loaded up front: the LibrarySystem's stores
+    # become views that query the database, and every mutation runs in one IMMEDIATE
+    # transaction, so several desks can share the database file safely.
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS books (
+            isbn TEXT PRIMARY KEY,
+            title TEXT NOT NULL,
+            author TEXT NOT NULL,
+            total_quantity INTEGER NOT NULL,
+            available_quantity INTEGER NOT NULL,
+            holds TEXT
+        );
+        CREATE TABLE IF NOT EXISTS members (
+            member_id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            type TEXT NOT NULL,
+            student_id TEXT UNIQUE,
+            department TEXT,
+            department_key TEXT
+        );
+        CREATE INDEX IF NOT EXISTS members_department ON members(department_key);
+        CREATE TABLE IF NOT EXISTS loans (
+            id INTEGER PRIMARY KEY,
+            member_id INTEGER NOT NULL,
+            isbn TEXT NOT NULL,
+            due_date TEXT,
+            reported INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS loans_member ON loans(member_id);
+        CREATE INDEX IF NOT EXISTS loans_isbn ON loans(isbn);
+        CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(title, author, content='books', content_rowid='rowid');
+        CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN
+            INSERT INTO books_fts(rowid, title, author) VALUES (new.rowid, new.title, new.author);
+        END;
+        CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE OF title, author ON books BEGIN
+            INSERT INTO books_fts(books_fts, rowid, title, author) VALUES ('delete', old.rowid, old.title, old.author);
+            INSERT INTO books_fts(rowid, title, author) VALUES (new.rowid, new.title, new.author);
+        END;
+        CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN
+            INSERT INTO books_fts(books_fts, rowid, title, author) VALUES ('delete', old.rowid, old.title, old.author);
+        END;
+        CREATE VIRTUAL TABLE IF NOT EXISTS books_vocab USING fts5vocab(books_fts, 'row');
+    """
+
+    def __init__(self, path=SQLITE_FILE):
+        self._path = path
+        self._conn = None
+        self._depth = 0
+
+    def open(self, library):
+        self.close()
+        self._conn = sqlite3.connect(self._path, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(self.SCHEMA)
+        self._upgrade_schema()
+        library._books = SQLiteBooks(self._conn)
+        library._members = SQLiteMembers(self._conn)
+        library._issued_books = SQLiteLoans(self._conn)
+        library._search_index = SQLiteSearchIndex(self._conn)
+        library._loans = SQLiteLoanIndex(self._conn)
+        library._due_dates = SQLiteDueDates(self._conn)
+        library._overdue = SQLiteOverdueSchedule(self._conn)
+        library._student_ids = SQLiteStudentIds(self._conn)
+        library._departments = SQLiteDepartments(self._conn)
+        self._sync_next_member_id()
+        library._analytics = SQLiteCirculationStats(self._conn)
+        with self.locked():
+            # A database that predates the analytics tables starts them from the loans on record.
+            if SQLiteCirculationStats.create(self._conn):
+                library._analytics.backfill(library)
+
+    def _upgrade_schema(self):
+        # Databases created before holds, due dates and the overdue cursor existed lack these columns.
+        for table, column, kind in (("books", "holds", "TEXT"), ("loans", "due_date", "TEXT"), ("loans", "reported", "INTEGER")):
+            if column not in {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}:
+                self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {kind}")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS loans_due ON loans(due_date)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS loans_unreported ON loans(due_date) WHERE reported IS NULL")
+
+    def _sync_next_member_id(self):
+        highest = self._conn.execute("SELECT MAX(member_id) FROM members").fetchone()[0]
+        if highest is not None and highest >= Member._next_id:
+            Member._next_id = highest + 1
+
+    @contextmanager
+    def locked(self, refresh=True):
+        if self._depth == 0:
+            self._conn.execute("BEGIN IMMEDIATE")
+            # Another desk may have registered members since we last looked.
+            self._sync_next_member_id()
+        self._depth += 1
+        try:
+            yield
+        except BaseException:
+            self._depth -= 1
+            if self._depth == 0:
+                self._conn.execute("ROLLBACK")
+            raise
+        self._depth -= 1
+        if self._depth == 0:
+            self._conn.execute("COMMIT")
+
+    def persist(self, records, compact=True):
+        # Changes are written through as they are applied and committed by locked().
+        pass
+
+    def compact_if_due(self):
+        pass
+
+    def save(self, force=False):
+        pass
+
+    def refresh(self):
+        pass
+
+    def rollback(self):
+        # Nothing to undo: the stores are views of the database, and locked() rolls the
+        # transaction back.
+        pass
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def mark_dirty(self, *stores):
+        pass
+
+    def compact(self):
+        self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def import_library(self, library):
+        # One-shot bulk copy of another LibrarySystem's data (e.g. the JSON files).
+        with self.locked():
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO books (isbn, title, author, total_quantity, available_quantity, holds) VALUES (?, ?, ?, ?, ?, ?)",
+                ((b.get_isbn(), b.get_title(), b.get_author(), b.get_total_quantity(), b.get_available_quantity(),
+                  SQLiteBooks.holds(b)) for b in library._books.values()))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO members (member_id, name, type, student_id, department, department_key) VALUES (?, ?, ?, ?, ?, ?)",
+                (SQLiteMembers.row(m) for m in library._members.values()))
+            self._conn.execute("DELETE FROM loans")
+            self._conn.executemany(
+                "INSERT INTO loans (member_id, isbn, due_date) VALUES (?, ?, ?)",
+                ((member_id, isbn, due_date) for member_id in library._issued_books
+                 for isbn, due_date in library.get_loans(member_id)))
+            self._sync_next_member_id()
+
+class SQLiteBooks:
+    # isbn -> Book view over the books table.
+    COLUMNS = ("title", "author", "isbn", "total_quantity", "available_quantity", "holds")
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    @staticmethod
+    def holds(book):
+        # The hold queue as a JSON array, or NULL when nobody is waiting.
+        return json.dumps(list(book.get_holds())) if book.get_holds() else None
+
+    @classmethod
+    def _book(cls, row):
+        data = dict(zip(cls.COLUMNS, row))
+        data["holds"] = json.loads(data["holds"]) if data["holds"] else []
+        return Book.from_dict(data)
+
+    def _query(self, where="", params=()):
+        cursor = self._conn.execute(f"SELECT {', '.join(self.COLUMNS)} FROM books {where}", params)
+        return (self._book(row) for row in cursor)
+
+    def get(self, isbn, default=None):
+        return next(self._query("WHERE isbn = ?", (isbn,)), default)
+
+    def __getitem__(self, isbn):
+        book = self.get(isbn)
+        if book is None:
+            raise KeyError(isbn)
+        return book
+
+    def __setitem__(self, isbn, book):
+        # Quantity changes are a single-row update; only new or renamed books touch the FTS index.
+        cursor = self._conn.execute(
+            "UPDATE books SET total_quantity = ?, available_quantity = ?, holds = ? WHERE isbn = ? AND title = ? AND author = ?",
+            (book.get_total_quantity(), book.get_available_quantity(), self.holds(book), isbn, book.get_title(), book.get_author()))
+        if cursor.rowcount == 0:
+            self._conn.execute(
+                "INSERT INTO books (isbn, title, author, total_quantity, available_quantity, holds) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(isbn) DO UPDATE SET title = excluded.title, author = excluded.author, "
+                "total_quantity = excluded.total_quantity, available_quantity = excluded.available_quantity, holds = excluded.holds",
+                (isbn, book.get_title(), book.get_author(), book.get_total_quantity(), book.get_available_quantity(), self.holds(book)))
+
+    def __contains__(self, isbn):
+        return self._conn.execute("SELECT 1 FROM books WHERE isbn = ?", (isbn,)).fetchone() is not None
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM books").fetchone()[0]
+
+    def __iter__(self):
+        return (row[0] for row in self._conn.execute("SELECT isbn FROM books ORDER BY rowid"))
+
+    def keys(self):
+        return iter(self)
+
+    def values(self):
+        return self._query("ORDER BY rowid")
+
+    def items(self):
+        return ((book.get_isbn(), book) for book in self.values())
+
+class SQLiteMembers:
+    # member_id -> Member view over the members table.
+    COLUMNS = ("member_id", "name", "type", "student_id", "department")
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    @staticmethod
+    def row(member):
+        data = member.to_dict()
+        department = data.get("department")
+        return (data["member_id"], data["name"], data["type"], data.get("student_id"), department,
+                department.casefold() if department else None)
+
+    def _query(self, where="", params=()):
+        cursor = self._conn.execute(f"SELECT {', '.join(self.COLUMNS)} FROM members {where}", params)
+        # Polymorphism: Member.from_dict rebuilds a Student or Faculty from the stored type.
+        return (Member.from_dict(dict(zip(self.COLUMNS, row))) for row in cursor)
+
+    def get(self, member_id, default=None):
+        return next(self._query("WHERE member_id = ?", (member_id,)), default)
+
+    def __getitem__(self, member_id):
+        member = self.get(member_id)
+        if member is None:
+            raise KeyError(member_id)
+        return member
+
+    def __setitem__(self, member_id, member):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO members (member_id, name, type, student_id, department, department_key) VALUES (?, ?, ?, ?, ?, ?)",
+            self.row(member))
+
+    def __contains__(self, member_id):
+        return self._conn.execute("SELECT 1 FROM members WHERE member_id = ?", (member_id,)).fetchone() is not None
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM members").fetchone()[0]
+
+    def __iter__(self):
+        return (row[0] for row in self._conn.execute("SELECT member_id FROM members ORDER BY member_id"))
+
+    def keys(self):
+        return iter(self)
+
+    def values(self):
+        return self._query("ORDER BY member_id")
+
+    def items(self):
+        return ((member.get_member_id(), member) for member in self.values())
+
+class SQLiteLoans:
+    # member_id -> [isbn] view over the loans table, in the order the books were issued.
+    def __init__(self, conn):
+        self._conn = conn
+
+    def get(self, member_id, default=None):
+        isbns = [row[0] for row in self._conn.execute("SELECT isbn FROM loans WHERE member_id = ? ORDER BY id", (member_id,))]
+        return isbns or default
+
+    def __getitem__(self, member_id):
+        isbns = self.get(member_id)
+        if isbns is None:
+            raise KeyError(member_id)
+        return isbns
+
+    def __setitem__(self, member_id, isbns):
+        # Only the difference is written: one insert for an issue, one delete for a return.
+        current = Counter(self.get(member_id, []))
+        wanted = Counter(isbns)
+        for isbn, count in (current - wanted).items():
+            self._conn.execute(
+                "DELETE FROM loans WHERE id IN (SELECT id FROM loans WHERE member_id = ? AND isbn = ? ORDER BY id LIMIT ?)",
+                (member_id, isbn, count))
+        self._conn.executemany(
+            "INSERT INTO loans (member_id, isbn) VALUES (?, ?)",
+            [(member_id, isbn) for isbn, count in (wanted - current).items() for _ in range(count)])
+
+    def pop(self, member_id, default=None):
+        isbns = self.get(member_id, default)
+        self._conn.execute("DELETE FROM loans WHERE member_id = ?", (member_id,))
+        return isbns
+
+    def __contains__(self, member_id):
+        return self._conn.execute("SELECT 1 FROM loans WHERE member_id = ? LIMIT 1", (member_id,)).fetchone() is not None
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(DISTINCT member_id) FROM loans").fetchone()[0]
+
+    def __iter__(self):
+        return (row[0] for row in self._conn.execute("SELECT DISTINCT member_id FROM loans ORDER BY member_id"))
+
+    def keys(self):
+        return iter(self)
+
+    def items(self):
+        cursor = self._conn.execute("SELECT member_id, isbn FROM loans ORDER BY member_id, id")
+        member_id, isbns = None, []
+        for row_member_id, isbn in cursor:
+            if row_member_id != member_id and isbns:
+                yield member_id, isbns
+                isbns = []
+            member_id = row_member_id
+            isbns.append(isbn)
+        if isbns:
+            yield member_id, isbns
+
+    def values(self):
+        return (isbns for member_id, isbns in self.items())
+
+class SQLiteDueDates:
+    # member_id -> [due date] view over the loans table, parallel to SQLiteLoans.
+    def __init__(self, conn):
+        self._conn = conn
+
+    def get(self, member_id, default=None):
+        due_dates = [row[0] for row in self._conn.execute("SELECT due_date FROM loans WHERE member_id = ? ORDER BY id", (member_id,))]
+        return due_dates or default
+
+    def __setitem__(self, member_id, due_dates):
+        # Called right after SQLiteLoans.__setitem__, whose rows are already in loan order.
+        # A loan whose due date moves is due to be reported again.
+        ids = [row[0] for row in self._conn.execute("SELECT id FROM loans WHERE member_id = ? ORDER BY id", (member_id,))]
+        self._conn.executemany("UPDATE loans SET reported = CASE WHEN due_date IS ?1 THEN reported END, due_date = ?1 "
+                               "WHERE id = ?2", list(zip(due_dates, ids)))
+
+    def pop(self, member_id, default=None):
+        return default
+
+class SQLiteOverdueSchedule:
+    # OverdueSchedule counterpart: the loans_due index already keeps loans in due-date order, and
+    # each loan's reported column records whether a pass has drained it, so the cursor survives
+    # restarts and is shared by every desk.
+    def __init__(self, conn):
+        self._conn = conn
+
+    def reset(self):
+        pass
+
+    def add(self, member_id, isbn, due_date):
+        pass
+
+    def remove(self, member_id, isbn, due_date):
+        pass
+
+    def collect(self, as_of):
+        # Loans due before as_of that no pass has drained yet, including any issued already past due.
+        own = not self._conn.in_transaction
+        if own:
+            self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = list(self._conn.execute(
+                "SELECT id, due_date, member_id, isbn FROM loans WHERE due_date < ? AND reported IS NULL "
+                "ORDER BY due_date, id", (as_of,)))
+            self._conn.executemany("UPDATE loans SET reported = 1 WHERE id = ?", [(row[0],) for row in rows])
+            if own:
+                self._conn.execute("COMMIT")
+        except Exception:
+            if own:
+                self._conn.execute("ROLLBACK")
+            raise
+        return [row[1:] for row in rows]
+
+    def overdue(self, as_of):
+        return list(self._conn.execute(
+            "SELECT due_date, member_id, isbn FROM loans WHERE due_date < ? ORDER BY due_date, id", (as_of,)))
+
+class SQLiteLoanIndex:
+    # LoanIndex counterpart answered from the loans table and its isbn and member_id indexes.
+    def __init__(self, conn):
+        self._conn = conn
+
+    def rebuild(self, issued_books):
+        pass
+
+    def update(self, member_id, old_isbns, new_isbns):
+        pass
+
+    def borrowers(self, isbn):
+        return dict(self._conn.execute(
+            "SELECT member_id, COUNT(*) FROM loans WHERE isbn = ? GROUP BY member_id", (isbn,)))
+
+    def holds(self, member_id, isbn):
+        return self._conn.execute("SELECT COUNT(*) FROM loans WHERE member_id = ? AND isbn = ?", (member_id, isbn)).fetchone()[0]
+
+    def issued_count(self, isbn):
+        return self._conn.execute("SELECT COUNT(*) FROM loans WHERE isbn = ?", (isbn,)).fetchone()[0]
+
+    def issued_isbns(self):
+        return [row[0] for row in self._conn.execute("SELECT DISTINCT isbn FROM loans")]
+
+class SQLiteStudentIds:
+    # student_id -> member_id, answered by the UNIQUE student_id column.
+    def __init__(self, conn):
+        self._conn = conn
+
+    def get(self, student_id, default=None):
+        row = self._conn.execute("SELECT member_id FROM members WHERE student_id = ?", (student_id,)).fetchone()
+        return default if row is None else row[0]
+
+    def __contains__(self, student_id):
+        return self.get(student_id) is not None
+
+    def __setitem__(self, student_id, member_id):
+        # The members table is the index; nothing extra to maintain.
+        pass
+
+class SQLiteDepartments:
+    # department -> {member_id}, answered by the members_department index.
+    def __init__(self, conn):
+        self._conn = conn
+
+    def get(self, department_key, default=None):
+        member_ids = {row[0] for row in self._conn.execute(
+            "SELECT member_id FROM members WHERE department_key = ?", (department_key,))}
+        return member_ids or default
+
+    def setdefault(self, department_key, default=None):
+        # The members table is the index; the returned set is not kept.
+        return set() if default is None else default
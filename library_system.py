@@ -1,274 +1,927 @@
+import argparse
+import bisect
+import csv
+import functools
+import io
 import json
+import multiprocessing
 import os
-
-BOOKS_FILE = 'books.json'
-MEMBERS_FILE = 'members.json'
-ISSUED_BOOKS_FILE = 'issued_books.json'
-
-class Book:
-    # Encapsulation
-    def __init__(self, title, author, isbn, quantity):
-        if not isinstance(title, str) or not title.strip():
-            raise ValueError("Book title cannot be empty.")
-        if not isinstance(author, str) or not author.strip():
-            raise ValueError("Book author cannot be empty.")
-        if not isinstance(isbn, str) or not isbn.strip():
-            raise ValueError("Book ISBN cannot be empty.")
-        if not isinstance(quantity, int) or quantity <= 0:
-            raise ValueError("Book quantity must be a positive integer.")
-
-        self._title = title.strip()
-        self._author = author.strip()
-        self._isbn = isbn.strip()
-        self._total_quantity = quantity
-        self._available_quantity = quantity
-
-    def get_title(self):
-        return self._title
-
-    def get_author(self):
-        return self._author
-
-    def get_isbn(self):
-        return self._isbn
-
-    def get_total_quantity(self):
-        return self._total_quantity
-
-    def get_available_quantity(self):
-        return self._available_quantity
-
-    def set_available_quantity(self, quantity):
-        if not isinstance(quantity, int) or quantity < 0 or quantity > self._total_quantity:
-            raise ValueError("Available quantity must be non-negative and not exceed total quantity.")
-        self._available_quantity = quantity
-
-    def increment_available_quantity(self):
-        if self._available_quantity < self._total_quantity:
-            self._available_quantity += 1
-            return True
-        return False
-
-    def decrement_available_quantity(self):
-        if self._available_quantity > 0:
-            self._available_quantity -= 1
-            return True
-        return False
-
-    def to_dict(self):
-        return {
-            "title": self._title,
-            "author": self._author,
-            "isbn": self._isbn,
-            "total_quantity": self._total_quantity,
-            "available_quantity": self._available_quantity
-        }
-
-    @classmethod
-    def from_dict(cls, data):
-        book = cls(
-            data['title'],
-            data['author'],
-            data['isbn'],
-            data['total_quantity']
-        )
-        book.set_available_quantity(data['available_quantity'])
-        return book
-
-    def __str__(self):
-        return (f"Title: {self._title}, Author: {self._author}, ISBN: {self._isbn}, "
-                f"Available: {self._available_quantity}/{self._total_quantity}")
-
-class Member:
-    _next_id = 1001
-
-    def __init__(self, name, member_id=None):
-        # Encapsulation: Attributes initialized and managed within the class.
-        if not isinstance(name, str) or not name.strip():
-            raise ValueError("Member name cannot be empty.")
-        self._name = name.strip()
-        if member_id is None:
-            self._member_id = Member._next_id
-            Member._next_id += 1
-        else:
-            if not isinstance(member_id, int) or member_id <= 0:
-                raise ValueError("Member ID must be a positive integer.")
-            self._member_id = member_id
-            if member_id >= Member._next_id:
-                Member._next_id = member_id + 1
-
-    def get_member_id(self):
-        return self._member_id
-
-    def get_name(self):
-        return self._name
-
-    def get_max_books_allowed(self):
-        # Polymorphism
-        # It forces derived classes to define their specific borrowing limit.
-        raise NotImplementedError("Subclasses must implement get_max_books_allowed()")
-
-    def to_dict(self):
-        return {
-            "member_id": self._member_id,
-            "name": self._name,
-            "type": self.__class__.__name__
-        }
-
-    def __str__(self):
-        return f"Member ID: {self._member_id}, Name: {self._name}"
-
-class Student(Member):
-    # Inheritance: Student class inherits from Member, gaining its attributes and methods.
-    def __init__(self, name, student_id, member_id=None):
-        super().__init__(name, member_id) 
-        if not isinstance(student_id, str) or not student_id.strip():
-            raise ValueError("Student ID cannot be empty.")
-        self._student_id = student_id.strip() # Encapsulation
-        self._max_books_allowed = 3 # Encapsulation
-    def get_student_id(self):
-        return self._student_id
-
-    def get_max_books_allowed(self):
-        # Polymorphism
-        return self._max_books_allowed
-
-    def to_dict(self):
-        data = super().to_dict()
-        data["student_id"] = self._student_id
-        return data
-
-    @classmethod
-    def from_dict(cls, data):
-        return cls(data['name'], data['student_id'], data['member_id'])
-
-    def __str__(self):
-        return f"{super().__str__()}, Type: Student, Student ID: {self._student_id}, Max Books: {self._max_books_allowed}"
-
-class Faculty(Member):
-    # Inheritance: Faculty class also inherits from Member.
-    def __init__(self, name, department, member_id=None):
-        super().__init__(name, member_id)
-        if not isinstance(department, str) or not department.strip():
-            raise ValueError("Department cannot be empty.")
-        self._department = department.strip() # Encapsulation
-        self._max_books_allowed = 10 # Encapsulation
-
-    def get_department(self):
-        return self._department
-
-    def get_max_books_allowed(self):
-        # Polymorphism
-            return self._max_books_allowed
-
-    def to_dict(self):
-        data = super().to_dict()
-        data["department"] = self._department
-        return data
-
-    @classmethod
-    def from_dict(cls, data):
-        return cls(data['name'], data['department'], data['member_id'])
-
-    def __str__(self):
-        return f"{super().__str__()}, Type: Faculty, Department: {self._department}, Max Books: {self._max_books_allowed}"
-
+import sys
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+from library_analytics import CirculationStats
+from library_instrumentation import STATS_DUMP_INTERVAL, STATS_ENV, Instrumentation
+from library_models import (Book, BookNotFoundError, BorrowLimitError, ColumnarCatalog, DuplicateStudentIdError,
+                            Faculty, HoldError, LibraryError, LoanIndex, Member, MemberNotFoundError, NotIssuedError,
+                            OutOfStockError, OverdueSchedule, ReadOnlyCatalogError, Student)
+from library_search import BookSearchIndex
+from library_storage import (CATALOG_FILE, CHANGES_FILE, SQLITE_FILE, CatalogStorage, JsonStorage, ReplicaStorage,
+                             ShardedStorage, SQLiteStorage, _write_json_atomic)
+
+IMPORT_CHUNK_SIZE = 5000
+FSCK_CHUNK_SIZE = 100000
+SEARCH_PAGE_SIZE = 10
+VIEW_PAGE_SIZE = 20
+EXPORT_CHUNK_ROWS = 10000
+EXPORT_FORMATS = ("text", "csv", "jsonl")
+
+def _mutation(method):
+    # Runs a LibrarySystem mutation under the shared-mode lock, after catching up with other desks.
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._locked():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+def _validate_import_rows(rows):
+    # Runs in the bulk-import worker processes. rows are (line number, CSV row dict or JSONL line);
+    # returns the rows that pass Book's rules as normalized (title, author, isbn, quantity)
+    # tuples, and a {"line", "error", "row"} entry for each one that does not.
+    books = []
+    rejected = []
+    for line_number, row in rows:
+        try:
+            if isinstance(row, str):
+                row = json.loads(row)
+                if not isinstance(row, dict):
+                    raise ValueError("Each line must be a JSON object.")
+            quantity = row["quantity"]
+            # CSV fields are text; a whole number is accepted, anything else is left for Book to reject.
+            if isinstance(quantity, str) and quantity.strip().lstrip("+-").isdigit():
+                quantity = int(quantity)
+            book = Book(row["title"], row["author"], row["isbn"], quantity)
+            books.append((book.get_title(), book.get_author(), book.get_isbn(), book.get_total_quantity()))
+        except KeyError as e:
+            rejected.append({"line": line_number, "error": f"Missing field {e}.", "row": row})
+        except (ValueError, TypeError, AttributeError) as e:
+            rejected.append({"line": line_number, "error": str(e), "row": row})
+    return books, rejected
+
+# How check_integrity problems are shown on the command line, by check.
+FSCK_MESSAGES = {
+    "availability": "ISBN {isbn}: available {available}, expected {expected} ({issued} on loan).",
+    "over_issued": "ISBN {isbn}: {issued} copies on loan but only {total} owned.",
+    "unknown_hold": "ISBN {isbn}: hold by member ID {member_id}, who is not registered.",
+    "unknown_member": "Member ID {member_id}: {loans} loans but the member is not registered.",
+    "over_limit": "Member ID {member_id}: {loans} loans, over the {limit}-book limit.",
+    "due_dates": "Member ID {member_id}: {due_dates} due dates for {loans} loans.",
+    "unknown_book": "Member ID {member_id}: {copies} copies of ISBN {isbn}, which is not in the catalog.",
+}
+
+_fsck_state = None  # (library, isbns, member_ids) inherited by forked check_integrity workers
+
+def _availability_mismatch(isbn, book, issued):
+    # The book's availability problem, if its available quantity is not its total less the
+    # `issued` copies on loan. Shared by check_integrity and reconcile_availability.
+    expected = book.get_total_quantity() - issued
+    if book.get_available_quantity() == expected:
+        return None
+    return {"isbn": isbn, "available": book.get_available_quantity(), "expected": expected, "issued": issued}
+
+def _check_integrity_chunk(kind, start, end, state=None):
+    # Checks rows [start, end) of the catalog ("books") or of the members holding loans ("loans")
+    # and returns the problems found. Forked workers read the stores they inherited.
+    library, isbns, member_ids = state or _fsck_state
+    members = library._members
+    problems = []
+    if kind == "books":
+        books, loans = library._books, library._loans
+        for isbn in isbns[start:end]:
+            book = books[isbn]
+            issued = loans.issued_count(isbn)
+            mismatch = _availability_mismatch(isbn, book, issued)
+            if mismatch is not None:
+                problems.append(dict(check="availability", **mismatch))
+            if issued > book.get_total_quantity():
+                problems.append({"check": "over_issued", "isbn": isbn, "total": book.get_total_quantity(),
+                                 "issued": issued})
+            for member_id in book.get_holds():
+                if member_id not in members:
+                    problems.append({"check": "unknown_hold", "isbn": isbn, "member_id": member_id})
+    else:
+        issued_books, due_dates = library._issued_books, library._due_dates
+        for member_id in member_ids[start:end]:
+            held = issued_books[member_id]
+            member = members.get(member_id)
+            if member is None:
+                problems.append({"check": "unknown_member", "member_id": member_id, "loans": len(held)})
+            elif len(held) > member.get_max_books_allowed():
+                problems.append({"check": "over_limit", "member_id": member_id, "loans": len(held),
+                                 "limit": member.get_max_books_allowed()})
+            dates = due_dates.get(member_id)
+            if dates is not None and len(dates) != len(held):
+                problems.append({"check": "due_dates", "member_id": member_id, "loans": len(held),
+                                 "due_dates": len(dates)})
+    return problems
 
 class LibrarySystem:
     # Encapsulation: _books, _members, _issued_books are internal state, managed by the class's methods.
-    def __init__(self):
-        self._books = {}
+    # The menu screens, which wait on input(); Instrumentation leaves them untimed.
+    MENU_METHODS = frozenset({"add_book", "view_all_books", "search_book", "add_member", "view_all_members",
+                              "view_members_by_department", "issue_book", "return_book", "place_hold",
+                              "view_borrowers", "run"})
+
+    def __init__(self, data_dir='.', use_journal=True, shared=False, columnar=False, storage=None, trusted_load=False,
+                 lazy=False, instrumentation=None, snapshot_format=None, shards=None, change_stream=False):
+        # columnar=True keeps the catalog in a ColumnarCatalog instead of one Book object per title.
+        self._columnar = columnar
+        self._books = self._new_catalog()
         self._members = {}
         self._issued_books = {}
+        # Due date (ISO string, or None for loans made before due dates existed) of every loan,
+        # parallel to the member's list in _issued_books.
+        self._due_dates = {}
+        self._overdue = OverdueSchedule(self._scheduled_loans, lambda: self._storage.load_overdue_cursor(),
+                                        lambda cursor, append: self._storage.save_overdue_cursor(cursor, append))
+        self._search_index = BookSearchIndex()
+        # Reverse loan index: who holds each ISBN, and how many copies of it each member holds.
+        self._loans = LoanIndex()
+        # Secondary member indexes: student_id -> member_id and department -> {member_id}.
+        self._student_ids = {}
+        self._departments = {}
+        # Circulation analytics, updated as changes are applied.
+        self._analytics = CirculationStats()
+        # "_books"/"_members" -> (store, size, sorted keys), for paging and export in key order.
+        self._key_order = {}
+        # Records committed inside batch() are persisted together when the batch ends.
+        self._batch_depth = 0
+        self._pending = []
+        # Pluggable persistence: JsonStorage by default, or e.g. an SQLiteStorage.
+        # shards=N splits the JSON files across N shard directories (see ShardedStorage).
+        if storage is None and shards:
+            if lazy or change_stream:
+                raise ValueError("Sharded storage cannot be combined with lazy mode or a change stream.")
+            storage = ShardedStorage(data_dir, shards, use_journal, trusted=trusted_load, snapshot_format=snapshot_format,
+                                     shared=shared)
+        elif storage is None:
+            storage = JsonStorage(data_dir, use_journal, shared, trusted=trusted_load, lazy=lazy,
+                                  snapshot_format=snapshot_format, change_stream=change_stream)
+        elif lazy or snapshot_format or shards or change_stream:
+            raise ValueError("lazy, snapshot_format, shards and change_stream configure the default storage; "
+                             "pass them to its class instead.")
+        self._storage = storage
+        # Opt-in metrics, from the LIBRARY_STATS environment variable unless one is passed in.
+        # instrumentation=False turns it off even when LIBRARY_STATS is set.
+        if instrumentation is None:
+            instrumentation = Instrumentation.from_env()
+        self._instrumentation = instrumentation or None
+        if self._instrumentation is not None:
+            instrumentation.attach(self)
         self._load_data()
 
+    def _new_catalog(self):
+        return ColumnarCatalog() if self._columnar else {}
+
     def _load_data(self):
-        if os.path.exists(BOOKS_FILE):
-            try:
-                with open(BOOKS_FILE, 'r') as f:
-                    books_data = json.load(f)
-                    for data in books_data:
-                        try:
-                            book = Book.from_dict(data)
-                            self._books[book.get_isbn()] = book
-                        except (ValueError, KeyError) as e:
-                            print(f"Error loading book data: {data} - {e}")
-            except json.JSONDecodeError:
-                print(f"Warning: {BOOKS_FILE} is corrupted or empty. Starting with no books.")
-            except Exception as e:
-                print(f"An unexpected error occurred while loading {BOOKS_FILE}: {e}")
-
-        if os.path.exists(MEMBERS_FILE):
-            try:
-                with open(MEMBERS_FILE, 'r') as f:
-                    members_data_structured = json.load(f)
-                    students_data = members_data_structured.get("students", [])
-                    for data in students_data:
-                        try:
-                            member = Student.from_dict(data) # Polymorphism: Creates Student objects
-                            self._members[member.get_member_id()] = member
-                            if member.get_member_id() >= Member._next_id:
-                                Member._next_id = member.get_member_id() + 1
-                        except (ValueError, KeyError) as e:
-                            print(f"Error loading student data: {data} - {e}")
-
-                    faculty_data = members_data_structured.get("faculty", [])
-                    for data in faculty_data:
-                        try:
-                            member = Faculty.from_dict(data) # Polymorphism: Creates Faculty objects
-                            self._members[member.get_member_id()] = member
-                            if member.get_member_id() >= Member._next_id:
-                                Member._next_id = member.get_member_id() + 1
-                        except (ValueError, KeyError) as e:
-                            print(f"Error loading faculty data: {data} - {e}")
-
-            except json.JSONDecodeError:
-                print(f"Warning: {MEMBERS_FILE} is corrupted or empty. Starting with no members.")
-            except Exception as e:
-                print(f"An unexpected error occurred while loading {MEMBERS_FILE}: {e}")
-
-        if os.path.exists(ISSUED_BOOKS_FILE):
+        self._storage.open(self)
+        # The first search would otherwise pay for tokenizing the whole catalog.
+        self._search_index.index_in_background()
+
+    def _save_data(self, force=False):
+        self._storage.save(force)
+
+    def _locked(self):
+        return self._storage.locked()
+
+    def refresh(self):
+        self._storage.refresh()
+
+    def get_stats(self):
+        # Per-operation calls, failures and timings plus bytes written, or None when not instrumented.
+        return None if self._instrumentation is None else self._instrumentation.snapshot()
+
+    def compact(self):
+        self._storage.compact()
+
+    def close(self):
+        # Releases the storage's files, connection and threads once the desk is done; compact() first
+        # to fold the journal into the snapshots.
+        self._search_index.join_background()
+        self._storage.close()
+
+    def get_analytics(self, k=10, days=7, weeks=4, author=None):
+        # Circulation report from the running counters: the k most borrowed titles and most active
+        # members, author utilization (one author's, or the k highest), faculty activity by
+        # department, and issues and returns over the last `days` days and `weeks` ISO weeks.
+        analytics = self._analytics
+        titles = []
+        for isbn, issues in analytics.top_titles(k):
+            book = self._books.get(isbn)
+            titles.append({"isbn": isbn, "title": book.get_title() if book else None, "issues": issues})
+        return {"top_titles": titles,
+                "top_members": [{"member_id": member_id, "issues": issues} for member_id, issues in analytics.top_members(k)],
+                "utilization": analytics.utilization(self._books, author, k),
+                "departments": analytics.departments(),
+                "daily": analytics.rollup("daily", days),
+                "weekly": analytics.rollup("weekly", weeks)}
+
+    def _apply_change(self, record):
+        # Every record carries the post-change state of what it touched, so replaying
+        # a record that is already part of the snapshots leaves the data unchanged.
+        op = record["op"]
+        if op in ("add_book", "restock"):
+            book = Book.from_dict(record["book"])
+            old = self._books.get(book.get_isbn())
+            self._analytics.book_changed(old, book)
+            self._books[book.get_isbn()] = book
+            if old is None:
+                self._key_added("_books", book.get_isbn())
+            self._search_index.add(book)
+            self._storage.mark_dirty("books")
+        elif op == "add_member":
+            member = Member.from_dict(record["member"])
+            new_member = member.get_member_id() not in self._members
+            self._members[member.get_member_id()] = member
+            if new_member:
+                self._key_added("_members", member.get_member_id())
+            self._index_member(member)
+            self._storage.mark_dirty("members")
+        elif op == "hold":
+            book = self._books[record["isbn"]]
+            book.set_holds(record["holds"])
+            self._books[record["isbn"]] = book
+            self._storage.mark_dirty("books")
+        elif op in ("issue", "return"):
+            book = self._books[record["isbn"]]
+            self._analytics.stock_changed(book.get_author(), 0, book.get_available_quantity() - record["available"])
+            book.set_available_quantity(record["available"])
+            if "holds" in record:
+                book.set_holds(record["holds"])
+            # Write the book back so stores that are not plain dicts see the change.
+            self._books[record["isbn"]] = book
+            member_id = record["member_id"]
+            self._loans.update(member_id, self._issued_books.get(member_id, ()), record["loans"])
+            # Records journaled before due dates existed carry none.
+            due_dates = record.get("due_dates") or [None] * len(record["loans"])
+            old_loans, new_loans = Counter(self.get_loans(member_id)), Counter(zip(record["loans"], due_dates))
+            for isbn, due_date in (old_loans - new_loans).elements():
+                self._overdue.remove(member_id, isbn, due_date)
+            for isbn, due_date in (new_loans - old_loans).elements():
+                self._overdue.add(member_id, isbn, due_date)
+            if record["loans"]:
+                self._issued_books[member_id] = list(record["loans"])
+                self._due_dates[member_id] = list(due_dates)
+            else:
+                self._issued_books.pop(member_id, None)
+                self._due_dates.pop(member_id, None)
+            self._storage.mark_dirty("books", "issued")
+            # Records journaled before analytics existed carry no date; count them as today's.
+            day = record.get("on") or date.today().isoformat()
+            if op == "issue":
+                self._analytics.issued(record["isbn"], self._members.get(member_id), day)
+            else:
+                self._analytics.returned(self._members.get(member_id), day)
+        else:
+            raise ValueError(f"Unknown operation '{op}'.")
+
+    def _sorted_keys(self, store):
+        # The keys of _books or _members, sorted. Records are never removed, so the cached order
+        # only goes stale when the store is reloaded or grows behind _key_added's back.
+        records = getattr(self, store)
+        cached = self._key_order.get(store)
+        if cached is None or cached[0] is not records or cached[1] != len(records):
+            cached = self._key_order[store] = (records, len(records), sorted(records))
+        return cached[2]
+
+    def _key_added(self, store, key):
+        cached = self._key_order.get(store)
+        records = getattr(self, store)
+        if cached is not None and cached[0] is records and cached[1] == len(records) - 1:
+            bisect.insort(cached[2], key)
+            self._key_order[store] = (records, len(records), cached[2])
+
+    def _page(self, store, after, limit):
+        if limit < 1:
+            raise ValueError("The page size must be at least 1.")
+        keys = self._sorted_keys(store)
+        start = 0 if after is None else bisect.bisect_right(keys, after)
+        page = keys[start:start + limit]
+        records = getattr(self, store)
+        return [records[key] for key in page], page[-1] if page and start + limit < len(keys) else None
+
+    def page_books(self, after=None, limit=VIEW_PAGE_SIZE):
+        # Cursor paging in ISBN order: the books after the cursor (the last ISBN of the previous
+        # page) and the cursor for the next page, or None on the last one. Books added meanwhile
+        # show up in their place without shifting the pages already seen.
+        return self._page("_books", after, limit)
+
+    def page_members(self, after=None, limit=VIEW_PAGE_SIZE):
+        # Cursor paging in member ID order, as page_books.
+        return self._page("_members", after, limit)
+
+    def _book_text(self, book):
+        return f"{book}\n"
+
+    def _member_text(self, member):
+        # The member's block in the listing: the member, each loan and a rule.
+        lines = [str(member)]
+        borrowed_isbns = self.get_loans(member.get_member_id())
+        if borrowed_isbns:
+            lines.append("  Borrowed Books:")
+            for i, (isbn, due_date) in enumerate(borrowed_isbns):
+                book = self._books.get(isbn)
+                due = f", due {due_date}" if due_date else ""
+                if book:
+                    lines.append(f"    {i+1}. {book.get_title()} by {book.get_author()} (ISBN: {isbn}{due})")
+                else:
+                    lines.append(f"    {i+1}. Unknown Book (ISBN: {isbn}{due}) - Data might be missing.")
+        else:
+            lines.append("  No books currently borrowed.")
+        lines.append("-" * 30)
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _book_row(book):
+        return (book.get_title(), book.get_author(), book.get_isbn(), book.get_total_quantity(),
+                book.get_available_quantity())
+
+    def _member_row(self, member):
+        student = isinstance(member, Student)
+        return (member.get_member_id(), member.get_name(), "Student" if student else "Faculty",
+                member.get_student_id() if student else "", "" if student else member.get_department(),
+                " ".join(self._issued_books.get(member.get_member_id(), ())))
+
+    def _member_record(self, member):
+        return dict(member.to_dict(), loans=[{"isbn": isbn, "due_date": due_date}
+                                             for isbn, due_date in self.get_loans(member.get_member_id())])
+
+    def export_chunks(self, kind, fmt="text"):
+        # Generator over the whole listing of "books" or "members" in key order, as text (the
+        # lines of the menu listings), CSV with a header row, or JSONL. Each string it yields
+        # holds EXPORT_CHUNK_ROWS records, so a consumer writes in large chunks and neither side
+        # ever holds more than one chunk of output.
+        if kind not in ("books", "members"):
+            raise ValueError(f"Unknown listing '{kind}'.")
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format '{fmt}'.")
+        store = f"_{kind}"
+        if kind == "books":
+            text, row, record = self._book_text, self._book_row, Book.to_dict
+            header = ("title", "author", "isbn", "total_quantity", "available_quantity")
+        else:
+            text, row, record = self._member_text, self._member_row, self._member_record
+            header = ("member_id", "name", "type", "student_id", "department", "loans")
+        keys = self._sorted_keys(store)
+        records = getattr(self, store)
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        if fmt == "csv":
+            writer.writerow(header)
+        for start in range(0, len(keys), EXPORT_CHUNK_ROWS):
+            chunk = [records[key] for key in keys[start:start + EXPORT_CHUNK_ROWS]]
+            if fmt == "text":
+                yield "".join(map(text, chunk))
+            elif fmt == "csv":
+                writer.writerows(map(row, chunk))
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            else:
+                yield "".join(json.dumps(record(item)) + "\n" for item in chunk)
+        if fmt == "csv" and not keys:
+            yield buffer.getvalue()
+
+    def export(self, kind, f, fmt="text"):
+        # Streams a listing to the open text file f, one write per chunk; returns the records written.
+        for chunk in self.export_chunks(kind, fmt):
+            f.write(chunk)
+        return len(getattr(self, f"_{kind}"))
+
+    def _scheduled_loans(self):
+        issued_books = self._issued_books
+        for member_id, due_dates in self._due_dates.items():
+            yield member_id, issued_books.get(member_id, ()), due_dates
+
+    def get_loans(self, member_id):
+        # (isbn, due date) for each book the member holds, in the order they were issued.
+        isbns = self._issued_books.get(member_id, [])
+        due_dates = self._due_dates.get(member_id) or [None] * len(isbns)
+        return list(zip(isbns, due_dates))
+
+    def get_overdue_loans(self, as_of=None, new_only=False):
+        # Loans due before as_of (a date, default today), oldest first. new_only=True is the
+        # nightly pass: just the loans that became overdue since the previous call.
+        as_of = as_of or date.today()
+        loans = self._overdue.collect(as_of.isoformat()) if new_only else self._overdue.overdue(as_of.isoformat())
+        days_overdue = {}
+        overdue = []
+        for due_date, member_id, isbn in loans:
+            if due_date not in days_overdue:
+                days_overdue[due_date] = (as_of - date.fromisoformat(due_date)).days
+            overdue.append({"member_id": member_id, "isbn": isbn, "due_date": due_date,
+                            "days_overdue": days_overdue[due_date]})
+        return overdue
+
+    def _index_member(self, member):
+        # Polymorphism: only students carry a student ID, only faculty a department.
+        if isinstance(member, Student):
+            self._student_ids[member.get_student_id()] = member.get_member_id()
+        elif isinstance(member, Faculty):
+            self._departments.setdefault(member.get_department().casefold(), set()).add(member.get_member_id())
+
+    def find_member_by_student_id(self, student_id):
+        member_id = self._student_ids.get(student_id.strip())
+        return self._members.get(member_id) if member_id is not None else None
+
+    def get_members_by_department(self, department):
+        member_ids = self._departments.get(department.strip().casefold(), ())
+        return [self._members[member_id] for member_id in sorted(member_ids)]
+
+    def get_borrowers(self, isbn):
+        # (member, copies held) for everyone holding the ISBN, e.g. to send recall notices.
+        borrowers = self._loans.borrowers(isbn.strip())
+        return [(self._members[member_id], borrowers[member_id]) for member_id in sorted(borrowers)
+                if member_id in self._members]
+
+    def get_issued_count(self, isbn):
+        return self._loans.issued_count(isbn.strip())
+
+    def get_book(self, isbn):
+        # Raises BookNotFoundError for an unknown ISBN.
+        return self._get_book(isbn)
+
+    def get_member(self, member_id):
+        # Raises MemberNotFoundError for an unknown member ID.
+        return self._get_member(member_id)
+
+    def reconcile_availability(self, repair=False):
+        # Books whose available quantity is not total minus copies on loan, each a lookup on the
+        # reverse loan index, then ISBNs on loan that are missing from the catalog (with None for
+        # available and expected). repair=True corrects the available quantities that can be
+        # corrected, and nothing else; check_integrity covers the other invariants.
+        if not repair:
+            self.refresh()
+            return self._availability_mismatches()
+        with self._locked():
+            mismatches = self._availability_mismatches()
+            self._repair_availability(mismatches)
+            return mismatches
+
+    def _availability_mismatches(self):
+        loans = self._loans
+        mismatches = [mismatch for mismatch in (_availability_mismatch(isbn, book, loans.issued_count(isbn))
+                                                for isbn, book in self._books.items()) if mismatch is not None]
+        mismatches += [{"isbn": isbn, "available": None, "expected": None, "issued": loans.issued_count(isbn)}
+                       for isbn in self._missing_isbns()]
+        return mismatches
+
+    def _missing_isbns(self):
+        # The ISBNs on loan that are not in the catalog, from the distinct ISBNs on loan.
+        return [isbn for isbn in self._loans.issued_isbns() if isbn not in self._books]
+
+    def _repair_availability(self, mismatches):
+        # Sets each mismatched book's available quantity to the expected one, where that can be
+        # right (a book missing from the catalog, or with more copies out than it owns, cannot);
+        # marks the mismatches repaired and returns how many were.
+        repaired = 0
+        with self.batch():
+            for mismatch in mismatches:
+                if mismatch["expected"] is not None and mismatch["expected"] >= 0:
+                    record = self._books[mismatch["isbn"]].to_dict()
+                    record["available_quantity"] = mismatch["expected"]
+                    self._commit({"op": "restock", "book": record})
+                    mismatch["repaired"] = True
+                    repaired += 1
+        return repaired
+
+    def check_integrity(self, repair=False, workers=None, chunk_size=FSCK_CHUNK_SIZE):
+        # fsck: one linear pass over the catalog and the loans, checking that every book's available
+        # quantity is its total less the copies on loan, that loans and holds name registered members
+        # and catalogued ISBNs, that nobody is over their borrowing limit and that due dates line up
+        # with loans. Chunks are checked in `workers` forked processes, which share the stores
+        # copy-on-write instead of receiving them. repair=True corrects the available quantities
+        # that can be corrected and drops holds by unknown members; the rest needs a person.
+        # Only a repair takes the writer lock; a plain check just catches up with the other desks.
+        if not repair:
+            self.refresh()
+            return self._check_integrity(False, workers, chunk_size)
+        with self._locked():
+            return self._check_integrity(True, workers, chunk_size)
+
+    def _check_integrity(self, repair, workers, chunk_size):
+        global _fsck_state
+        start = time.perf_counter()
+        workers = workers or os.cpu_count() or 1
+        isbns = list(self._books)
+        member_ids = list(self._issued_books)
+        chunks = [(kind, row, row + chunk_size) for kind, keys in (("books", isbns), ("loans", member_ids))
+                  for row in range(0, len(keys), chunk_size)]
+        state = (self, isbns, member_ids)
+        # SQLite connections and lazy stores' open files must not be shared across a fork.
+        if (workers > 1 and len(chunks) > 1 and "fork" in multiprocessing.get_all_start_methods()
+                and isinstance(self._storage, JsonStorage) and not self._storage._lazy):
+            # A lock the search index's background thread held at the fork would never be released
+            # in the children, so that pass is finished first.
+            self._search_index.join_background()
+            _fsck_state = state
             try:
-                with open(ISSUED_BOOKS_FILE, 'r') as f:
-                    self._issued_books = json.load(f)
-                    self._issued_books = {int(k): v for k, v in self._issued_books.items()}
-            except json.JSONDecodeError:
-                print(f"Warning: {ISSUED_BOOKS_FILE} is corrupted or empty. Starting with no issued records.")
-            except Exception as e:
-                print(f"An unexpected error occurred while loading {ISSUED_BOOKS_FILE}: {e}")
-
-    def _save_data(self):
+                with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("fork")) as pool:
+                    results = list(pool.map(_check_integrity_chunk, *zip(*chunks)))
+            finally:
+                _fsck_state = None
+        else:
+            results = [_check_integrity_chunk(kind, row, end, state) for kind, row, end in chunks]
+        problems = [problem for result in results for problem in result]
+        for isbn in self._missing_isbns():
+            problems += [{"check": "unknown_book", "member_id": member_id, "isbn": isbn, "copies": copies}
+                         for member_id, copies in self._loans.borrowers(isbn).items()]
+
+        repaired = 0
+        if repair:
+            with self.batch():
+                repaired = self._repair_availability([problem for problem in problems if problem["check"] == "availability"])
+                for problem in problems:
+                    if problem["check"] == "unknown_hold":
+                        # One record drops every unknown member from the queue.
+                        holds = self._books[problem["isbn"]].get_holds()
+                        if problem["member_id"] in holds:
+                            self._commit({"op": "hold", "isbn": problem["isbn"],
+                                          "holds": [member_id for member_id in holds if member_id in self._members]})
+                        problem["repaired"] = True
+                        repaired += 1
+        return {"ok": not problems or repaired == len(problems),
+                "checked": {"books": len(isbns), "members": len(self._members),
+                            "loans": sum(map(len, self._issued_books.values()))},
+                "counts": dict(Counter(problem["check"] for problem in problems)),
+                "problems": problems, "repaired": repaired, "seconds": time.perf_counter() - start}
+
+    def _commit(self, record):
+        if self._batch_depth:
+            self._apply_change(record)
+            self._pending.append(record)
+            return
+        # Written ahead: the record is applied only once it is on disk, so a write that fails
+        # leaves nothing to undo. A compaction waits until it is applied, as it saves the stores.
+        self._storage.persist([record], compact=False)
+        self._apply_change(record)
+        self._storage.compact_if_due()
+
+    def _persist(self, records):
+        # A batch's records are applied as the block runs, so they are written once it ends. A
+        # write that fails leaves the disk as it was before the batch, and the storage rolls back
+        # to it rather than reporting the batch as done; the caller still sees the error.
         try:
-            with open(BOOKS_FILE, 'w') as f:
-                json.dump([book.to_dict() for book in self._books.values()], f, indent=4)
-        except Exception as e:
-            print(f"Error saving books data: {e}")
-
+            self._storage.persist(records)
+        except ReadOnlyCatalogError:
+            raise
+        except Exception:
+            self._storage.rollback()
+            raise
+
+    @contextmanager
+    def batch(self):
+        # Applies changes immediately but defers persistence to a single write at the end. If the
+        # block raises, nothing is written and the storage rolls its changes back, as in
+        # staged_batch: the JSON storages reload once the lock is released, and SQLite's
+        # transaction is rolled back by locked().
+        discarded = False
         try:
-            students_to_save = []
-            faculty_to_save = []
-            for member in self._members.values():
-                # Polymorphism: Checks the type of member at runtime to save them to the correct section.
-                if isinstance(member, Student):
-                    students_to_save.append(member.to_dict())
-                elif isinstance(member, Faculty):
-                    faculty_to_save.append(member.to_dict())
-
-            members_data_structured = {
-                "students": students_to_save,
-                "faculty": faculty_to_save
-            }
-
-            with open(MEMBERS_FILE, 'w') as f:
-                json.dump(members_data_structured, f, indent=4)
-        except Exception as e:
-            print(f"Error saving members data: {e}")
-
+            with self._locked():
+                self._batch_depth += 1
+                try:
+                    yield self
+                except BaseException:
+                    if self._batch_depth == 1 and self._pending:
+                        self._pending = []
+                        discarded = True
+                    raise
+                finally:
+                    self._batch_depth -= 1
+                    if not self._batch_depth and self._pending:
+                        records, self._pending = self._pending, []
+                        self._persist(records)
+        finally:
+            if discarded:
+                self._storage.rollback()
+
+    @contextmanager
+    def staged_batch(self):
+        # batch() for a caller that persists on another thread, like the HTTP server's writer.
+        # Yields the list the block's records are collected in, which the caller passes to
+        # persist_staged() before the block ends; the lock is held until then. Whatever is still
+        # unpersisted when the block ends is persisted then, and if the block raises, the storage
+        # rolls the changes back, as after any failed write.
+        with self._locked():
+            if self._batch_depth:
+                raise ValueError("staged_batch() cannot run inside another batch.")
+            self._batch_depth = 1
+            records = self._pending = []
+            try:
+                yield records
+            except BaseException:
+                if records:
+                    self._storage.rollback()
+                raise
+            finally:
+                self._batch_depth = 0
+                self._pending = []
+            if records:
+                self._persist(records)
+
+    def persist_staged(self, records):
+        # Writes the records of a staged_batch(). Touches only the storage, so it may run on a
+        # worker thread while the block's thread goes on serving reads. A compaction that falls
+        # due is left out, as it rewrites (and in lazy mode reopens) the files those reads use;
+        # call compact_if_due() from the reading thread once the block has ended.
+        self._storage.persist(records, compact=False)
+        records.clear()
+
+    def compact_if_due(self):
+        # Compacts once the journal has grown past JOURNAL_COMPACT_THRESHOLD records.
+        self._storage.compact_if_due()
+
+    @_mutation
+    def process_add_book(self, title, author, isbn, quantity):
+        # Adding an ISBN that already exists adds copies to it, like the Add New Book menu.
+        if isinstance(isbn, str) and isbn.strip() in self._books:
+            return self.process_restock(isbn, quantity)
+        new_book = Book(title, author, isbn, quantity)
+        self._commit({"op": "add_book", "book": new_book.to_dict()})
+        return self._books[new_book.get_isbn()]
+
+    @_mutation
+    def process_restock(self, isbn, quantity):
+        book = self._get_book(isbn)
+        if not isinstance(quantity, int) or quantity <= 0:
+            raise ValueError("Additional quantity must be positive.")
+        book_data = book.to_dict()
+        book_data["total_quantity"] += quantity
+        book_data["available_quantity"] += quantity
+        self._commit({"op": "restock", "book": book_data})
+        self._fulfil_holds(book.get_isbn())
+        return self._books[book.get_isbn()]
+
+    @_mutation
+    def process_add_member(self, member_type, name, student_id=None, department=None):
+        member_type = str(member_type).strip().capitalize()
+        if member_type == "Student":
+            if isinstance(student_id, str) and student_id.strip() in self._student_ids:
+                raise DuplicateStudentIdError(f"A student with ID '{student_id.strip()}' already exists. Please use a unique ID.")
+            new_member = Student(name, student_id)
+        elif member_type == "Faculty":
+            new_member = Faculty(name, department)
+        else:
+            raise ValueError("Invalid member type. Please enter 'Student' or 'Faculty'.")
+        self._commit({"op": "add_member", "member": new_member.to_dict()})
+        return new_member
+
+    @_mutation
+    def process_issue(self, member_id, isbn, due_date=None):
+        member = self._get_member(member_id)
+        book = self._get_book(isbn)
+        if book.get_available_quantity() <= 0:
+            raise OutOfStockError(f"'{book.get_title()}' (ISBN: {book.get_isbn()}) is currently out of stock.")
+        holds = book.get_holds()
+        if member.get_member_id() in holds:
+            if member.get_member_id() not in self._next_holders(book, member.get_member_id()):
+                raise OutOfStockError(f"The copies of '{book.get_title()}' (ISBN: {book.get_isbn()}) are reserved for members ahead of {member.get_name()} in the hold queue.")
+        elif book.get_available_quantity() <= len(holds):
+            raise OutOfStockError(f"The copies of '{book.get_title()}' (ISBN: {book.get_isbn()}) are reserved for members with holds.")
+
+        issued_by_member = self._issued_books.get(member.get_member_id(), [])
+        # Polymorphism
+        if len(issued_by_member) >= member.get_max_books_allowed():
+            raise BorrowLimitError(f"{member.get_name()} (ID: {member.get_member_id()}) has reached their borrowing limit ({member.get_max_books_allowed()} books).")
+
+        # Polymorphism: the loan period depends on the kind of member.
+        due_date = date.fromisoformat(due_date) if due_date else date.today() + timedelta(days=member.get_loan_period_days())
+        record = {
+            "op": "issue",
+            "member_id": member.get_member_id(),
+            "isbn": book.get_isbn(),
+            "available": book.get_available_quantity() - 1,
+            "loans": issued_by_member + [book.get_isbn()],
+            "due_dates": [d for _, d in self.get_loans(member.get_member_id())] + [due_date.isoformat()],
+            "on": date.today().isoformat()
+        }
+        if member.get_member_id() in holds:
+            record["holds"] = [m for m in holds if m != member.get_member_id()]
+        self._commit(record)
+        return self._books[book.get_isbn()]
+
+    @_mutation
+    def process_return(self, member_id, isbn):
+        member = self._get_member(member_id)
+        if not self._loans.holds(member.get_member_id(), isbn):
+            raise NotIssuedError(f"Book with ISBN '{isbn}' is not listed as issued to {member.get_name()} (ID: {member.get_member_id()}).")
+        book = self._books.get(isbn)
+        if not book:
+            raise BookNotFoundError(f"Error: Book with ISBN '{isbn}' not found in library inventory.")
+        if book.get_available_quantity() >= book.get_total_quantity():
+            raise LibraryError("Failed to return book. Unexpected error: Book quantity already at max.")
+
+        remaining_loans = self.get_loans(member.get_member_id())
+        at_limit = len(remaining_loans) >= member.get_max_books_allowed()
+        # The copy that has been out the longest goes back first.
+        remaining_loans.pop([loan_isbn for loan_isbn, _ in remaining_loans].index(isbn))
+        self._commit({
+            "op": "return",
+            "member_id": member.get_member_id(),
+            "isbn": isbn,
+            "available": book.get_available_quantity() + 1,
+            "loans": [loan_isbn for loan_isbn, _ in remaining_loans],
+            "due_dates": [due_date for _, due_date in remaining_loans],
+            "on": date.today().isoformat()
+        })
+        self._fulfil_holds(isbn)
+        if at_limit:
+            # The hold queues passed the member over while they were at their limit, so copies
+            # may be waiting for them.
+            for waiting_isbn in [held_isbn for held_isbn, held in self._books.items()
+                                 if held.get_available_quantity() > 0 and member.get_member_id() in held.get_holds()]:
+                self._fulfil_holds(waiting_isbn)
+        return self._books[isbn]
+
+    def _next_holders(self, book, member_id):
+        # The holders the free copies go to, one copy each in queue order, passing over unknown
+        # members and members other than member_id at their borrowing limit.
+        holders = []
+        for holder_id in book.get_holds():
+            if len(holders) >= book.get_available_quantity():
+                break
+            holder = self._members.get(holder_id)
+            if holder_id == member_id or (holder is not None and
+                                          len(self._issued_books.get(holder_id, [])) < holder.get_max_books_allowed()):
+                holders.append(holder_id)
+        return holders
+
+    def _fulfil_holds(self, isbn):
+        # Hands free copies to the hold queue in order, passing over members at their
+        # borrowing limit (they keep their place) and dropping holds of unknown members.
+        book = self._books[isbn]
+        served = []
+        for member_id in book.get_holds():
+            if book.get_available_quantity() <= 0:
+                break
+            member = self._members.get(member_id)
+            if member is None:
+                self._commit({"op": "hold", "isbn": isbn, "holds": [m for m in book.get_holds() if m != member_id]})
+            elif len(self._issued_books.get(member_id, [])) < member.get_max_books_allowed():
+                self.process_issue(member_id, isbn)
+                served.append(member)
+            book = self._books[isbn]
+        return served
+
+    @_mutation
+    def process_place_hold(self, member_id, isbn):
+        # Joins the FIFO queue for a title with no free copies; returns the place in the queue.
+        member = self._get_member(member_id)
+        book = self._get_book(isbn)
+        holds = book.get_holds()
+        if member.get_member_id() in holds:
+            raise HoldError(f"{member.get_name()} (ID: {member.get_member_id()}) already has a hold on '{book.get_title()}'.")
+        if book.get_available_quantity() > len(holds):
+            raise HoldError(f"'{book.get_title()}' (ISBN: {book.get_isbn()}) has copies available; issue it instead.")
+        self._commit({"op": "hold", "isbn": book.get_isbn(), "holds": list(holds) + [member.get_member_id()]})
+        return len(holds) + 1
+
+    @_mutation
+    def process_cancel_hold(self, member_id, isbn):
+        member = self._get_member(member_id)
+        book = self._get_book(isbn)
+        if member.get_member_id() not in book.get_holds():
+            raise HoldError(f"{member.get_name()} (ID: {member.get_member_id()}) has no hold on '{book.get_title()}'.")
+        self._commit({"op": "hold", "isbn": book.get_isbn(),
+                      "holds": [m for m in book.get_holds() if m != member.get_member_id()]})
+        return self._books[book.get_isbn()]
+
+    def import_catalog(self, path, workers=None, chunk_size=IMPORT_CHUNK_SIZE):
+        # Bulk onboarding from a CSV file (with a title,author,isbn,quantity header) or a JSONL file.
+        # Chunks of rows are validated in a pool of `workers` processes (1 validates in this one),
+        # without holding the lock. Rows for the same ISBN are merged by summing quantities, and an
+        # ISBN already in the catalog is restocked, as add_book does for one book. The changes are
+        # then committed in one batch, so they are journaled and published like any other, and
+        # folded into the snapshots by a compaction once the lock is released.
+        start = time.perf_counter()
+        workers = workers or os.cpu_count() or 1
+        chunks = self._read_import_chunks(path, chunk_size)
+        merged = {}
+        rejected = []
+        rows = 0
+        pool = None
+
+        def validated():
+            # Results in file order, with at most two chunks per worker read ahead of the merge.
+            pending = deque()
+            for chunk in chunks:
+                pending.append(pool.submit(_validate_import_rows, chunk))
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+        if workers == 1:
+            results = map(_validate_import_rows, chunks)
+        else:
+            # The workers only need the rows they are sent, so they are not forked: a fork would
+            # copy in any lock the search index's background thread held at that moment.
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+            results = validated()
         try:
-            with open(ISSUED_BOOKS_FILE, 'w') as f:
-                json.dump({str(k): v for k, v in self._issued_books.items()}, f, indent=4)
-        except Exception as e:
-            print(f"Error saving issued books data: {e}")
+            for books, chunk_rejected in results:
+                rows += len(books) + len(chunk_rejected)
+                rejected += chunk_rejected
+                for title, author, isbn, quantity in books:
+                    entry = merged.get(isbn)
+                    if entry is None:
+                        merged[isbn] = [title, author, quantity, 1]
+                    else:
+                        entry[2] += quantity
+                        entry[3] += 1
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+        added = restocked = 0
+        held = []
+        with self.batch():
+            for isbn, (title, author, quantity, _) in merged.items():
+                book = self._books.get(isbn)
+                if book is None:
+                    self._commit({"op": "add_book", "book": {"title": title, "author": author, "isbn": isbn,
+                                                             "total_quantity": quantity, "available_quantity": quantity}})
+                    added += 1
+                else:
+                    book_data = book.to_dict()
+                    book_data["total_quantity"] += quantity
+                    book_data["available_quantity"] += quantity
+                    self._commit({"op": "restock", "book": book_data})
+                    restocked += 1
+                    if book.get_holds():
+                        held.append(isbn)
+            for isbn in held:
+                self._fulfil_holds(isbn)
+        if added or restocked:
+            self.compact()
+        return {"rows": rows, "added": added, "restocked": restocked,
+                "merged": sum(entry[3] - 1 for entry in merged.values()),
+                "rejected": rejected, "seconds": time.perf_counter() - start}
+
+    @staticmethod
+    def _read_import_chunks(path, chunk_size):
+        # JSONL lines go to the workers unparsed; CSV is split into rows here, since a quoted
+        # field may span lines.
+        with open(path, 'r', newline='', encoding='utf-8') as f:
+            if path.lower().endswith(".csv"):
+                reader = csv.DictReader(f)
+                reader.fieldnames = [name.strip().lower() for name in reader.fieldnames or []]
+                missing = {"title", "author", "isbn", "quantity"} - set(reader.fieldnames)
+                if missing:
+                    raise ValueError(f"{path} has no {', '.join(sorted(missing))} column.")
+                rows = ((reader.line_num, row) for row in reader)
+            else:
+                rows = ((line_number, line) for line_number, line in enumerate(f, 1) if line.strip())
+            chunk = []
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+
+    def process_batch(self, path):
+        # Applies a JSONL feed of operations in one pass and persists once at the end.
+        handlers = {
+            "add_book": lambda op: self.process_add_book(op["title"], op["author"], op["isbn"], op["quantity"]),
+            "add_member": lambda op: self.process_add_member(op["type"], op["name"], op.get("student_id"), op.get("department")),
+            "issue": lambda op: self.process_issue(op["member_id"], op["isbn"]),
+            "return": lambda op: self.process_return(op["member_id"], op["isbn"]),
+            "hold": lambda op: self.process_place_hold(op["member_id"], op["isbn"]),
+            "cancel_hold": lambda op: self.process_cancel_hold(op["member_id"], op["isbn"]),
+        }
+        applied = 0
+        failures = []
+        with open(path, 'r') as f, self.batch():
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    operation = json.loads(line)
+                    if operation.get("op") not in handlers:
+                        raise ValueError(f"Unknown operation '{operation.get('op')}'.")
+                    handlers[operation["op"]](operation)
+                    applied += 1
+                except (LibraryError, ValueError, KeyError, TypeError, AttributeError) as e:
+                    failures.append({"line": line_number, "error": str(e)})
+        return {"applied": applied, "failed": failures}
+
+    def _get_book(self, isbn):
+        book = self._books.get(isbn.strip()) if isinstance(isbn, str) else None
+        if book is None:
+            raise BookNotFoundError(f"Book with ISBN '{isbn}' not found.")
+        return book
+
+    def _get_member(self, member_id):
+        member = self._members.get(member_id)
+        if member is None:
+            raise MemberNotFoundError(f"Member with ID '{member_id}' not found.")
+        return member
 
     def add_book(self):
         print("\n--- Add New Book ---")
@@ -296,10 +949,8 @@ class LibrarySystem:
                     try:
                         add_qty = int(input(f"Current total quantity for '{existing_book.get_title()}': {existing_book.get_total_quantity()}. Enter additional quantity to add: "))
                         if add_qty > 0:
-                            existing_book._total_quantity += add_qty
-                            existing_book._available_quantity += add_qty
-                            print(f"Quantity updated successfully for '{existing_book.get_title()}'. New total: {existing_book.get_total_quantity()}")
-                            self._save_data()
+                            book = self.process_restock(isbn, add_qty)
+                            print(f"Quantity updated successfully for '{book.get_title()}'. New total: {book.get_total_quantity()}")
                             return
                         else:
                             print("Additional quantity must be positive.")
@@ -319,10 +970,8 @@ class LibrarySystem:
                 print("Invalid input. Please enter a number for quantity.")
 
         try:
-            new_book = Book(title, author, isbn, quantity)
-            self._books[isbn] = new_book
+            self.process_add_book(title, author, isbn, quantity)
             print(f"Book '{title}' (ISBN: {isbn}) added successfully.")
-            self._save_data()
         except ValueError as e:
             print(f"Error adding book: {e}")
 
@@ -332,9 +981,27 @@ class LibrarySystem:
             print("No books available in the library.")
             return
 
-        for book in self._books.values():
-            print(book)
-        print("-" * 30)
+        # A page at a time, each printed with one write.
+        cursor = None
+        while True:
+            books, cursor = self.page_books(cursor)
+            print("".join(map(self._book_text, books)) + "-" * 30)
+            if cursor is None or input("Show more books? (y/n): ").strip().lower() != 'y':
+                break
+
+    def find_books(self, search_term, limit=None, offset=0, fuzzy=False):
+        # Exact ISBN lookups stay a direct dict hit, ranked ahead of whatever the index finds for
+        # the same term. limit and offset select one page of the ranked results; fuzzy=True
+        # tolerates typos. ISBNs match regardless of case, as before the index, so "...x" finds
+        # an ISBN ending in "X".
+        search_term = search_term.strip()
+        search = self._search_index.fuzzy_search if fuzzy else self._search_index.search
+        hit = next((isbn for isbn in (search_term, search_term.upper(), search_term.lower()) if isbn in self._books), None)
+        if hit is None:
+            return [self._books[isbn] for isbn in search(search_term, limit, offset)]
+        end = None if limit is None else offset + limit
+        isbns = [hit] + [isbn for isbn in search(search_term, end) if isbn != hit]
+        return [self._books[isbn] for isbn in isbns[offset:end]]
 
     def search_book(self):
         print("\n--- Search Book ---")
@@ -342,21 +1009,29 @@ class LibrarySystem:
             print("No books available to search.")
             return
 
-        search_term = input("Enter title, author, or ISBN to search: ").strip().lower()
-        found_books = []
-        for book in self._books.values():
-            if (search_term in book.get_title().lower() or
-                search_term in book.get_author().lower() or
-                search_term == book.get_isbn().lower()):
-                found_books.append(book)
-
-        if found_books:
-            print("\n--- Search Results ---")
-            for book in found_books:
+        search_term = input("Enter title, author, or ISBN to search: ").strip()
+        # One page at a time; the extra result fetched tells whether there is another page.
+        fuzzy = False
+        found_books = self.find_books(search_term, SEARCH_PAGE_SIZE + 1)
+        if not found_books:
+            fuzzy = True
+            found_books = self.find_books(search_term, SEARCH_PAGE_SIZE + 1, fuzzy=True)
+        if not found_books:
+            print("No books found matching your search term.")
+            return
+
+        print("\n--- Close Matches ---" if fuzzy else "\n--- Search Results ---")
+        offset = 0
+        while True:
+            for book in found_books[:SEARCH_PAGE_SIZE]:
                 print(book)
             print("-" * 30)
-        else:
-            print("No books found matching your search term.")
+            if len(found_books) <= SEARCH_PAGE_SIZE:
+                break
+            if input("Show more results? (y/n): ").strip().lower() != 'y':
+                break
+            offset += SEARCH_PAGE_SIZE
+            found_books = self.find_books(search_term, SEARCH_PAGE_SIZE + 1, offset, fuzzy)
 
     def add_member(self):
         print("\n--- Add New Member ---")
@@ -378,14 +1053,13 @@ class LibrarySystem:
             while True:
                 student_id = input("Enter student ID: ").strip()
                 if student_id:
-                    if any(isinstance(m, Student) and m.get_student_id() == student_id for m in self._members.values()):
-                        print(f"A student with ID '{student_id}' already exists. Please use a unique ID.")
-                    else:
-                        try:
-                            new_member = Student(name, student_id)
-                            break
-                        except ValueError as e:
-                            print(f"Error creating student: {e}")
+                    try:
+                        new_member = self.process_add_member(member_type, name, student_id=student_id)
+                        break
+                    except DuplicateStudentIdError as e:
+                        print(e)
+                    except ValueError as e:
+                        print(f"Error creating student: {e}")
                 else:
                     print("Student ID cannot be empty. Please try again.")
         elif member_type == "Faculty":
@@ -393,7 +1067,7 @@ class LibrarySystem:
                 department = input("Enter department: ").strip()
                 if department:
                     try:
-                        new_member = Faculty(name, department)
+                        new_member = self.process_add_member(member_type, name, department=department)
                         break
                     except ValueError as e:
                         print(f"Error creating faculty member: {e}")
@@ -401,9 +1075,7 @@ class LibrarySystem:
                     print("Department cannot be empty. Please try again.")
 
         if new_member:
-            self._members[new_member.get_member_id()] = new_member
             print(f"{member_type} '{name}' (ID: {new_member.get_member_id()}) added successfully.")
-            self._save_data()
         else:
             print("Failed to add member due to invalid input.")
 
@@ -413,20 +1085,25 @@ class LibrarySystem:
             print("No members registered in the system.")
             return
 
-        for member in self._members.values():
+        # A page at a time, each printed with one write.
+        cursor = None
+        while True:
+            members, cursor = self.page_members(cursor)
+            print("".join(map(self._member_text, members)), end="")
+            if cursor is None or input("Show more members? (y/n): ").strip().lower() != 'y':
+                break
+
+    def view_members_by_department(self):
+        print("\n--- Faculty by Department ---")
+        department = input("Enter department: ").strip()
+        members = self.get_members_by_department(department)
+        if not members:
+            print(f"No faculty members registered in department '{department}'.")
+            return
+
+        for member in members:
             print(member)
-            borrowed_isbns = self._issued_books.get(member.get_member_id())
-            if borrowed_isbns:
-                print("  Borrowed Books:")
-                for i, isbn in enumerate(borrowed_isbns):
-                    book = self._books.get(isbn)
-                    if book:
-                        print(f"    {i+1}. {book.get_title()} by {book.get_author()} (ISBN: {isbn})")
-                    else:
-                        print(f"    {i+1}. Unknown Book (ISBN: {isbn}) - Data might be missing.")
-            else:
-                print("  No books currently borrowed.")
-            print("-" * 30)
+        print("-" * 30)
 
     def issue_book(self):
         print("\n--- Issue Book ---")
@@ -451,28 +1128,24 @@ class LibrarySystem:
         while True:
             isbn = input("Enter ISBN of the book to issue: ").strip()
             if isbn in self._books:
-                book = self._books[isbn]
                 break
             else:
                 print("Book not found. Please enter a valid ISBN.")
 
-        if book.get_available_quantity() <= 0:
-            print(f"'{book.get_title()}' (ISBN: {isbn}) is currently out of stock.")
-            return
-
-        issued_by_member = self._issued_books.get(member_id, [])
-        # Polymorphism
-        if len(issued_by_member) >= member.get_max_books_allowed():
-            print(f"{member.get_name()} (ID: {member_id}) has reached their borrowing limit ({member.get_max_books_allowed()} books).")
-            return
-
-        if book.decrement_available_quantity():
-            issued_by_member.append(isbn)
-            self._issued_books[member_id] = issued_by_member
-            print(f"Book '{book.get_title()}' issued to {member.get_name()} (ID: {member_id}) successfully.")
-            self._save_data()
-        else:
-            print("Failed to issue book. Unexpected error: Book not available.")
+        try:
+            book = self.process_issue(member_id, isbn)
+            due_date = self.get_loans(member_id)[-1][1]
+            print(f"Book '{book.get_title()}' issued to {member.get_name()} (ID: {member_id}) successfully. Due back on {due_date}.")
+        except OutOfStockError as e:
+            print(e)
+            if input("Place a hold instead? (y/n): ").strip().lower() == 'y':
+                try:
+                    position = self.process_place_hold(member_id, isbn)
+                    print(f"Hold placed. {member.get_name()} is number {position} in the queue.")
+                except LibraryError as e:
+                    print(e)
+        except LibraryError as e:
+            print(e)
 
     def return_book(self):
         print("\n--- Return Book ---")
@@ -491,41 +1164,79 @@ class LibrarySystem:
             except ValueError:
                 print("Invalid Member ID. Please enter a number.")
 
-        issued_by_member = self._issued_books.get(member_id)
+        issued_by_member = self.get_loans(member_id)
         if not issued_by_member:
             print(f"{member.get_name()} (ID: {member_id}) currently has no books issued.")
             return
 
         print(f"\nBooks issued to {member.get_name()} (ID: {member_id}):")
-        for i, isbn in enumerate(issued_by_member):
+        for i, (isbn, due_date) in enumerate(issued_by_member):
             book = self._books.get(isbn)
+            due = f", due {due_date}" if due_date else ""
             if book:
-                print(f"{i+1}. {book.get_title()} (ISBN: {isbn})")
+                print(f"{i+1}. {book.get_title()} (ISBN: {isbn}{due})")
             else:
-                print(f"{i+1}. Unknown Book (ISBN: {isbn}) - Data might be missing.")
+                print(f"{i+1}. Unknown Book (ISBN: {isbn}{due}) - Data might be missing.")
 
         while True:
             isbn_to_return = input("Enter ISBN of the book to return: ").strip()
-            if isbn_to_return in issued_by_member:
+            if self._loans.holds(member_id, isbn_to_return):
                 break
             else:
                 print("This book is not listed as issued to this member. Please enter a correct ISBN from the list above.")
 
-        book = self._books.get(isbn_to_return)
+        try:
+            waiting = self._books[isbn_to_return].get_holds() if isbn_to_return in self._books else ()
+            book = self.process_return(member_id, isbn_to_return)
+            print(f"Book '{book.get_title()}' returned by {member.get_name()} (ID: {member_id}) successfully.")
+            for waiting_id in waiting:
+                if waiting_id not in book.get_holds() and self._loans.holds(waiting_id, isbn_to_return):
+                    print(f"The copy was issued to Member ID {waiting_id}, who had it on hold.")
+        except LibraryError as e:
+            print(e)
+
+    def place_hold(self):
+        print("\n--- Place Hold ---")
+        try:
+            member_id = int(input("Enter Member ID: "))
+        except ValueError:
+            print("Invalid Member ID. Please enter a number.")
+            return
+        isbn = input("Enter ISBN of the book to hold: ").strip()
+        try:
+            position = self.process_place_hold(member_id, isbn)
+            print(f"Hold placed. Member ID {member_id} is number {position} in the queue.")
+        except LibraryError as e:
+            print(e)
+
+    def view_overdue_loans(self):
+        print("\n--- Overdue Loans ---")
+        overdue = self.get_overdue_loans()
+        if not overdue:
+            print("No loans are overdue.")
+            return
+
+        for loan in overdue:
+            member = self._members.get(loan["member_id"])
+            book = self._books.get(loan["isbn"])
+            print(f"{member.get_name() if member else 'Unknown Member'} (ID: {loan['member_id']}): "
+                  f"{book.get_title() if book else 'Unknown Book'} (ISBN: {loan['isbn']}), "
+                  f"due {loan['due_date']}, {loan['days_overdue']} days overdue")
+        print("-" * 30)
+
+    def view_borrowers(self):
+        print("\n--- Borrowers of a Book ---")
+        isbn = input("Enter ISBN: ").strip()
+        book = self._books.get(isbn)
         if not book:
-            print(f"Error: Book with ISBN '{isbn_to_return}' not found in library inventory.")
+            print("Book not found. Please enter a valid ISBN.")
             return
 
-        if book.increment_available_quantity():
-            issued_by_member.remove(isbn_to_return)
-            if not issued_by_member:
-                del self._issued_books[member_id]
-            else:
-                self._issued_books[member_id] = issued_by_member
-            print(f"Book '{book.get_title()}' returned by {member.get_name()} (ID: {member_id}) successfully.")
-            self._save_data()
-        else:
-            print("Failed to return book. Unexpected error: Book quantity already at max.")
+        borrowers = self.get_borrowers(isbn)
+        print(f"'{book.get_title()}': {self.get_issued_count(isbn)} of {book.get_total_quantity()} copies issued.")
+        for member, copies in borrowers:
+            print(f"  {member}" + (f" ({copies} copies)" if copies > 1 else ""))
+        print("-" * 30)
 
     def display_main_menu(self):
         print("\n===== Library Management System =====")
@@ -547,18 +1258,24 @@ class LibrarySystem:
         print("\n--- Member Management ---")
         print("1. Add New Member")
         print("2. View All Members")
-        print("3. Back to Main Menu")
+        print("3. View Faculty by Department")
+        print("4. Back to Main Menu")
         print("-------------------------")
 
     def display_issue_return_menu(self):
         print("\n--- Issue/Return Books ---")
         print("1. Issue Book")
         print("2. Return Book")
-        print("3. Back to Main Menu")
+        print("3. View Borrowers of a Book")
+        print("4. Place Hold")
+        print("5. View Overdue Loans")
+        print("6. Back to Main Menu")
         print("--------------------------")
 
     def run(self):
         while True:
+            # Picks up loans and additions made by other desks (shared mode only).
+            self.refresh()
             self.display_main_menu()
             choice = input("Enter your choice: ").strip()
 
@@ -585,6 +1302,8 @@ class LibrarySystem:
                     elif member_choice == '2':
                         self.view_all_members()
                     elif member_choice == '3':
+                        self.view_members_by_department()
+                    elif member_choice == '4':
                         break
                     else:
                         print("Invalid choice. Please try again.")
@@ -597,15 +1316,236 @@ class LibrarySystem:
                     elif issue_return_choice == '2':
                         self.return_book()
                     elif issue_return_choice == '3':
+                        self.view_borrowers()
+                    elif issue_return_choice == '4':
+                        self.place_hold()
+                    elif issue_return_choice == '5':
+                        self.view_overdue_loans()
+                    elif issue_return_choice == '6':
                         break
                     else:
                         print("Invalid choice. Please try again.")
             elif choice == '4':
+                try:
+                    self.compact()
+                except OSError as e:
+                    print(f"Error saving library data: {e} The changes are kept in the journal.")
                 print("Exiting Library Management System. Goodbye!")
                 break
             else:
                 print("Invalid choice. Please try again.")
 
+def migrate_json_to_sqlite(data_dir='.', db_path=None):
+    # One-shot copy of books.json, members.json, issued_books.json (and any journal) into SQLite.
+    source = LibrarySystem(data_dir=data_dir)
+    storage = SQLiteStorage(db_path or os.path.join(data_dir, SQLITE_FILE))
+    target = LibrarySystem(storage=storage)
+    storage.import_library(source)
+    with storage.locked():
+        target._analytics.load(source._analytics.to_dict())
+    source.close()
+    return target
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Library Management System")
+    parser.add_argument("--data-dir", default=".", help="directory holding the JSON data files")
+    parser.add_argument("--shared", action="store_true", help="lock and version the data files so several desks can share them")
+    parser.add_argument("--storage", choices=["json", "sqlite"], default="json", help="storage backend")
+    parser.add_argument("--db", help=f"SQLite database path (default: DATA_DIR/{SQLITE_FILE})")
+    parser.add_argument("--trusted-load", action="store_true", help="skip re-validating records from the JSON files at startup")
+    parser.add_argument("--lazy", action="store_true", help="load books and members from the JSON files on first use")
+    parser.add_argument("--catalog-only", action="store_true",
+                        help=f"read-only book lookups from a memory-mapped {CATALOG_FILE}, for kiosks")
+    parser.add_argument("--shards", type=int, metavar="N",
+                        help="split the JSON files across N shard directories, by ISBN and member ID")
+    parser.add_argument("--change-stream", action="store_true",
+                        help=f"publish every change to {CHANGES_FILE} for read replicas (on for every desk once it exists)")
+    parser.add_argument("--replica", action="store_true",
+                        help=f"read-only desk that loads the data files once and then follows {CHANGES_FILE}")
+    parser.add_argument("--snapshot-format", choices=["json", "binary"],
+                        help="format to save the data files in (default: the format they are already in)")
+    parser.add_argument("--stats", metavar="PATH", help=f"write per-operation metrics to PATH in Prometheus text format (or set {STATS_ENV})")
+    parser.add_argument("--stats-interval", type=float, default=STATS_DUMP_INTERVAL, help="seconds between metric dumps")
+    parser.add_argument("--profile", metavar="OPERATION[:MODE]", action="append", default=[],
+                        help="sample an operation with cprofile (default) or tracemalloc; needs --stats")
+    parser.add_argument("--profile-every", type=int, default=1, help="profile every Nth call of a sampled operation")
+    subparsers = parser.add_subparsers(dest="command")
+    batch_parser = subparsers.add_parser("batch", help="apply a JSONL file of operations non-interactively")
+    batch_parser.add_argument("path", help="JSONL file with one operation per line")
+    subparsers.add_parser("migrate-sqlite", help="copy the JSON data files into the SQLite database")
+    overdue_parser = subparsers.add_parser("overdue", help="list loans that are past their due date")
+    overdue_parser.add_argument("--as-of", type=date.fromisoformat, help="date to check against (YYYY-MM-DD, default today)")
+    overdue_parser.add_argument("--new-only", action="store_true",
+                                help="list only the loans that became overdue since the last --new-only run")
+    reconcile_parser = subparsers.add_parser("reconcile", help="check available quantities against the loans on record")
+    reconcile_parser.add_argument("--repair", action="store_true", help="correct the quantities that can be corrected")
+    fsck_parser = subparsers.add_parser("fsck", help="check every invariant between books, members and loans")
+    fsck_parser.add_argument("--repair", action="store_true", help="correct the quantities and holds that can be corrected")
+    fsck_parser.add_argument("--workers", type=int, help="checking processes (default: one per CPU)")
+    fsck_parser.add_argument("--report", metavar="PATH", help="write the full report as JSON to PATH ('-' for stdout)")
+    analytics_parser = subparsers.add_parser("analytics", help="circulation report: popular titles, utilization, activity")
+    analytics_parser.add_argument("--top", type=int, default=10, help="titles, members and authors to list")
+    analytics_parser.add_argument("--days", type=int, default=7, help="days of daily issues and returns")
+    analytics_parser.add_argument("--weeks", type=int, default=4, help="ISO weeks of weekly issues and returns")
+    analytics_parser.add_argument("--author", help="show this author's utilization instead of the most utilized")
+    analytics_parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    import_parser = subparsers.add_parser("import", help="bulk-import a CSV or JSONL catalog")
+    import_parser.add_argument("path", help="CSV file with a title,author,isbn,quantity header, or JSONL with those keys")
+    import_parser.add_argument("--workers", type=int, help="validation processes (default: one per CPU)")
+    import_parser.add_argument("--rejects", help="write the rejected rows to this JSONL file")
+    export_parser = subparsers.add_parser("export", help="stream every book or member to a file or pipe")
+    export_parser.add_argument("kind", choices=["books", "members"])
+    export_parser.add_argument("--format", choices=EXPORT_FORMATS, default="text")
+    export_parser.add_argument("--output", help="file to write (default: standard output)")
+    convert_parser = subparsers.add_parser("convert", help="rewrite the data files as JSON or binary snapshots")
+    convert_parser.add_argument("--to", choices=["json", "binary"], required=True)
+    convert_parser.add_argument("--compress", action="store_true", help="zlib-compress binary snapshots")
+    args = parser.parse_args(argv)
+    db_path = args.db or os.path.join(args.data_dir, SQLITE_FILE)
+
+    if args.command == "migrate-sqlite":
+        library = migrate_json_to_sqlite(args.data_dir, db_path)
+        print(f"Migrated {len(library._books)} books and {len(library._members)} members into {db_path}.")
+        library.close()
+        return
+
+    if args.shards and (args.storage == "sqlite" or args.lazy or args.catalog_only):
+        parser.error("--shards cannot be combined with --storage sqlite, --lazy or --catalog-only")
+    if args.command == "convert":
+        if args.shards:
+            storage = ShardedStorage(args.data_dir, args.shards, snapshot_format=args.to, compress=args.compress,
+                                     shared=args.shared)
+        else:
+            storage = JsonStorage(args.data_dir, shared=args.shared, snapshot_format=args.to, compress=args.compress)
+        library = LibrarySystem(storage=storage)
+        library._save_data(force=True)
+        library.compact()
+        library.close()
+        print(f"Saved {len(library._books)} books and {len(library._members)} members as {'binary snapshots' if args.to == 'binary' else 'JSON files'}.")
+        return
+
+    if args.lazy and args.storage == "sqlite":
+        parser.error("--lazy applies to the JSON storage only")
+    if args.snapshot_format and args.storage == "sqlite":
+        parser.error("--snapshot-format applies to the JSON storage only")
+    if args.catalog_only and (args.storage == "sqlite" or args.lazy or args.shared or args.snapshot_format):
+        parser.error("--catalog-only cannot be combined with --storage sqlite, --lazy, --shared or --snapshot-format")
+    if args.replica and (args.storage == "sqlite" or args.lazy or args.shared or args.catalog_only or args.shards
+                         or args.snapshot_format or args.change_stream):
+        parser.error("--replica cannot be combined with --storage sqlite, --lazy, --shared, --catalog-only, --shards, "
+                     "--snapshot-format or --change-stream")
+    if args.change_stream and (args.storage == "sqlite" or args.shards):
+        parser.error("--change-stream applies to the unsharded JSON storage only")
+    if args.profile and not args.stats:
+        parser.error("--profile needs --stats")
+    instrumentation = None
+    if args.stats:
+        instrumentation = Instrumentation(args.stats, args.stats_interval)
+        for spec in args.profile:
+            operation, _, mode = spec.partition(":")
+            instrumentation.profile(operation, mode or "cprofile", args.profile_every)
+    storage = SQLiteStorage(db_path) if args.storage == "sqlite" else None
+    if args.catalog_only:
+        storage = CatalogStorage(args.data_dir)
+    if args.replica:
+        storage = ReplicaStorage(args.data_dir, trusted=args.trusted_load)
+    library = LibrarySystem(data_dir=args.data_dir, shared=args.shared, storage=storage, trusted_load=args.trusted_load,
+                            lazy=args.lazy, instrumentation=instrumentation, snapshot_format=args.snapshot_format,
+                            shards=args.shards, change_stream=args.change_stream)
+    try:
+        if args.command == "batch":
+            result = library.process_batch(args.path)
+            for failure in result["failed"]:
+                print(f"Line {failure['line']}: {failure['error']}")
+            print(f"Applied {result['applied']} operations, {len(result['failed'])} failed.")
+            library.compact()
+        elif args.command == "overdue":
+            overdue = library.get_overdue_loans(args.as_of, new_only=args.new_only)
+            for loan in overdue:
+                print(f"Member ID {loan['member_id']}: ISBN {loan['isbn']} due {loan['due_date']} ({loan['days_overdue']} days overdue)")
+            print(f"{len(overdue)} {'newly ' if args.new_only else ''}overdue loans.")
+        elif args.command == "import":
+            try:
+                result = library.import_catalog(args.path, args.workers)
+            except (OSError, ValueError, LibraryError) as e:
+                print(f"Import failed: {e}")
+                sys.exit(1)
+            for reject in result["rejected"][:20]:
+                print(f"Line {reject['line']}: {reject['error']}")
+            if len(result["rejected"]) > 20:
+                print(f"... and {len(result['rejected']) - 20} more rejected rows.")
+            if args.rejects:
+                with open(args.rejects, 'w') as f:
+                    f.writelines(json.dumps(reject) + "\n" for reject in result["rejected"])
+            print(f"Imported {result['rows'] - len(result['rejected'])} of {result['rows']} rows in {result['seconds']:.2f}s "
+                  f"({result['rows'] / max(result['seconds'], 1e-9):,.0f} rows/s): {result['added']} new titles, "
+                  f"{result['restocked']} restocked, {result['merged']} duplicate rows merged, "
+                  f"{len(result['rejected'])} rejected.")
+        elif args.command == "reconcile":
+            mismatches = library.reconcile_availability(repair=args.repair)
+            for m in mismatches:
+                if m["expected"] is None:
+                    print(f"ISBN {m['isbn']}: {m['issued']} copies on loan but the book is not in the catalog.")
+                else:
+                    print(f"ISBN {m['isbn']}: available {m['available']}, expected {m['expected']} ({m['issued']} on loan).")
+            print(f"{len(mismatches)} mismatches found{', repaired where possible' if args.repair and mismatches else ''}.")
+            if args.repair:
+                library.compact()
+        elif args.command == "export":
+            try:
+                if args.output:
+                    with open(args.output, 'w', newline='', encoding='utf-8') as f:
+                        count = library.export(args.kind, f, args.format)
+                    print(f"Exported {count} {args.kind} to {args.output}.")
+                else:
+                    library.export(args.kind, sys.stdout, args.format)
+                    sys.stdout.flush()
+            except BrokenPipeError:
+                # The reader (e.g. head) went away; stop quietly, as other command-line tools do.
+                os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        elif args.command == "analytics":
+            report = library.get_analytics(args.top, args.days, args.weeks, args.author)
+            if args.json:
+                print(json.dumps(report, indent=4))
+                return
+            print("--- Most Borrowed Titles ---")
+            for i, entry in enumerate(report["top_titles"]):
+                print(f"{i+1}. {entry['title'] or 'Unknown Book'} (ISBN: {entry['isbn']}): issued {entry['issues']} times")
+            print("--- Most Active Members ---")
+            for i, entry in enumerate(report["top_members"]):
+                print(f"{i+1}. Member ID {entry['member_id']}: {entry['issues']} books borrowed")
+            print("--- Author Utilization ---")
+            for entry in [report["utilization"]] if args.author else report["utilization"]:
+                print(f"{entry['author']}: {entry['out']} of {entry['owned']} copies out ({entry['utilization']:.0%})")
+            print("--- Faculty Activity by Department ---")
+            for department, counts in sorted(report["departments"].items()):
+                print(f"{department}: {counts['issues']} issued, {counts['returns']} returned, {counts['on_loan']} on loan")
+            for period in ("daily", "weekly"):
+                print(f"--- {period.capitalize()} Circulation ---")
+                for entry in report[period]:
+                    print(f"{entry['period']}: {entry['issues']} issued, {entry['returns']} returned")
+        elif args.command == "fsck":
+            report = library.check_integrity(repair=args.repair, workers=args.workers)
+            if args.report == "-":
+                print(json.dumps(report, indent=4))
+            else:
+                if args.report:
+                    _write_json_atomic(args.report, report)
+                for problem in report["problems"][:20]:
+                    print(FSCK_MESSAGES[problem["check"]].format(**problem) + (" Repaired." if problem.get("repaired") else ""))
+                if len(report["problems"]) > 20:
+                    print(f"... and {len(report['problems']) - 20} more problems.")
+                checked = report["checked"]
+                print(f"Checked {checked['books']} books, {checked['members']} members and {checked['loans']} loans "
+                      f"in {report['seconds']:.2f}s: {len(report['problems'])} problems, {report['repaired']} repaired.")
+            if args.repair:
+                library.compact()
+            if not report["ok"]:
+                sys.exit(1)
+        else:
+            library.run()
+    finally:
+        library.close()
+
 if __name__ == "__main__":
-    library = LibrarySystem()
-    library.run()
+    main()
@@ -0,0 +1,57 @@
+import sqlite3
+
+from library_analytics import SortedRanking
+from library_system import CirculationStats, LibrarySystem, SQLiteStorage
+
+
+def stock(library):
+    with library.batch():
+        library.process_add_book("Dune", "Frank Herbert", "111", 2)
+        library.process_add_book("Emma", "Jane Austen", "222", 4)
+        member = library.process_add_member("student", "Ada", student_id="s1")
+    library.process_issue(member.get_member_id(), "111")
+    library.process_issue(member.get_member_id(), "222")
+    return member
+
+
+def test_sqlite_analytics_survive_a_restart(tmp_path):
+    path = str(tmp_path / "library.db")
+    library = LibrarySystem(storage=SQLiteStorage(path))
+    stock(library)
+    report = library.get_analytics()
+    assert [entry["issues"] for entry in report["top_titles"]] == [1, 1]
+    assert [entry["author"] for entry in report["utilization"]] == ["Frank Herbert", "Jane Austen"]
+    assert LibrarySystem(storage=SQLiteStorage(path)).get_analytics() == report
+
+
+def test_sqlite_analytics_roll_back_with_the_change(tmp_path):
+    path = str(tmp_path / "library.db")
+    library = LibrarySystem(storage=SQLiteStorage(path))
+    member = stock(library)
+    try:
+        with library.batch():
+            library.process_return(member.get_member_id(), "111")
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT SUM(returns) FROM analytics_daily").fetchone() == (0,)
+
+
+def test_utilization_ranking_follows_stock_changes():
+    stats = CirculationStats()
+    books = {}
+    stats.utilization(books)
+    stats.stock_changed("A", 4, 1)
+    stats.stock_changed("B", 2, 1)
+    stats.stock_changed("A", 0, 3)
+    assert [entry["author"] for entry in stats.utilization(books, k=2)] == ["A", "B"]
+
+
+def test_sorted_ranking_splits_blocks():
+    ranking = SortedRanking()
+    ranking.BLOCK = 2
+    for entry in [5, 1, 4, 2, 3, 6, 0]:
+        ranking.add(entry)
+    ranking.remove(4)
+    assert ranking.largest(10) == [6, 5, 3, 2, 1, 0]
@@ -0,0 +1,44 @@
+import json
+import os
+
+import pytest
+
+from library_system import LibrarySystem
+
+
+def test_batch_feed_is_persisted_in_one_journal_write(tmp_path, monkeypatch):
+    data_dir = str(tmp_path)
+    library = LibrarySystem(data_dir)
+    member = library.process_add_member("student", "Ada", student_id="s1")
+    feed = tmp_path / "feed.jsonl"
+    feed.write_text("\n".join(json.dumps(op) for op in [
+        {"op": "add_book", "title": "Dune", "author": "Frank Herbert", "isbn": "111", "quantity": 1},
+        {"op": "issue", "member_id": member.get_member_id(), "isbn": "111"},
+        {"op": "issue", "member_id": member.get_member_id(), "isbn": "111"},
+        {"op": "shelve", "isbn": "111"},
+    ]))
+    fsyncs = []
+    fsync = os.fsync
+    monkeypatch.setattr(os, "fsync", lambda fd: fsyncs.append(fd) or fsync(fd))
+    result = library.process_batch(str(feed))
+    monkeypatch.undo()
+    assert result["applied"] == 2
+    assert [failure["line"] for failure in result["failed"]] == [3, 4]
+    assert len(fsyncs) == 1
+    reopened = LibrarySystem(data_dir)
+    assert reopened.get_book("111").get_available_quantity() == 0
+
+
+def test_batch_that_raises_writes_nothing_and_undoes_its_changes(tmp_path):
+    data_dir = str(tmp_path)
+    library = LibrarySystem(data_dir)
+    library.process_add_book("Dune", "Frank Herbert", "111", 1)
+    with pytest.raises(RuntimeError):
+        with library.batch():
+            library.process_add_book("Emma", "Jane Austen", "222", 1)
+            library.process_restock("111", 2)
+            raise RuntimeError("feed aborted")
+    reopened = LibrarySystem(data_dir)
+    for desk in (library, reopened):
+        assert [book.get_isbn() for book in desk.find_books("emma")] == []
+        assert desk.get_book("111").get_total_quantity() == 1
@@ -0,0 +1,27 @@
+import filecmp
+import queue
+
+from benchmark import _suite_run, write_dataset
+from library_system import LibrarySystem
+
+
+def test_dataset_is_reproducible_and_consistent(tmp_path):
+    first, second = tmp_path / "first", tmp_path / "second"
+    first.mkdir()
+    second.mkdir()
+    write_dataset(str(first), 200, 30, 50, seed=7)
+    write_dataset(str(second), 200, 30, 50, seed=7)
+    for name in ("books.json", "members.json", "issued_books.json"):
+        assert filecmp.cmp(first / name, second / name, shallow=False)
+    assert LibrarySystem(str(first)).check_integrity(workers=1)["ok"]
+
+
+def test_suite_finishes_on_a_catalog_with_no_copies_left(tmp_path):
+    write_dataset(str(tmp_path), 3, 40, 1000)
+    library = LibrarySystem(str(tmp_path))
+    assert all(book.get_available_quantity() == 0 for book in library._books.values())
+    results = queue.Queue()
+    _suite_run(str(tmp_path), 20, 1, False, False, 42, results)
+    run = results.get_nowait()
+    assert "issue_book" not in run["results"]
+    assert run["results"]["add_member"]
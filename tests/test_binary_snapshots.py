@@ -0,0 +1,36 @@
+import pytest
+
+from benchmark import write_dataset
+from library_storage import BinarySnapshot
+from library_system import JsonStorage, LibrarySystem, main
+
+
+def state(library):
+    return ({isbn: book.to_dict() for isbn, book in library._books.items()},
+            {member_id: member.to_dict() for member_id, member in library._members.items()},
+            {member_id: library.get_loans(member_id) for member_id in library._issued_books})
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_binary_snapshots_round_trip(tmp_path, compress):
+    data_dir = str(tmp_path)
+    write_dataset(data_dir, 200, 30, 50)
+    expected = state(LibrarySystem(data_dir))
+    main(["--data-dir", data_dir, "convert", "--to", "binary"] + (["--compress"] if compress else []))
+    library = LibrarySystem(data_dir)
+    assert state(library) == expected
+    library.process_add_book("Dune", "Frank Herbert", "NEW-1", 1)
+    library.compact()
+    storage = JsonStorage(data_dir)
+    assert "NEW-1" in LibrarySystem(storage=storage)._books
+    assert storage._formats["books"] == ("binary", compress)
+
+
+def test_corrupted_snapshot_fails_its_checksum(tmp_path):
+    path = tmp_path / "books.snap"
+    BinarySnapshot.write(str(path), [b"books", b"payload"])
+    data = bytearray(path.read_bytes())
+    data[-1] ^= 1
+    path.write_bytes(bytes(data))
+    with pytest.raises(ValueError, match="checksum"):
+        BinarySnapshot.read(str(path))
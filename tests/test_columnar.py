@@ -0,0 +1,18 @@
+from library_system import Book, LibrarySystem
+
+
+def test_columnar_catalog_persists_like_the_default_one(tmp_path):
+    data_dir = str(tmp_path)
+    library = LibrarySystem(data_dir, columnar=True)
+    library.process_add_book("Dune", "Frank Herbert", "111", 2)
+    member = library.process_add_member("student", "Ada", student_id="s1")
+    library.process_issue(member.get_member_id(), "111")
+    library.compact()
+    library.process_restock("111", 3)
+    for columnar in (True, False):
+        book = LibrarySystem(data_dir, columnar=columnar).get_book("111")
+        assert (book.get_total_quantity(), book.get_available_quantity()) == (5, 4)
+
+
+def test_books_are_slotted():
+    assert not hasattr(Book("Dune", "Frank Herbert", "111", 1), "__dict__")
@@ -0,0 +1,50 @@
+import os
+
+import pytest
+
+from library_system import LibrarySystem, main
+
+
+def snapshot(data_dir):
+    return {name: os.path.getmtime(os.path.join(data_dir, name)) for name in sorted(os.listdir(data_dir))}
+
+
+def test_fsck_without_repair_leaves_the_data_files_alone(tmp_path):
+    data_dir = str(tmp_path)
+    library = LibrarySystem(data_dir)
+    library.process_add_book("Dune", "Frank Herbert", "111", 2)
+    before = snapshot(data_dir)
+    assert os.path.getsize(os.path.join(data_dir, "journal.log")) > 0
+    main(["--data-dir", data_dir, "fsck", "--workers", "1"])
+    assert snapshot(data_dir) == before
+
+
+def test_fsck_repair_compacts_the_journal(tmp_path):
+    data_dir = str(tmp_path)
+    LibrarySystem(data_dir).process_add_book("Dune", "Frank Herbert", "111", 2)
+    main(["--data-dir", data_dir, "fsck", "--repair", "--workers", "1"])
+    assert os.path.getsize(os.path.join(data_dir, "journal.log")) == 0
+
+
+def test_check_without_repair_takes_no_lock(tmp_path, monkeypatch):
+    library = LibrarySystem(str(tmp_path))
+    library.process_add_book("Dune", "Frank Herbert", "111", 2)
+
+    def locked(refresh=True):
+        raise AssertionError("a read-only check took the writer lock")
+
+    monkeypatch.setattr(library._storage, "locked", locked)
+    assert library.check_integrity(workers=1)["ok"]
+    with pytest.raises(AssertionError):
+        library.check_integrity(repair=True, workers=1)
+
+
+def test_forked_check_waits_for_the_background_index(tmp_path):
+    data_dir = str(tmp_path)
+    with LibrarySystem(data_dir).batch() as library:
+        for i in range(4):
+            library.process_add_book(f"Book {i}", "Author", f"isbn-{i}", 1)
+    library = LibrarySystem(data_dir)
+    report = library.check_integrity(workers=2, chunk_size=1)
+    assert report["ok"] and report["checked"]["books"] == 4
+    assert library._search_index._thread is None
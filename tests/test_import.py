@@ -0,0 +1,56 @@
+import library_system
+from library_system import LibrarySystem, ReplicaStorage, SQLiteStorage
+
+CATALOG = """title,author,isbn,quantity
+Dune,Frank Herbert,111,2
+Emma,Jane Austen,222,3
+Dune,Frank Herbert,111,1
+"""
+
+
+def write_catalog(tmp_path):
+    path = tmp_path / "catalog.csv"
+    path.write_text(CATALOG)
+    return str(path)
+
+
+def test_import_is_compacted_into_the_snapshots(tmp_path):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    library = LibrarySystem(str(data_dir))
+    result = library.import_catalog(write_catalog(tmp_path), workers=1)
+    assert (result["added"], result["merged"]) == (2, 1)
+    assert (data_dir / "journal.log").read_text() == ""
+    reopened = LibrarySystem(str(data_dir))
+    assert reopened.get_book("111").get_total_quantity() == 3
+    assert reopened.get_book("222").get_total_quantity() == 3
+
+
+def test_import_under_sqlite_commits_before_compacting(tmp_path):
+    library = LibrarySystem(storage=SQLiteStorage(str(tmp_path / "library.db")))
+    library.import_catalog(write_catalog(tmp_path), workers=1)
+    reopened = LibrarySystem(storage=SQLiteStorage(str(tmp_path / "library.db")))
+    assert reopened.get_book("111").get_available_quantity() == 3
+
+
+def test_import_is_published_to_replicas(tmp_path):
+    data_dir = str(tmp_path)
+    library = LibrarySystem(data_dir, change_stream=True)
+    replica = LibrarySystem(data_dir, storage=ReplicaStorage(data_dir))
+    library.import_catalog(write_catalog(tmp_path), workers=1)
+    replica.refresh()
+    assert replica.get_book("222").get_total_quantity() == 3
+
+
+def test_import_validates_in_worker_processes_that_are_not_forked(tmp_path, monkeypatch):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    library = LibrarySystem(str(data_dir))
+    contexts = []
+    pool = library_system.ProcessPoolExecutor
+    monkeypatch.setattr(library_system, "ProcessPoolExecutor",
+                        lambda **kwargs: contexts.append(kwargs["mp_context"]) or pool(**kwargs))
+    result = library.import_catalog(write_catalog(tmp_path), workers=2, chunk_size=1)
+    assert (result["rows"], result["added"], result["merged"]) == (3, 2, 1)
+    assert [context.get_start_method() for context in contexts] in (["forkserver"], ["spawn"])
+    assert library.get_book("111").get_total_quantity() == 3
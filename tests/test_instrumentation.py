@@ -0,0 +1,48 @@
+import pytest
+
+from library_system import Book, BookNotFoundError, Instrumentation, LibrarySystem
+
+
+def test_operations_and_journal_bytes_are_counted(tmp_path):
+    stats_path = tmp_path / "stats.prom"
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    library = LibrarySystem(str(data_dir), instrumentation=Instrumentation(str(stats_path)))
+    library.process_add_book("Dune", "Frank Herbert", "111", 2)
+    with pytest.raises(BookNotFoundError):
+        library.process_restock("222", 1)
+    library.compact()
+    stats = library.get_stats()
+    assert stats["operations"]["process_add_book"]["calls"] == 1
+    assert stats["operations"]["process_restock"]["failures"] == 1
+    assert stats["operations"]["storage_persist"]["calls"] == 1
+    assert stats["operations"]["storage_compact"]["calls"] == 1
+    assert stats["bytes_written"]["journal"] > 0
+    assert "search_book" not in stats["operations"]
+    assert "batch" not in stats["operations"]
+    library._instrumentation.dump()
+    assert 'operation="process_add_book"' in stats_path.read_text()
+
+
+def test_loading_and_maintenance_operations_are_timed(tmp_path):
+    LibrarySystem(str(tmp_path)).process_add_book("Dune", "Frank Herbert", "111", 2)
+    library = LibrarySystem(str(tmp_path), instrumentation=Instrumentation())
+    library.check_integrity(workers=1)
+    library.page_books()
+    library.get_overdue_loans()
+    library.compact()
+    operations = library.get_stats()["operations"]
+    assert operations["load"]["calls"] == 1
+    # The journaled book is validated once while it is replayed.
+    assert operations["load_from_dict"]["calls"] == 1
+    for name in ("check_integrity", "page_books", "get_overdue_loans", "compact"):
+        assert operations[name]["calls"] == 1
+    Book.from_dict({"title": "Dune", "author": "Frank Herbert", "isbn": "111", "total_quantity": 1,
+                    "available_quantity": 1})
+    assert library.get_stats()["operations"]["load_from_dict"]["calls"] == 1
+
+
+def test_instrumentation_false_overrides_the_environment(tmp_path, monkeypatch):
+    monkeypatch.setenv("LIBRARY_STATS", str(tmp_path / "stats.prom"))
+    assert LibrarySystem(str(tmp_path)).get_stats() is not None
+    assert LibrarySystem(str(tmp_path), instrumentation=False).get_stats() is None
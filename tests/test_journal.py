@@ -0,0 +1,58 @@
+import json
+import os
+
+import pytest
+
+from library_system import LibrarySystem
+
+
+def test_mutations_are_journaled_and_replayed(tmp_path):
+    data_dir = str(tmp_path)
+    library = LibrarySystem(data_dir)
+    library.process_add_book("Dune", "Frank Herbert", "111", 2)
+    member = library.process_add_member("student", "Ada", student_id="s1")
+    library.process_issue(member.get_member_id(), "111")
+    with open(os.path.join(data_dir, "journal.log")) as f:
+        assert [json.loads(line)["op"] for line in f] == ["add_book", "add_member", "issue"]
+    reopened = LibrarySystem(data_dir)
+    assert reopened.get_book("111").get_available_quantity() == 1
+    assert [isbn for isbn, _ in reopened.get_loans(member.get_member_id())] == ["111"]
+
+
+def test_failed_journal_write_raises_and_is_undone(tmp_path, monkeypatch):
+    data_dir = str(tmp_path)
+    library = LibrarySystem(data_dir)
+    library.process_add_book("Dune", "Frank Herbert", "111", 2)
+    size = os.path.getsize(os.path.join(data_dir, "journal.log"))
+
+    def fail(fd):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(os, "fsync", fail)
+    with pytest.raises(OSError):
+        library.process_add_book("Emma", "Jane Austen", "222", 1)
+    monkeypatch.undo()
+    assert "222" not in library._books
+    assert os.path.getsize(os.path.join(data_dir, "journal.log")) == size
+    assert "222" not in LibrarySystem(data_dir)._books
+
+
+def test_failed_save_without_journal_keeps_the_change_in_the_journal(tmp_path, monkeypatch):
+    data_dir = str(tmp_path)
+    journal = os.path.join(data_dir, "journal.log")
+    library = LibrarySystem(data_dir, use_journal=False)
+    library.process_add_book("Dune", "Frank Herbert", "111", 2)
+    assert os.path.getsize(journal) == 0
+
+    def fail(source, target):
+        raise OSError("disk full")
+
+    # The change is committed once journaled; the snapshots catch up with it later.
+    monkeypatch.setattr(os, "replace", fail)
+    library.process_add_book("Emma", "Jane Austen", "222", 1)
+    monkeypatch.undo()
+    assert "222" in library._books
+    assert os.path.getsize(journal) > 0
+    reopened = LibrarySystem(data_dir, use_journal=False)
+    assert set(reopened._books) == {"111", "222"}
+    assert os.path.getsize(journal) == 0
@@ -0,0 +1,24 @@
+import pytest
+
+from library_system import CatalogStorage, LibrarySystem, ReadOnlyCatalogError
+
+
+def test_kiosk_follows_the_journal_and_compaction(tmp_path):
+    data_dir = str(tmp_path)
+    desk = LibrarySystem(data_dir)
+    desk.process_add_book("Dune", "Frank Herbert", "111", 2)
+    desk.compact()
+    kiosk = LibrarySystem(storage=CatalogStorage(data_dir))
+    member = desk.process_add_member("student", "Ada", student_id="s1")
+    desk.process_issue(member.get_member_id(), "111")
+    desk.process_add_book("Emma", "Jane Austen", "222", 1)
+    kiosk.refresh()
+    assert kiosk.get_book("111").get_available_quantity() == 1
+    assert [book.get_isbn() for book in kiosk.find_books("emma")] == ["222"]
+    desk.compact()
+    desk.process_restock("222", 2)
+    kiosk.refresh()
+    assert kiosk.get_book("222").get_total_quantity() == 3
+    assert len(kiosk._books) == 2
+    with pytest.raises(ReadOnlyCatalogError):
+        kiosk.process_add_book("Ulysses", "James Joyce", "333", 1)
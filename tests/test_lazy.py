@@ -0,0 +1,27 @@
+import os
+
+from benchmark import write_dataset
+from library_system import LibrarySystem
+
+
+def isbns(books):
+    return [book.get_isbn() for book in books]
+
+
+def test_lazy_desk_persists_and_searches_like_a_full_one(tmp_path):
+    data_dir = str(tmp_path)
+    write_dataset(data_dir, 500, 40, 60)
+    lazy = LibrarySystem(data_dir, lazy=True)
+    title = lazy.get_book(sorted(LibrarySystem(data_dir)._books)[3]).get_title()
+    word = title.split()[0]
+    lazy.process_add_book(f"{word} Companion", "New Author", "NEW-1", 2)
+    member_id = next(iter(lazy._members))
+    lazy.process_issue(member_id, "NEW-1")
+    full = LibrarySystem(data_dir)
+    assert isbns(lazy.find_books(word, 20)) == isbns(full.find_books(word, 20))
+    lazy.compact()
+    assert os.path.getsize(os.path.join(data_dir, "journal.log")) == 0
+    reopened = LibrarySystem(data_dir, lazy=True)
+    assert reopened.get_book("NEW-1").get_available_quantity() == 1
+    assert isbns(reopened.find_books(word, 20)) == isbns(full.find_books(word, 20))
+    assert "NEW-1" in [isbn for isbn, _ in reopened.get_loans(member_id)]
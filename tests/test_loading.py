@@ -0,0 +1,24 @@
+from benchmark import write_dataset
+from library_system import JsonStorage, LibrarySystem
+
+
+def state(library):
+    return ({isbn: book.to_dict() for isbn, book in library._books.items()},
+            {member_id: member.to_dict() for member_id, member in library._members.items()},
+            {member_id: library.get_loans(member_id) for member_id in library._issued_books})
+
+
+def test_streaming_and_trusted_loads_match_a_plain_load(tmp_path):
+    data_dir = str(tmp_path)
+    write_dataset(data_dir, 300, 50, 80)
+    expected = state(LibrarySystem(storage=JsonStorage(data_dir, streaming=False)))
+    assert state(LibrarySystem(storage=JsonStorage(data_dir))) == expected
+    assert state(LibrarySystem(storage=JsonStorage(data_dir, trusted=True))) == expected
+
+
+def test_search_waits_for_the_background_index(tmp_path):
+    data_dir = str(tmp_path)
+    write_dataset(data_dir, 300, 0, 0)
+    library = LibrarySystem(data_dir)
+    book = library._books[sorted(library._books)[7]]
+    assert book.get_isbn() in [found.get_isbn() for found in library.find_books(book.get_title())]
@@ -0,0 +1,22 @@
+import pytest
+
+from library_system import DuplicateStudentIdError, LibrarySystem, SQLiteStorage
+
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_member_indexes_are_rebuilt_on_reopen(tmp_path, backend):
+    def open_library():
+        if backend == "sqlite":
+            return LibrarySystem(storage=SQLiteStorage(str(tmp_path / "library.db")))
+        return LibrarySystem(str(tmp_path))
+
+    library = open_library()
+    student = library.process_add_member("student", "Ada", student_id="s1")
+    first = library.process_add_member("faculty", "Grace", department="Computer Science")
+    second = library.process_add_member("faculty", "Alan", department="computer science ")
+    reopened = open_library()
+    assert reopened.find_member_by_student_id("s1").get_member_id() == student.get_member_id()
+    assert [member.get_member_id() for member in reopened.get_members_by_department("COMPUTER SCIENCE")] == \
+        [first.get_member_id(), second.get_member_id()]
+    with pytest.raises(DuplicateStudentIdError):
+        reopened.process_add_member("student", "Eve", student_id="s1")
@@ -0,0 +1,63 @@
+import json
+from datetime import date
+
+import pytest
+
+from library_system import LibrarySystem, SQLiteStorage
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def open_library(request, tmp_path):
+    if request.param == "sqlite":
+        return lambda: LibrarySystem(storage=SQLiteStorage(str(tmp_path / "library.db")))
+    return lambda: LibrarySystem(str(tmp_path))
+
+
+def test_nightly_pass_reports_each_loan_once_across_restarts(open_library):
+    library = open_library()
+    library.process_add_book("Dune", "Frank Herbert", "111", 2)
+    member = library.process_add_member("faculty", "Grace", department="Physics")
+    library.process_issue(member.get_member_id(), "111", due_date="2026-01-01")
+    as_of = date(2026, 2, 1)
+    assert [loan["due_date"] for loan in library.get_overdue_loans(as_of, new_only=True)] == ["2026-01-01"]
+    library = open_library()
+    assert library.get_overdue_loans(as_of, new_only=True) == []
+    # A loan issued already past due is still new to the next pass.
+    library.process_issue(member.get_member_id(), "111", due_date="2025-12-01")
+    assert [loan["due_date"] for loan in open_library().get_overdue_loans(as_of, new_only=True)] == ["2025-12-01"]
+    assert len(open_library().get_overdue_loans(as_of)) == 2
+
+
+def test_hold_is_served_when_a_copy_comes_back(open_library):
+    library = open_library()
+    library.process_add_book("Dune", "Frank Herbert", "111", 1)
+    ada = library.process_add_member("student", "Ada", student_id="s1")
+    grace = library.process_add_member("faculty", "Grace", department="Physics")
+    library.process_issue(ada.get_member_id(), "111")
+    assert library.process_place_hold(grace.get_member_id(), "111") == 1
+    library.process_return(ada.get_member_id(), "111")
+    reopened = open_library()
+    assert [isbn for isbn, _ in reopened.get_loans(grace.get_member_id())] == ["111"]
+    assert not reopened.get_book("111").get_holds()
+
+
+def test_nightly_pass_saves_only_what_changed(tmp_path):
+    library = LibrarySystem(str(tmp_path))
+    library.process_add_book("Dune", "Frank Herbert", "111", 3)
+    member = library.process_add_member("faculty", "Grace", department="Physics")
+    for due_date in ("2026-01-01", "2026-01-01", "2026-01-02"):
+        library.process_issue(member.get_member_id(), "111", due_date=due_date)
+    # Both copies due on the same day are listed, and reported, once each.
+    assert [loan["due_date"] for loan in library.get_overdue_loans(date(2026, 2, 1))] == ["2026-01-01"] * 2 + ["2026-01-02"]
+    assert len(library.get_overdue_loans(date(2026, 1, 2), new_only=True)) == 2
+    assert len(library.get_overdue_loans(date(2026, 2, 1), new_only=True)) == 1
+    # The second pass appended its one loan instead of rewriting the first pass's.
+    lines = [json.loads(line) for line in (tmp_path / "overdue.json").read_text().splitlines()]
+    assert [line["drained"] for line in lines] == [[["2026-01-01", member.get_member_id(), "111", 2]],
+                                                   [["2026-01-02", member.get_member_id(), "111", 1]]]
+    library.process_return(member.get_member_id(), "111")
+    library.get_overdue_loans(date(2026, 2, 2), new_only=True)
+    reopened = LibrarySystem(str(tmp_path))
+    assert reopened._storage.load_overdue_cursor()["drained"] == [["2026-01-01", member.get_member_id(), "111", 1],
+                                                                 ["2026-01-02", member.get_member_id(), "111", 1]]
+    assert reopened.get_overdue_loans(date(2026, 3, 1), new_only=True) == []
@@ -0,0 +1,114 @@
+import json
+import os
+
+import library_storage
+from library_system import LibrarySystem, ReplicaStorage
+
+
+def open_replica(data_dir):
+    return LibrarySystem(data_dir, storage=ReplicaStorage(data_dir))
+
+
+def stream_seqs(data_dir):
+    with open(os.path.join(data_dir, "changes.log")) as f:
+        return [json.loads(line)["seq"] for line in f]
+
+
+def count_bootstraps(replica, monkeypatch):
+    bootstraps = []
+    storage = replica._storage
+    bootstrap = storage._bootstrap
+    monkeypatch.setattr(storage, "_bootstrap", lambda: bootstraps.append(1) or bootstrap())
+    return bootstraps
+
+
+def test_replica_bootstraps_and_follows_every_kind_of_change(tmp_path):
+    data_dir = str(tmp_path)
+    desk = LibrarySystem(data_dir, change_stream=True)
+    desk.process_add_book("Dune", "Frank Herbert", "111", 2)
+    replica = open_replica(data_dir)
+    assert replica.get_book("111").get_available_quantity() == 2
+    member = desk.process_add_member("student", "Ada", student_id="s1")
+    desk.process_add_book("Emma", "Jane Austen", "222", 1)
+    desk.process_issue(member.get_member_id(), "111")
+    desk.process_issue(member.get_member_id(), "222")
+    desk.process_return(member.get_member_id(), "222")
+    replica.refresh()
+    assert replica.get_member(member.get_member_id()).get_name() == "Ada"
+    assert replica.get_book("111").get_available_quantity() == 1
+    assert replica.get_book("222").get_available_quantity() == 1
+    assert [isbn for isbn, _ in replica.get_loans(member.get_member_id())] == ["111"]
+    assert replica._storage.get_seq() == stream_seqs(data_dir)[-1]
+
+
+def test_replica_follows_a_rotation_without_reloading(tmp_path, monkeypatch):
+    data_dir = str(tmp_path)
+    monkeypatch.setattr(library_storage, "CHANGES_ROTATE_SIZE", 0)
+    desk = LibrarySystem(data_dir, change_stream=True)
+    desk.process_add_book("Dune", "Frank Herbert", "111", 2)
+    replica = open_replica(data_dir)
+    bootstraps = count_bootstraps(replica, monkeypatch)
+    desk.process_add_book("Emma", "Jane Austen", "222", 1)
+    desk.compact()
+    desk.process_restock("222", 1)
+    replica.refresh()
+    assert replica.get_book("222").get_total_quantity() == 2
+    assert not bootstraps
+
+
+def test_replica_reloads_after_a_seq_gap(tmp_path, monkeypatch):
+    data_dir = str(tmp_path)
+    monkeypatch.setattr(library_storage, "CHANGES_ROTATE_SIZE", 0)
+    desk = LibrarySystem(data_dir, change_stream=True)
+    desk.process_add_book("Dune", "Frank Herbert", "111", 2)
+    replica = open_replica(data_dir)
+    bootstraps = count_bootstraps(replica, monkeypatch)
+    # Two rotations between refreshes: the middle file, and the events in it, are never read.
+    for isbn in ("222", "333"):
+        desk.process_add_book("Emma", "Jane Austen", isbn, 1)
+        desk.compact()
+    desk.process_restock("333", 1)
+    replica.refresh()
+    assert bootstraps == [1]
+    assert replica.get_book("222").get_total_quantity() == 1
+    assert replica.get_book("333").get_total_quantity() == 2
+
+
+def test_short_writes_are_completed(tmp_path, monkeypatch):
+    data_dir = str(tmp_path)
+    desk = LibrarySystem(data_dir, change_stream=True)
+    write = os.write
+    monkeypatch.setattr(os, "write", lambda fd, data: write(fd, data[:max(1, len(data) // 2)]))
+    with desk.batch():
+        desk.process_add_book("Dune", "Frank Herbert", "111", 2)
+        desk.process_add_book("Emma", "Jane Austen", "222", 1)
+    monkeypatch.undo()
+    seqs = stream_seqs(data_dir)
+    assert seqs == list(range(seqs[0], seqs[0] + 3))
+
+
+def test_failed_publish_sends_replicas_back_to_the_snapshots(tmp_path, monkeypatch):
+    data_dir = str(tmp_path)
+    desk = LibrarySystem(data_dir, change_stream=True)
+    desk.process_add_book("Dune", "Frank Herbert", "111", 2)
+    replica = open_replica(data_dir)
+    bootstraps = count_bootstraps(replica, monkeypatch)
+    write = os.write
+
+    def fail(fd, data):
+        write(fd, data[:5])
+        raise OSError("disk full")
+
+    monkeypatch.setattr(os, "write", fail)
+    # The change is committed to the journal, so it is not reported as failed.
+    desk.process_add_book("Emma", "Jane Austen", "222", 1)
+    monkeypatch.setattr(os, "write", write)
+    desk.process_restock("222", 1)
+    replica.refresh()
+    assert bootstraps == [1]
+    assert replica.get_book("222").get_total_quantity() == 2
+    # The torn line was cut off, and the stream restarted past the unpublished change.
+    with open(os.path.join(data_dir, "changes.log")) as f:
+        lines = [json.loads(line) for line in f]
+    assert [line["op"] for line in lines] == ["checkpoint", "restock"]
+    assert lines[1]["seq"] == lines[0]["seq"] + 1
@@ -0,0 +1,62 @@
+from library_system import LibrarySystem, SQLiteStorage
+
+
+def add_books(library):
+    with library.batch():
+        library.process_add_book("Sapiens", "Yuval Noah Harari", "111", 1)
+        library.process_add_book("Homo Deus", "Yuval Noah Harari", "222", 1)
+        library.process_add_book("Dune", "Frank Herbert", "333", 1)
+
+
+def isbns(books):
+    return [book.get_isbn() for book in books]
+
+
+def test_lazy_fuzzy_search_uses_the_token_index_vocabulary(tmp_path):
+    add_books(LibrarySystem(str(tmp_path)))
+    LibrarySystem(str(tmp_path)).compact()
+    lazy = LibrarySystem(str(tmp_path), lazy=True)
+    assert isbns(lazy.find_books("Harrari", fuzzy=True)) == ["222", "111"]
+    vocabulary = lazy._search_index._tokens.vocabulary()
+    lazy.find_books("Herbet", fuzzy=True)
+    assert lazy._search_index._tokens.vocabulary() is vocabulary
+    # Books added since books.tok was written are matched too.
+    lazy.process_add_book("Sapiens Graphic", "Yuval Noah Harari", "444", 1)
+    assert isbns(lazy.find_books("Harrari", fuzzy=True)) == ["222", "111", "444"]
+
+
+def test_sqlite_fuzzy_search_keeps_its_vocabulary_current(tmp_path):
+    library = LibrarySystem(storage=SQLiteStorage(str(tmp_path / "library.db")))
+    add_books(library)
+    assert isbns(library.find_books("Herbet", fuzzy=True)) == ["333"]
+    library.process_add_book("Frankenstein", "Mary Shelley", "555", 1)
+    assert isbns(library.find_books("Shely", fuzzy=True)) == ["555"]
+
+
+def test_search_ranks_prefix_matches_after_a_reopen(tmp_path):
+    add_books(LibrarySystem(str(tmp_path)))
+    library = LibrarySystem(str(tmp_path))
+    library.process_add_book("Harari Reader", "Various", "97801X", 1)
+    assert isbns(library.find_books("harar")) == ["97801X", "222", "111"]
+    assert isbns(library.find_books("homo de")) == ["222"]
+    assert isbns(library.find_books("97801x")) == ["97801X"]
+
+
+def test_isbn_hit_is_ranked_ahead_of_the_word_matches(tmp_path):
+    library = LibrarySystem(str(tmp_path))
+    add_books(library)
+    library.process_add_book("1984", "George Orwell", "1984", 1)
+    library.process_add_book("Nineteen", "1984 Society", "444", 1)
+    library.process_add_book("1984 Annotated", "Various", "555", 1)
+    assert isbns(library.find_books("1984")) == ["1984", "555", "444"]
+    assert isbns(library.find_books("1984", 2, 1)) == ["555", "444"]
+    assert isbns(library.find_books("1984", 1, 2)) == ["444"]
+
+
+def test_restocking_does_not_reindex_the_book(tmp_path):
+    library = LibrarySystem(str(tmp_path))
+    add_books(library)
+    assert isbns(library.find_books("dun")) == ["333"]
+    library.process_restock("333", 2)
+    assert not library._search_index._pending
+    assert isbns(library.find_books("dun")) == ["333"]
@@ -0,0 +1,92 @@
+import asyncio
+import json
+import os
+import threading
+
+import pytest
+
+import library_storage
+from library_server import LibraryServer
+from library_system import LibrarySystem
+
+
+def get(server, target):
+    return asyncio.run(server._dispatch("GET", target, b""))
+
+
+@pytest.mark.parametrize("target", ["/books?limit=0", "/books?q=dune&limit=-1", "/members?limit=0",
+                                    "/analytics?top=0"])
+def test_counts_below_one_are_rejected(tmp_path, target):
+    server = LibraryServer(LibrarySystem(str(tmp_path)))
+    status, body = get(server, target)
+    assert status == 400
+    assert "at least 1" in body["error"]
+
+
+def test_page_size_below_one_is_rejected(tmp_path):
+    library = LibrarySystem(str(tmp_path))
+    with pytest.raises(ValueError):
+        library.page_books(limit=0)
+
+
+def post_books(server, count, start=0):
+    async def run():
+        await server.start()
+        try:
+            return await asyncio.gather(*(server._dispatch("POST", "/books", json.dumps(
+                {"title": f"Book {i}", "author": "Author", "isbn": f"isbn-{i}", "quantity": 1}).encode())
+                for i in range(start, start + count)))
+        finally:
+            await server.close()
+    return asyncio.run(run())
+
+
+def test_concurrent_writes_are_group_committed_and_persisted(tmp_path):
+    server = LibraryServer(LibrarySystem(str(tmp_path)), port=0)
+    responses = post_books(server, 20)
+    assert {status for status, _ in responses} == {201}
+    assert server._stats["groups"] < 20
+    assert len(LibrarySystem(str(tmp_path))._books) == 20
+
+
+def test_failed_group_write_is_reported_and_rolled_back(tmp_path, monkeypatch):
+    library = LibrarySystem(str(tmp_path))
+    server = LibraryServer(library, port=0)
+
+    def fail(fd):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(os, "fsync", fail)
+    responses = post_books(server, 3)
+    monkeypatch.undo()
+    assert {status for status, _ in responses} == {500}
+    assert not library._books
+    assert not LibrarySystem(str(tmp_path))._books
+
+
+def test_lazy_server_compacts_on_the_event_loop(tmp_path, monkeypatch):
+    data_dir = str(tmp_path)
+    seed = LibrarySystem(data_dir)
+    seed.process_add_book("Dune", "Frank Herbert", "111", 1)
+    seed.compact()
+    monkeypatch.setattr(library_storage, "JOURNAL_COMPACT_THRESHOLD", 5)
+    reopened = []
+    reopen = library_storage.LazyStore.reopen
+    monkeypatch.setattr(library_storage.LazyStore, "reopen",
+                        lambda store, index: reopened.append(threading.current_thread()) or reopen(store, index))
+    server = LibraryServer(LibrarySystem(data_dir, lazy=True), port=0)
+
+    async def run():
+        await server.start()
+        try:
+            return await asyncio.gather(*(request for i in range(20) for request in (
+                server._dispatch("POST", "/books", json.dumps(
+                    {"title": f"Book {i}", "author": "Author", "isbn": f"isbn-{i}", "quantity": 1}).encode()),
+                server._dispatch("GET", "/books/111", b""))))
+        finally:
+            await server.close()
+
+    responses = asyncio.run(run())
+    assert {status for status, _ in responses} == {200, 201}
+    assert reopened and set(reopened) == {threading.main_thread()}
+    assert len(LibrarySystem(data_dir)._books) == 21
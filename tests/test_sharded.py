@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+from library_system import CatalogStorage, JsonStorage, LibrarySystem, OutOfStockError, ReplicaStorage, ShardedStorage
+
+
+def test_unsharded_storages_refuse_a_sharded_directory(tmp_path):
+    data_dir = str(tmp_path)
+    library = LibrarySystem(data_dir)
+    library.process_add_book("Dune", "Frank Herbert", "111", 2)
+    library.compact()
+    LibrarySystem(storage=ShardedStorage(data_dir, shards=2))
+    for storage in (JsonStorage(data_dir), CatalogStorage(data_dir), ReplicaStorage(data_dir)):
+        with pytest.raises(ValueError, match="split into shards"):
+            LibrarySystem(storage=storage)
+
+
+def journal_sizes(storage):
+    return [os.path.getsize(shard._journal_file) if os.path.exists(shard._journal_file) else 0
+            for shard in storage._storages]
+
+
+def test_failed_journal_write_is_cut_back_on_every_shard(tmp_path, monkeypatch):
+    data_dir = str(tmp_path)
+    storage = ShardedStorage(data_dir, shards=2)
+    library = LibrarySystem(storage=storage)
+    with library.batch():
+        for i in range(4):
+            library.process_add_book(f"Book {i}", "Author", f"isbn-{i}", 1)
+    sizes = journal_sizes(storage)
+    seq = storage._seq
+    append = storage._append_journal
+
+    def fail_on_shard_1(shard, lines):
+        size = append(shard, lines)
+        if shard == 1:
+            raise OSError("disk full")
+        return size
+
+    monkeypatch.setattr(storage, "_append_journal", fail_on_shard_1)
+    # One new book for each shard, so the write spans both journals.
+    isbns = {storage.book_shard(f"isbn-{i}"): f"isbn-{i}" for i in range(4, 40)}
+    with pytest.raises(OSError):
+        with library.batch():
+            for isbn in isbns.values():
+                library.process_add_book("New", "Author", isbn, 1)
+    assert journal_sizes(storage) == sizes
+    assert storage._seq == seq
+    assert len(library._books) == 4
+    monkeypatch.undo()
+    library.process_add_book("Book 99", "Author", "isbn-99", 1)
+    assert storage._seq == seq + 1
+    assert len(LibrarySystem(storage=ShardedStorage(data_dir, shards=2))._books) == 5
+
+
+def test_shared_sharded_desks_see_each_others_changes(tmp_path):
+    data_dir = str(tmp_path)
+    first = LibrarySystem(data_dir, shared=True, shards=2)
+    second = LibrarySystem(data_dir, shared=True, shards=2)
+    first.process_add_book("Dune", "Frank Herbert", "111", 1)
+    member = first.process_add_member("student", "Ada", student_id="s1")
+    other = second.process_add_member("student", "Grace", student_id="s2")
+    assert other.get_member_id() != member.get_member_id()
+    second.process_issue(other.get_member_id(), "111")
+    # The first desk replays the shard journals before checking the stock.
+    with pytest.raises(OutOfStockError):
+        first.process_issue(member.get_member_id(), "111")
+    first.compact()
+    # After the other desk compacted, the second one reloads the snapshots rather than the journals.
+    second.process_return(other.get_member_id(), "111")
+    first.refresh()
+    assert first.get_book("111").get_available_quantity() == 1
+    assert first.get_loans(other.get_member_id()) == []
+    first.close()
+    second.close()
+    third = LibrarySystem(data_dir, shards=2)
+    assert third.get_book("111").get_available_quantity() == 1
+    assert third.get_member(other.get_member_id()).get_name() == "Grace"
+    third.close()
@@ -0,0 +1,21 @@
+import pytest
+
+from library_system import LibrarySystem, OutOfStockError
+
+
+def test_desks_see_each_others_changes(tmp_path):
+    data_dir = str(tmp_path)
+    first = LibrarySystem(data_dir, shared=True)
+    second = LibrarySystem(data_dir, shared=True)
+    first.process_add_book("Dune", "Frank Herbert", "111", 1)
+    member = first.process_add_member("student", "Ada", student_id="s1")
+    other = second.process_add_member("student", "Grace", student_id="s2")
+    assert other.get_member_id() != member.get_member_id()
+    second.process_issue(other.get_member_id(), "111")
+    # The first desk catches up before checking the stock, so the last copy is not issued twice.
+    with pytest.raises(OutOfStockError):
+        first.process_issue(member.get_member_id(), "111")
+    first.compact()
+    second.refresh()
+    assert second.get_book("111").get_available_quantity() == 0
+    assert LibrarySystem(data_dir, shared=True).get_member(other.get_member_id()).get_name() == "Grace"
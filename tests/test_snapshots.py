@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+import library_storage
+from library_system import LibrarySystem
+
+
+def stamp(path):
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def test_compaction_rewrites_only_the_changed_snapshots(tmp_path):
+    data_dir = str(tmp_path)
+    library = LibrarySystem(data_dir)
+    library.process_add_book("Dune", "Frank Herbert", "111", 2)
+    library.process_add_member("student", "Ada", student_id="s1")
+    library.compact()
+    members = stamp(os.path.join(data_dir, "members.json"))
+    library.process_add_book("Emma", "Jane Austen", "222", 1)
+    library.compact()
+    assert stamp(os.path.join(data_dir, "members.json")) == members
+    assert "222" in LibrarySystem(data_dir)._books
+
+
+def test_failed_snapshot_write_keeps_the_journal(tmp_path, monkeypatch):
+    data_dir = str(tmp_path)
+    library = LibrarySystem(data_dir)
+    library.process_add_book("Dune", "Frank Herbert", "111", 2)
+    library.compact()
+    library.process_add_book("Emma", "Jane Austen", "222", 1)
+
+    def fail(source, target):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(os, "replace", fail)
+    with pytest.raises(OSError):
+        library.compact()
+    monkeypatch.undo()
+    assert os.path.getsize(os.path.join(data_dir, "journal.log")) > 0
+    assert set(LibrarySystem(data_dir)._books) == {"111", "222"}
+
+
+def test_failed_save_leaves_every_snapshot_as_it_was(tmp_path, monkeypatch):
+    data_dir = str(tmp_path)
+    library = LibrarySystem(data_dir)
+    library.process_add_book("Dune", "Frank Herbert", "111", 2)
+    member = library.process_add_member("student", "Ada", student_id="s1")
+    library.compact()
+    library.process_issue(member.get_member_id(), "111")
+    books = stamp(os.path.join(data_dir, "books.json"))
+    write = library_storage._write_json_atomic
+
+    def fail_on_loans(path, data, compact=False):
+        if "issued_books" in path:
+            raise OSError("disk full")
+        return write(path, data, compact)
+
+    # The books are written first, but they must not replace books.json while the loans cannot be saved.
+    monkeypatch.setattr(library_storage, "_write_json_atomic", fail_on_loans)
+    with pytest.raises(OSError):
+        library.compact()
+    monkeypatch.undo()
+    assert stamp(os.path.join(data_dir, "books.json")) == books
+    assert not [name for name in os.listdir(data_dir) if name.endswith((".new", ".tmp"))]
+    library.compact()
+    assert LibrarySystem(data_dir).get_book("111").get_available_quantity() == 1
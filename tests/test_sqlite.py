@@ -0,0 +1,40 @@
+import pytest
+
+from library_system import LibrarySystem, SQLiteStorage, migrate_json_to_sqlite
+
+
+def test_migration_copies_books_members_and_loans(tmp_path):
+    source = LibrarySystem(str(tmp_path))
+    source.process_add_book("Dune", "Frank Herbert", "111", 2)
+    member = source.process_add_member("faculty", "Grace", department="Physics")
+    source.process_issue(member.get_member_id(), "111", due_date="2026-01-01")
+    migrate_json_to_sqlite(str(tmp_path), str(tmp_path / "library.db"))
+    library = LibrarySystem(storage=SQLiteStorage(str(tmp_path / "library.db")))
+    assert library.get_book("111").get_available_quantity() == 1
+    assert library.get_loans(member.get_member_id()) == [("111", "2026-01-01")]
+    assert [m.get_name() for m in library.get_members_by_department("physics")] == ["Grace"]
+
+
+def test_desks_sharing_a_database_see_each_others_writes(tmp_path):
+    path = str(tmp_path / "library.db")
+    first = LibrarySystem(storage=SQLiteStorage(path))
+    second = LibrarySystem(storage=SQLiteStorage(path))
+    first.process_add_book("Dune", "Frank Herbert", "111", 1)
+    member = second.process_add_member("student", "Ada", student_id="s1")
+    second.process_issue(member.get_member_id(), "111")
+    assert first.get_book("111").get_available_quantity() == 0
+    assert first.get_borrowers("111")[0][0].get_name() == "Ada"
+
+
+def test_failed_batch_rolls_back_without_reopening_the_database(tmp_path):
+    library = LibrarySystem(storage=SQLiteStorage(str(tmp_path / "library.db")))
+    library.process_add_book("Dune", "Frank Herbert", "111", 2)
+    connection = library._storage._conn
+    with pytest.raises(RuntimeError):
+        with library.batch():
+            library.process_add_book("Emma", "Jane Austen", "222", 1)
+            library.process_restock("111", 3)
+            raise RuntimeError("feed aborted")
+    assert library._storage._conn is connection
+    assert "222" not in library._books
+    assert library.get_book("111").get_total_quantity() == 2